@@ -0,0 +1,570 @@
+"""
+Local caching forward proxy shared by every chrome of the run (Settings.ASSET_PROXY).
+
+create_driver points each driver at it. The TLS of Settings.ASSET_PROXY_HOSTS is opened with a certificate made for
+the run, so their fingerprinted JS/CSS/font files can be served from an LRU cache kept in memory and in
+Settings.ASSET_PROXY_DIR. Other requests to those hosts are forwarded as they are, and the TLS of every other host
+(logins, APIs) is tunneled without being read. Chrome is told to accept the key of the run certificates only, with
+--ignore-certificate-errors-spki-list.
+The certificates need the cryptography package. Without it the proxy is not started and the drivers connect directly.
+"""
+import base64
+import fnmatch
+import hashlib
+import http.client
+import json
+import os
+import re
+import select
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from helpers import logger
+from settings import Settings
+
+# Headers that only apply to one connection and are not forwarded
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "proxy-authorization", "proxy-authenticate",
+                      "te", "trailer", "transfer-encoding", "upgrade"}
+# A hash of 8+ hex chars or 16+ letters and digits ending the file name, with at least one digit, e.g.
+# main-3f2a9c1d.js. Plain long names like application-bundle.js are not fingerprints
+FINGERPRINT_RE = re.compile(r"[.\-_~/](?=[0-9A-Za-z]*[0-9])([0-9a-f]{8,}|[0-9A-Za-z]{16,})(\.[a-z0-9]+)*$")
+# Vary values the cache key already covers
+CACHE_KEY_VARY = {"accept-encoding", "origin"}
+UPSTREAM_TIMEOUT = 30
+# No of secs a request waits for the same asset being fetched by another chrome
+IN_FLIGHT_TIMEOUT = 30
+
+running_proxy = None
+# Driver options of the running proxy, inherited by the bot worker processes (Settings.BOT_EXECUTION = "processes")
+DRIVER_OPTIONS_ENV = "AUTOTRACK_ASSET_PROXY"
+
+
+def is_asset_url(url) -> bool:
+    """
+    :param url: Full url of a GET request
+    :return: True if it is a fingerprinted JS/CSS/font file, whose content never changes
+    """
+    parts = urlsplit(url)
+    if parts.query and "=" in parts.query and not re.search(r"=[0-9a-f]{8,}", parts.query):
+        return False
+    path = parts.path
+    extension = path.rsplit(".", 1)[-1].lower() if "." in os.path.basename(path) else ""
+    return extension in Settings.ASSET_PROXY_EXTENSIONS and (
+        "/_next/static/" in path or bool(FINGERPRINT_RE.search(path.rsplit(".", 1)[0])))
+
+
+def get_expiry(headers, now):
+    """
+    :param headers: Dictionary of the lower case response headers
+    :param now: Time the response was received
+    :return: Time the response stops being fresh, from its max-age or Expires. None if it is immutable without
+        max-age, now if it has no freshness at all
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    match = re.search(r"(?:^|[,\s])(?:s-)?max-age=(\d+)", cache_control)
+    if match:
+        return now + int(match.group(1))
+    if "immutable" in cache_control:
+        return None
+    try:
+        return parsedate_to_datetime(headers["expires"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return now
+
+
+def is_cacheable_response(status, headers, now) -> bool:
+    """
+    :param status: HTTP status of the response
+    :param headers: Dictionary of the lower case response headers
+    :param now: Time the response was received
+    :return: True if the response can be given to the other chromes
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    all_vary = {value.strip().lower() for value in headers.get("vary", "").split(",") if value.strip()}
+    expiry = get_expiry(headers, now)
+    return (status == 200 and "set-cookie" not in headers
+            and not any(directive in cache_control for directive in ("no-store", "no-cache", "private"))
+            and all_vary <= CACHE_KEY_VARY and (expiry is None or expiry > now))
+
+
+class AssetCache:
+
+    def __init__(self, memory_bytes, disk_bytes, directory):
+        """
+        :param memory_bytes: Max size of the responses kept in memory
+        :param disk_bytes: Max size of the responses kept in the cache folder
+        :param directory: Cache folder, kept between runs
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+        # Key -> (status, headers, body, expiry), least recently used first
+        self.memory = OrderedDict()
+        self.memory_usage = 0
+        # File name -> body size, least recently used first
+        self.disk = OrderedDict()
+        self.disk_usage = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        all_files = []
+        for name in os.listdir(directory):
+            if name.endswith(".body"):
+                stat = os.stat(os.path.join(directory, name))
+                all_files.append((stat.st_atime, name[:-5], stat.st_size))
+        for _, name, size in sorted(all_files):
+            self.disk[name] = size
+            self.disk_usage += size
+
+    @staticmethod
+    def _file_name(key) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        :param key: Url and request headers the response depends on
+        :return: (status, headers, body) or None
+        """
+        now = time.time()
+        with self._lock:
+            if key in self.memory:
+                status, headers, body, expiry = self.memory[key]
+                if expiry is None or expiry > now:
+                    self.memory.move_to_end(key)
+                    return status, headers, body
+                self.memory_usage -= len(self.memory.pop(key)[2])
+            name = self._file_name(key)
+            if name not in self.disk:
+                return None
+            self.disk.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path + ".json", "r") as file:
+                meta = json.load(file)
+            # Entries written before expiries were kept, or past theirs, are fetched again
+            if "expiry" not in meta or (meta["expiry"] is not None and meta["expiry"] <= now):
+                self._remove_from_disk(name)
+                return None
+            with open(path + ".body", "rb") as file:
+                body = file.read()
+            os.utime(path + ".body")
+        except (OSError, ValueError):
+            with self._lock:
+                self.disk_usage -= self.disk.pop(name, 0)
+            return None
+        entry = (meta["status"], [tuple(header) for header in meta["headers"]], body, meta["expiry"])
+        self._put_in_memory(key, entry)
+        return entry[:3]
+
+    def put(self, key, status, headers, body, expiry=None):
+        """
+        :param key: Url and request headers the response depends on
+        :param status: HTTP status
+        :param headers: List of (name, value) response headers
+        :param body: Response body
+        :param expiry: Time the response stops being fresh. Never if None
+        """
+        entry = (status, headers, body, expiry)
+        self._put_in_memory(key, entry)
+        if len(body) > self.disk_bytes:
+            return
+        name = self._file_name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path + ".json", "w") as file:
+                json.dump({"key": key, "status": status, "headers": headers, "expiry": expiry}, file)
+            with open(path + ".body.tmp", "wb") as file:
+                file.write(body)
+            os.replace(path + ".body.tmp", path + ".body")
+        except OSError as e:
+            logger.info(f"Asset proxy unable to cache {key} on disk: {e}")
+            return
+        with self._lock:
+            self.disk_usage += len(body) - self.disk.pop(name, 0)
+            self.disk[name] = len(body)
+            all_old_names = []
+            while self.disk_usage > self.disk_bytes and self.disk:
+                old_name, size = self.disk.popitem(last=False)
+                self.disk_usage -= size
+                all_old_names.append(old_name)
+        for old_name in all_old_names:
+            self._remove_from_disk(old_name)
+
+    def _remove_from_disk(self, name):
+        with self._lock:
+            self.disk_usage -= self.disk.pop(name, 0)
+        for extension in (".body", ".json"):
+            try:
+                os.remove(os.path.join(self.directory, name + extension))
+            except OSError:
+                pass
+
+    def _put_in_memory(self, key, entry):
+        size = len(entry[2])
+        # A few big files must not push everything else out
+        if size > self.memory_bytes / 4:
+            return
+        with self._lock:
+            if key in self.memory:
+                self.memory_usage -= len(self.memory.pop(key)[2])
+            self.memory[key] = entry
+            self.memory_usage += size
+            while self.memory_usage > self.memory_bytes:
+                _, (_, _, old_body, _) = self.memory.popitem(last=False)
+                self.memory_usage -= len(old_body)
+
+
+class RunCertificates:
+    """ Certificates of the intercepted hosts. They all share one key, whose hash chrome is told to trust """
+
+    def __init__(self, directory):
+        """
+        :param directory: Folder to write the certificates of the run to
+        """
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.key = ec.generate_private_key(ec.SECP256R1())
+        self.key_path = os.path.join(directory, "run_key.pem")
+        with open(self.key_path, "wb") as file:
+            file.write(self.key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                              serialization.NoEncryption()))
+        public_key = self.key.public_key().public_bytes(serialization.Encoding.DER,
+                                                        serialization.PublicFormat.SubjectPublicKeyInfo)
+        self.spki_hash = base64.b64encode(hashlib.sha256(public_key).digest()).decode()
+        # Host -> ssl context
+        self._contexts = {}
+        self._lock = threading.Lock()
+
+    def get_context(self, host) -> ssl.SSLContext:
+        """
+        :param host: Host chrome connects to
+        :return: Server ssl context with a certificate for the host
+        """
+        with self._lock:
+            if host not in self._contexts:
+                cert_path = os.path.join(self.directory, f"{host}.pem")
+                with open(cert_path, "wb") as file:
+                    file.write(self._make_certificate(host))
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                context.load_cert_chain(cert_path, self.key_path)
+                context.set_alpn_protocols(["http/1.1"])
+                self._contexts[host] = context
+            return self._contexts[host]
+
+    def _make_certificate(self, host) -> bytes:
+        import datetime
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.x509.oid import NameOID
+
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate = (x509.CertificateBuilder()
+                       .subject_name(name).issuer_name(name)
+                       .public_key(self.key.public_key())
+                       .serial_number(x509.random_serial_number())
+                       .not_valid_before(now - datetime.timedelta(days=1))
+                       .not_valid_after(now + datetime.timedelta(days=30))
+                       .add_extension(x509.SubjectAlternativeName([x509.DNSName(host)]), critical=False)
+                       .sign(self.key, hashes.SHA256()))
+        return certificate.public_bytes(serialization.Encoding.PEM)
+
+
+def relay(client, upstream):
+    """ Copy bytes both ways between two sockets until one of them closes """
+    all_sockets = [client, upstream]
+    while True:
+        # Data already decrypted by an ssl socket is not seen by select
+        ready = [each for each in all_sockets if isinstance(each, ssl.SSLSocket) and each.pending()]
+        if not ready:
+            ready, _, failed = select.select(all_sockets, [], all_sockets, UPSTREAM_TIMEOUT * 10)
+            if failed or not ready:
+                return
+        for source in ready:
+            try:
+                data = source.recv(64 * 1024)
+            except (OSError, ssl.SSLError):
+                return
+            if not data:
+                return
+            (upstream if source is client else client).sendall(data)
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Host:port of the CONNECT this connection was opened with
+    tunnel_address = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def finish(self):
+        super().finish()
+        for connection in self.__dict__.get("upstream_connections", {}).values():
+            connection.close()
+        # The server only closes the socket it accepted, not the ssl one wrapping it
+        if self.tunnel_address:
+            self.connection.close()
+
+    def do_CONNECT(self):
+        host, _, port = self.path.rpartition(":")
+        proxy = self.server.proxy
+        if proxy.is_intercepted(host):
+            self.send_response(200, "Connection established")
+            self.end_headers()
+            try:
+                self.connection = proxy.certificates.get_context(host).wrap_socket(self.connection, server_side=True)
+            except (OSError, ssl.SSLError) as e:
+                logger.info(f"Asset proxy TLS failed for {host}: {e}")
+                self.close_connection = True
+                return
+            # handle() reads the next requests from the decrypted connection
+            self.rfile = self.connection.makefile("rb")
+            self.wfile = self.connection.makefile("wb", buffering=0)
+            self.tunnel_address = (host, int(port))
+            self.close_connection = False
+            return
+
+        proxy.count("no_of_tunnels")
+        try:
+            upstream = socket.create_connection((host, int(port)), timeout=UPSTREAM_TIMEOUT)
+        except OSError as e:
+            self.send_error(502, f"Unable to reach {self.path}: {e}")
+            return
+        self.send_response(200, "Connection established")
+        self.end_headers()
+        try:
+            relay(self.connection, upstream)
+        finally:
+            upstream.close()
+            self.close_connection = True
+
+    def do_GET(self):
+        self.forward()
+
+    do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_GET
+
+    def get_url(self) -> str:
+        if self.tunnel_address:
+            host, port = self.tunnel_address
+            return f"https://{host}{'' if port == 443 else f':{port}'}{self.path}"
+        return self.path
+
+    def forward(self):
+        proxy = self.server.proxy
+        url = self.get_url()
+        if self.headers.get("Upgrade"):
+            self.forward_upgrade(url)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+        if self.command == "GET" and is_asset_url(url):
+            key = f"{url} {self.headers.get('Accept-Encoding', '')}"
+            status, headers, response_body = proxy.get_asset(key, lambda: self.send_upstream(url, body))
+        else:
+            proxy.count("no_of_passed")
+            status, headers, response_body = self.send_upstream(url, body)
+
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "content-length":
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(response_body)
+        self.wfile.flush()
+
+    def get_upstream(self, url, fresh=False) -> http.client.HTTPConnection:
+        """ Reuse one upstream connection per origin for the requests of this chrome connection """
+        parts = urlsplit(url)
+        all_connections = self.__dict__.setdefault("upstream_connections", {})
+        origin = (parts.scheme, parts.netloc)
+        if fresh or origin not in all_connections:
+            if origin in all_connections:
+                all_connections[origin].close()
+            if parts.scheme == "https":
+                all_connections[origin] = http.client.HTTPSConnection(parts.netloc, timeout=UPSTREAM_TIMEOUT,
+                                                                      context=self.server.proxy.upstream_context)
+            else:
+                all_connections[origin] = http.client.HTTPConnection(parts.netloc, timeout=UPSTREAM_TIMEOUT)
+        return all_connections[origin]
+
+    def send_upstream(self, url, body) -> tuple:
+        """
+        :return: (status, list of (name, value) headers, body) of the upstream response
+        """
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "") or "/"
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        # A kept alive upstream connection may have been closed in the meantime, the request is sent again once
+        for fresh in (False, True):
+            connection = self.get_upstream(url, fresh)
+            try:
+                connection.request(self.command, path, body=body or None, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+                return response.status, response.getheaders(), response_body
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if fresh:
+                    logger.info(f"Asset proxy unable to get {url}: {e}")
+                    return 502, [("Content-Type", "text/plain")], str(e).encode()
+
+    def forward_upgrade(self, url):
+        """ Websockets and other upgraded connections are relayed as raw bytes """
+        parts = urlsplit(url)
+        self.server.proxy.count("no_of_passed")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            upstream = socket.create_connection((parts.hostname, port), timeout=UPSTREAM_TIMEOUT)
+            if parts.scheme == "https":
+                upstream = self.server.proxy.upstream_context.wrap_socket(upstream, server_hostname=parts.hostname)
+        except (OSError, ssl.SSLError) as e:
+            self.send_error(502, f"Unable to reach {url}: {e}")
+            return
+        path = parts.path + (f"?{parts.query}" if parts.query else "") or "/"
+        request = [f"{self.command} {path} HTTP/1.1"] + [f"{name}: {value}" for name, value in self.headers.items()]
+        upstream.sendall(("\r\n".join(request) + "\r\n\r\n").encode("latin-1"))
+        self.wfile.flush()
+        try:
+            relay(self.connection, upstream)
+        finally:
+            upstream.close()
+            self.close_connection = True
+
+
+class AssetProxy:
+
+    def __init__(self, port=Settings.ASSET_PROXY_PORT, directory=Settings.ASSET_PROXY_DIR):
+        """
+        :param port: Local port to listen on. 0 picks a free one
+        :param directory: Folder of the cache and the run certificates
+        """
+        self.certificates = RunCertificates(os.path.join(directory, "certs"))
+        self.cache = AssetCache(Settings.ASSET_PROXY_MEMORY_MB * 1024 ** 2, Settings.ASSET_PROXY_DISK_MB * 1024 ** 2,
+                                os.path.join(directory, "responses"))
+        self.upstream_context = ssl.create_default_context()
+        self.stats = {"no_of_hits": 0, "no_of_misses": 0, "no_of_passed": 0, "no_of_tunnels": 0, "bytes_saved": 0,
+                      "bytes_fetched": 0}
+        # Cache key -> event set once the asset fetched by another chrome is cached
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), ProxyHandler)
+        self.server.daemon_threads = True
+        self.server.proxy = self
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.server.server_address[1]}"
+
+    def is_intercepted(self, host) -> bool:
+        return any(fnmatch.fnmatch(host, pattern) for pattern in Settings.ASSET_PROXY_HOSTS)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def get_asset(self, key, fetch) -> tuple:
+        """
+        Serve an asset from the cache, or fetch it once for all the chromes asking for it at the same time
+        :param key: Cache key
+        :param fetch: Function returning the upstream (status, headers, body)
+        :return: (status, headers, body)
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            with self._lock:
+                event = self._in_flight.get(key)
+                is_fetching = event is None
+                if is_fetching:
+                    self._in_flight[key] = threading.Event()
+            if not is_fetching:
+                event.wait(IN_FLIGHT_TIMEOUT)
+                entry = self.cache.get(key)
+
+        if entry is not None:
+            self.count("no_of_hits")
+            self.count("bytes_saved", len(entry[2]))
+            return entry
+
+        try:
+            status, headers, body = fetch()
+            self.count("no_of_misses")
+            self.count("bytes_fetched", len(body))
+            all_headers = {name.lower(): value for name, value in headers}
+            now = time.time()
+            if is_cacheable_response(status, all_headers, now):
+                self.cache.put(key, status, [(name, value) for name, value in headers
+                                             if name.lower() not in HOP_BY_HOP_HEADERS], body,
+                               get_expiry(all_headers, now))
+            return status, headers, body
+        finally:
+            if is_fetching:
+                with self._lock:
+                    self._in_flight.pop(key).set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="asset_proxy", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def report(self) -> str:
+        """
+        :return: Cache hit ratio and bytes saved since the start
+        """
+        no_of_assets = self.stats["no_of_hits"] + self.stats["no_of_misses"]
+        hit_ratio = self.stats["no_of_hits"] / no_of_assets if no_of_assets else 0
+        return (f"Asset proxy: {self.stats['no_of_hits']}/{no_of_assets} assets from cache ({hit_ratio:.1%}), "
+                f"{self.stats['bytes_saved'] / 1024 ** 2:.1f}MB saved, {self.stats['bytes_fetched'] / 1024 ** 2:.1f}MB "
+                f"fetched, cache {self.cache.memory_usage / 1024 ** 2:.1f}MB in memory / "
+                f"{self.cache.disk_usage / 1024 ** 2:.1f}MB on disk, {self.stats['no_of_passed']} requests passed "
+                f"through, {self.stats['no_of_tunnels']} tunnels")
+
+
+def start_asset_proxy():
+    """
+    Start the proxy of the run. create_driver points the drivers created after this at it
+    :return: AssetProxy, or None if the cryptography package is missing
+    """
+    global running_proxy
+    try:
+        running_proxy = AssetProxy().start()
+    except ImportError:
+        print("The asset proxy needs the cryptography package: pip install cryptography. Starting without it\n")
+        return None
+    os.environ[DRIVER_OPTIONS_ENV] = json.dumps(get_driver_options())
+    return running_proxy
+
+
+def stop_asset_proxy():
+    global running_proxy
+    if running_proxy:
+        running_proxy.stop()
+        running_proxy = None
+        os.environ.pop(DRIVER_OPTIONS_ENV, None)
+
+
+def get_driver_options() -> dict:
+    """
+    :return: seleniumbase Driver arguments to go through the running proxy, of this process or of the parent
+        process. Empty without one
+    """
+    if running_proxy is None:
+        return json.loads(os.environ.get(DRIVER_OPTIONS_ENV, "{}"))
+    return {"proxy": running_proxy.address,
+            "chromium_arg": f"--ignore-certificate-errors-spki-list={running_proxy.certificates.spki_hash}"}
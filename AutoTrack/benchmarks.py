@@ -0,0 +1,390 @@
+"""
+Benchmarks of the bot browsers. Meant to be run against local test pages, never on a production run.
+
+Usage:
+    python benchmarks.py resource-policy --platform suno --serve test_pages/ page.html
+    python benchmarks.py replay recordings/suno-before.json recordings/suno-after.json
+    python benchmarks.py contexts --accounts 6 --serve test_pages/ page.html
+    python benchmarks.py profile-loads
+    python benchmarks.py bot-modes --tasks 12 --concurrency 6
+    python benchmarks.py driver-configs --serve test_pages/ page.html other.html
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from helpers import create_driver, measure_page_load
+from settings import Settings
+
+
+def serve_directory(directory, port=0) -> tuple:
+    """
+    Serve a local folder of test pages over http in a background thread
+    :param directory: Folder to serve
+    :param port: Port to listen on. 0 picks a free port
+    :return: (server, base_url)
+    """
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def compare_resource_policy(platform, urls, rounds=3) -> dict:
+    """
+    Load each url with and without the platform resource policy and report the load times
+    :param platform: suno / soundcloud
+    :param urls: List of pages to load
+    :param rounds: Number of loads per page. The median is reported
+    :return: Dictionary of url to (load time without policy, load time with policy) in ms
+    """
+    all_timings = {url: {False: [], True: []} for url in urls}
+    for block_resources in (False, True):
+        driver = create_driver(platform, block_resources=block_resources)
+        try:
+            for url in urls:
+                for _ in range(rounds):
+                    # Clear the cache so every round measures a full page load
+                    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+                    all_timings[url][block_resources].append(measure_page_load(driver, url))
+        finally:
+            driver.quit()
+
+    report = {}
+    print(f"\n{'Page':60} {'No policy':>12} {'Policy':>12} {'Gain':>8} {'Bytes saved':>12}")
+    for url, timings in all_timings.items():
+        without_policy, with_policy = (sorted(timings[flag], key=lambda x: x["load_ms"])[rounds // 2]
+                                       for flag in (False, True))
+        gain = 1 - with_policy["load_ms"] / without_policy["load_ms"] if without_policy["load_ms"] else 0
+        print(f"{url[-60:]:60} {without_policy['load_ms']:>10.0f}ms {with_policy['load_ms']:>10.0f}ms "
+              f"{gain:>8.0%} {without_policy['bytes'] - with_policy['bytes']:>12}")
+        report[url] = (without_policy["load_ms"], with_policy["load_ms"])
+    return report
+
+
+def replay_session(recording_path) -> dict:
+    """
+    Run a full bot flow against a recorded driver session, without a browser
+    :param recording_path: Recording saved by a RecordingDriver (Settings.RECORD_SESSIONS_DIR)
+    :return: The replay summary: commands served, skipped and the modeled latency
+    """
+    from records import TrackRecord
+    from result_bus import ResultBus
+    from session_recorder import ReplayDriver
+
+    driver = ReplayDriver(recording_path)
+    result_bus = ResultBus(journal_path=None)
+    meta = driver.meta
+    started_at = time.perf_counter()
+    if meta.get("bot") == "suno":
+        from sunodownloads.suno_ai_spider import run_suno_bot
+        run_suno_bot(driver, meta["username"], "", meta.get("prompts", []), result_bus)
+    elif meta.get("bot") == "soundcloud":
+        from soundcloud_uploads.soundcloud import run_soundcloud_bot
+        run_soundcloud_bot(driver, meta.get("link"), meta["username"], "", [TrackRecord.from_dict(track) for track in meta.get("store", [])], result_bus)
+    else:
+        raise ValueError(f"{recording_path} does not say which bot was recorded")
+
+    summary = driver.summary()
+    summary["wall_time"] = round(time.perf_counter() - started_at, 3)
+    return summary
+
+
+def compare_replays(all_recording_paths) -> list:
+    """
+    Replay several recordings of the same flow and print their command counts and modeled latency side by side
+    :param all_recording_paths: Recording files, e.g. one made before and one after a change
+    :return: List of the replay summaries
+    """
+    all_summaries = [replay_session(path) for path in all_recording_paths]
+
+    print(f"\n{'':28}" + "".join(f"{os.path.basename(path)[-24:]:>26}" for path in all_recording_paths))
+    for key in ("commands", "skipped", "modeled_latency", "wall_time"):
+        print(f"{key:28}" + "".join(f"{summary[key]:>26}" for summary in all_summaries))
+    all_names = sorted(set(name for summary in all_summaries for name in summary["by_name"]))
+    for name in all_names:
+        print(f"  {name:26}" + "".join(f"{summary['by_name'].get(name, 0):>26}" for summary in all_summaries))
+    return all_summaries
+
+
+def compare_browser_contexts(no_of_accounts, url, platform="suno") -> dict:
+    """
+    Measure the memory used by accounts running in their own chrome against accounts sharing one chrome
+    through browser contexts. Every account loads the same page.
+    :param no_of_accounts: Number of accounts to open
+    :param url: Page each account loads
+    :param platform: Resource policy to apply
+    :return: Dictionary with the total RSS in bytes of both setups
+    """
+    from browser_contexts import SharedBrowser
+    from memory_watchdog import get_driver_pids, get_process_tree_rss
+
+    all_drivers = [create_driver(platform) for _ in range(no_of_accounts)]
+    try:
+        for driver in all_drivers:
+            driver.get(url)
+        separate_rss = sum(get_process_tree_rss(get_driver_pids(driver)) for driver in all_drivers)
+    finally:
+        for driver in all_drivers:
+            driver.quit()
+
+    browser = SharedBrowser(platform)
+    all_contexts = [browser.new_context(f"account-{i}") for i in range(no_of_accounts)]
+    try:
+        for context_driver in all_contexts:
+            context_driver.get(url)
+        shared_rss = get_process_tree_rss(get_driver_pids(browser.driver))
+    finally:
+        for context_driver in all_contexts:
+            context_driver.quit()
+
+    print(f"\n{no_of_accounts} accounts on {url}")
+    print(f"One chrome per account: {separate_rss / 1024 ** 2:8.0f}MB ({separate_rss / no_of_accounts / 1024 ** 2:.0f}MB per account)")
+    print(f"One chrome, contexts:   {shared_rss / 1024 ** 2:8.0f}MB ({shared_rss / no_of_accounts / 1024 ** 2:.0f}MB per account)")
+    print(f"Saved per account:      {(separate_rss - shared_rss) / no_of_accounts / 1024 ** 2:8.0f}MB\n")
+    return {"separate": separate_rss, "shared": shared_rss}
+
+
+def compare_profile_loads(load_times_path=Settings.PROFILE_LOAD_TIMES_FILE) -> dict:
+    """
+    Compare the first page load of the browser launches recorded by the bots, by profile state:
+    guest window, new persistent profile (cold) and existing persistent profile (warm)
+    :param load_times_path: File written by profiles.record_first_load
+    :return: Dictionary of (platform, profile state) to (no of launches, median load ms, median bytes)
+    """
+    all_loads = {}
+    with open(load_times_path, "r") as file:
+        for line in file:
+            page_load = json.loads(line)
+            if page_load.get("load_ms") is not None:
+                all_loads.setdefault((page_load["platform"], page_load["profile"]), []).append(page_load)
+
+    report = {}
+    print(f"\n{'Platform':12} {'Profile':8} {'Launches':>9} {'Median load':>12} {'Median bytes':>13}")
+    for (platform, profile_state), page_loads in sorted(all_loads.items()):
+        median_load = statistics.median(page_load["load_ms"] for page_load in page_loads)
+        median_bytes = statistics.median(page_load["bytes"] for page_load in page_loads)
+        print(f"{platform:12} {profile_state:8} {len(page_loads):>9} {median_load:>10.0f}ms {median_bytes:>13.0f}")
+        report[(platform, profile_state)] = (len(page_loads), median_load, median_bytes)
+    return report
+
+
+def synthetic_bot_task(kind, payload, result_bus):
+    """
+    Stand-in for a bot run: every round decodes a clip list the size of a suno API response, waits like a bot waiting
+    on the site and publishes a track. With a url, every round also loads it in the chrome of the task
+    :param kind: Name of the task
+    :param payload: {"rounds", "payload_kb", "wait_secs", "url"}
+    :param result_bus: ResultBus the tracks are published on
+    """
+    from records import TrackRecord
+
+    clip = {"id": "0" * 36, "title": "Benchmark", "metadata": {"tags": "lofi, chill", "prompt": "x" * 200}}
+    response = json.dumps([clip] * max(payload["payload_kb"] * 1024 // len(json.dumps(clip)), 1))
+    driver = create_driver("suno") if payload.get("url") else None
+    try:
+        for i in range(payload["rounds"]):
+            if driver:
+                driver.get(payload["url"])
+            all_clips = json.loads(response)
+            time.sleep(payload["wait_secs"])
+            result_bus.publish(TrackRecord(account=kind, title=f"{all_clips[0]['title']} {i}", genre="benchmark"))
+    finally:
+        if driver:
+            driver.quit()
+
+
+def compare_bot_modes(no_of_tasks, concurrency, rounds=20, payload_kb=512, wait_secs=0.05, url=None) -> dict:
+    """
+    Throughput of the same bot tasks run as threads of this process and on process_pool.BotProcessPool
+    :param no_of_tasks: No of bot runs
+    :param concurrency: No of bots at the same time, threads or worker processes
+    :param rounds: Tracks published by every task
+    :param payload_kb: Size of the JSON decoded every round
+    :param wait_secs: Secs every round waits
+    :param url: Page every round loads in chrome. No chrome if None
+    :return: Dictionary of mode to tracks per sec
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from process_pool import BotProcessPool
+    from records import TrackRecord
+    from result_bus import ResultBus
+
+    payload = {"rounds": rounds, "payload_kb": payload_kb, "wait_secs": wait_secs, "url": url}
+    report = {}
+    for mode in ("threads", "processes"):
+        result_bus = ResultBus(journal_path=None)
+        tracks_queue = result_bus.subscribe(TrackRecord.KIND)
+        started_at = time.perf_counter()
+        if mode == "threads":
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(lambda i: synthetic_bot_task(f"task-{i}", payload, result_bus), range(no_of_tasks)))
+        else:
+            pool = BotProcessPool(result_bus, concurrency, runner=synthetic_bot_task, task_timeout=None,
+                                  deadline_secs=None)
+            for i in range(no_of_tasks):
+                pool.submit(f"task-{i}", payload)
+            pool.close()
+        elapsed = time.perf_counter() - started_at
+        no_of_tracks = len(ResultBus.drain(tracks_queue))
+        report[mode] = no_of_tracks / elapsed
+        print(f"{mode:10} {no_of_tracks:>6} tracks in {elapsed:7.2f}s {report[mode]:>8.1f} tracks/s")
+    print(f"Processes vs threads: {report['processes'] / report['threads']:.2f}x\n")
+    return report
+
+
+def measure_driver_config(config, urls, platform=None) -> dict:
+    """
+    Launch a driver with a configuration, load the pages once and quit it
+    :param config: create_driver launch options
+    :param urls: Pages to load, in order
+    :param platform: Resource policy to apply. None for no policy
+    :return: Dictionary with the start ms, first load ms, total load ms, CPU secs and RSS in bytes of the chrome
+    """
+    from memory_watchdog import get_driver_pids, get_process_tree_cpu_secs, get_process_tree_rss
+
+    started_at = time.perf_counter()
+    driver = create_driver(platform, config=config)
+    try:
+        start_ms = (time.perf_counter() - started_at) * 1000
+        all_loads_ms = []
+        for url in urls:
+            load_started_at = time.perf_counter()
+            driver.get(url)
+            all_loads_ms.append((time.perf_counter() - load_started_at) * 1000)
+        all_pids = get_driver_pids(driver)
+        return {"start_ms": start_ms, "first_load_ms": all_loads_ms[0], "load_ms": sum(all_loads_ms),
+                "cpu_secs": get_process_tree_cpu_secs(all_pids), "rss": get_process_tree_rss(all_pids)}
+    finally:
+        driver.quit()
+
+
+def compare_driver_configs(urls, all_displays, all_window_sizes, all_uc_flags, rounds=3, platform=None,
+                           sort_by="total_ms") -> list:
+    """
+    Measure every combination of the driver launch options and rank them from the cheapest
+    :param urls: Pages every driver loads after its start
+    :param all_displays: DRIVER_CONFIG displays to try, see helpers.DISPLAY_OPTIONS
+    :param all_window_sizes: List of (width, height)
+    :param all_uc_flags: uc modes to try
+    :param rounds: Number of launches per configuration. The medians are reported
+    :param platform: Resource policy to apply. None for no policy
+    :param sort_by: total_ms / start_ms / first_load_ms / cpu_secs / rss
+    :return: List of (config, medians) from the cheapest, then the configurations that failed to launch
+    """
+    all_results = []
+    for display, window_size, uc in itertools.product(all_displays, all_window_sizes, all_uc_flags):
+        config = {"display": display, "window_size": window_size, "uc": uc}
+        try:
+            all_runs = [measure_driver_config(config, urls, platform) for _ in range(rounds)]
+        except Exception as e:
+            print(f"{config} failed: {e}")
+            all_results.append((config, None))
+            continue
+        medians = {key: statistics.median(run[key] for run in all_runs) for key in all_runs[0]}
+        medians["total_ms"] = medians["start_ms"] + medians["load_ms"]
+        all_results.append((config, medians))
+
+    all_results.sort(key=lambda result: (result[1] is None, result[1] and result[1][sort_by]))
+    print(f"\n{'Rank':>4} {'Display':13} {'Window':10} {'uc':>3} {'Start':>9} {'1st load':>9} {'All loads':>10} "
+          f"{'Total':>9} {'CPU':>7} {'RSS':>8}")
+    for rank, (config, medians) in enumerate(all_results, 1):
+        window = "x".join(map(str, config["window_size"]))
+        uc = "on" if config["uc"] else "off"
+        if medians is None:
+            print(f"{rank:>4} {config['display']:13} {window:10} {uc:>3} failed to launch")
+            continue
+        print(f"{rank:>4} {config['display']:13} {window:10} {uc:>3} {medians['start_ms']:>7.0f}ms "
+              f"{medians['first_load_ms']:>7.0f}ms {medians['load_ms']:>8.0f}ms {medians['total_ms']:>7.0f}ms "
+              f"{medians['cpu_secs']:>6.1f}s {medians['rss'] / 1024 ** 2:>6.0f}MB")
+    print(f"Ranked by median {sort_by} over {rounds} launches\n")
+    return all_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot browser benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    policy_parser = subparsers.add_parser("resource-policy", help="Page load time with and without the resource policy")
+    policy_parser.add_argument("--platform", choices=["suno", "soundcloud"], required=True)
+    policy_parser.add_argument("--serve", help="Local folder of test pages to serve. Urls are then relative to it")
+    policy_parser.add_argument("--rounds", type=int, default=3)
+    policy_parser.add_argument("urls", nargs="+")
+
+    replay_parser = subparsers.add_parser("replay", help="Replay recorded driver sessions offline and compare them")
+    replay_parser.add_argument("recordings", nargs="+")
+
+    contexts_parser = subparsers.add_parser("contexts", help="Memory of one chrome per account vs shared contexts")
+    contexts_parser.add_argument("--accounts", type=int, default=Settings.CONCURRENT_PROCESS)
+    contexts_parser.add_argument("--platform", choices=["suno", "soundcloud"], default="suno")
+    contexts_parser.add_argument("--serve", help="Local folder of test pages to serve. The url is then relative to it")
+    contexts_parser.add_argument("url")
+
+    loads_parser = subparsers.add_parser("profile-loads", help="First page load of guest, cold and warm profiles")
+    loads_parser.add_argument("--file", default=Settings.PROFILE_LOAD_TIMES_FILE)
+
+    modes_parser = subparsers.add_parser("bot-modes", help="Throughput of the bots as threads vs worker processes")
+    modes_parser.add_argument("--tasks", type=int, default=2 * Settings.CONCURRENT_PROCESS)
+    modes_parser.add_argument("--concurrency", type=int, default=Settings.CONCURRENT_PROCESS)
+    modes_parser.add_argument("--rounds", type=int, default=20)
+    modes_parser.add_argument("--payload-kb", type=int, default=512)
+    modes_parser.add_argument("--wait", type=float, default=0.05, help="Secs every round waits")
+    modes_parser.add_argument("--serve", help="Local folder of test pages to serve. The url is then relative to it")
+    modes_parser.add_argument("--url", help="Page every round loads in chrome")
+
+    configs_parser = subparsers.add_parser("driver-configs",
+                                           help="Start, page load, CPU and memory of the driver launch options")
+    configs_parser.add_argument("--display", nargs="+", default=["headed", "headless", "new-headless", "xvfb"],
+                                choices=["headed", "headless", "new-headless", "xvfb"])
+    configs_parser.add_argument("--window-size", nargs="+", default=["1920x1080", "1280x720"],
+                                help="Window sizes to try, as WIDTHxHEIGHT")
+    configs_parser.add_argument("--uc", nargs="+", choices=["on", "off"], default=["on", "off"])
+    configs_parser.add_argument("--platform", choices=["suno", "soundcloud"], help="Resource policy to apply")
+    configs_parser.add_argument("--rounds", type=int, default=3)
+    configs_parser.add_argument("--sort-by", choices=["total_ms", "start_ms", "first_load_ms", "cpu_secs", "rss"],
+                                default="total_ms")
+    configs_parser.add_argument("--serve", help="Local folder of test pages to serve. Urls are then relative to it")
+    configs_parser.add_argument("urls", nargs="+")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "resource-policy":
+        urls = args.urls
+        if args.serve:
+            server, base_url = serve_directory(args.serve)
+            urls = [base_url + url.lstrip("/") for url in urls]
+        compare_resource_policy(args.platform, urls, args.rounds)
+    elif args.benchmark == "replay":
+        compare_replays(args.recordings)
+    elif args.benchmark == "contexts":
+        url = args.url
+        if args.serve:
+            server, base_url = serve_directory(args.serve)
+            url = base_url + url.lstrip("/")
+        compare_browser_contexts(args.accounts, url, args.platform)
+    elif args.benchmark == "profile-loads":
+        compare_profile_loads(args.file)
+    elif args.benchmark == "bot-modes":
+        url = args.url
+        if args.serve and url:
+            server, base_url = serve_directory(args.serve)
+            url = base_url + url.lstrip("/")
+        compare_bot_modes(args.tasks, args.concurrency, args.rounds, args.payload_kb, args.wait, url)
+    elif args.benchmark == "driver-configs":
+        urls = args.urls
+        if args.serve:
+            server, base_url = serve_directory(args.serve)
+            urls = [base_url + url.lstrip("/") for url in urls]
+        all_window_sizes = [tuple(map(int, size.lower().split("x"))) for size in args.window_size]
+        compare_driver_configs(urls, args.display, all_window_sizes, [uc == "on" for uc in args.uc], args.rounds,
+                               args.platform, args.sort_by)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Runs several accounts in one Chrome process, each one in its own isolated browser context.
+
+Every account gets a ContextDriver: a tab opened in a new CDP browser context, so cookies, storage and cache
+are not shared. Before each command a ContextDriver takes the browser lock and switches the WebDriver to
+its tab, which lets the bot threads share the browser without knowing about each other.
+A command that waits inside seleniumbase (e.g. driver.type with a timeout) holds the browser for that time.
+"""
+import itertools
+import threading
+import time
+
+from settings import Settings
+from helpers import create_driver, apply_resource_policy
+
+# Numbers the shared browsers in the memory watchdog and status reports
+_browser_numbers = itertools.count(1)
+
+
+class SharedBrowser:
+    """ One chrome process shared by several browser contexts """
+
+    def __init__(self, platform):
+        """
+        :param platform: suno / soundcloud. Selects the resource policy applied in every context
+        """
+        self.platform = platform
+        self.name = f"shared {platform} browser {next(_browser_numbers)}"
+        self.driver = create_driver(platform)
+        self.lock = threading.RLock()
+        self.handles = {}
+        self.context_ids = {}
+        self.current = None
+
+    def new_context(self, name):
+        """
+        Open a tab in a new isolated browser context
+        :param name: Unique name of the context. e.g. the account username
+        :return: ContextDriver bound to the tab
+        """
+        with self.lock:
+            existing_handles = set(self.driver.window_handles)
+            context_id = self.driver.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+            self.driver.execute_cdp_cmd("Target.createTarget", {"url": "about:blank", "browserContextId": context_id})
+            new_handles = [handle for handle in self.driver.window_handles if handle not in existing_handles]
+            self.handles[name] = new_handles[0]
+            self.context_ids[name] = context_id
+            context_driver = ContextDriver(self, name)
+            self.switch(name)
+            apply_resource_policy(self.driver, self.platform)
+            return context_driver
+
+    def switch(self, name):
+        """ Point the WebDriver to the tab of a context. The browser lock must be held """
+        if self.current != name:
+            self.driver.switch_to.window(self.handles[name])
+            self.current = name
+
+    def renew_context(self, name):
+        """
+        Replace the context of an account with a new empty one. Its tab is closed, which frees the memory
+        of its renderer, while chrome and the other contexts keep running
+        :param name: Name of the context
+        :return: ContextDriver bound to the new tab
+        """
+        with self.lock:
+            old_handle, old_context_id = self.handles[name], self.context_ids[name]
+            # The new tab is opened first so chrome never runs without a context
+            self.current = None
+            context_driver = self.new_context(name)
+            self.driver.switch_to.window(old_handle)
+            self.driver.close()
+            self.driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": old_context_id})
+            self.current = None
+            self.switch(name)
+            return context_driver
+
+    def close_context(self, name):
+        """ Close the tab and dispose the browser context. Quits chrome once no context is left """
+        with self.lock:
+            if name not in self.handles:
+                return
+            self.switch(name)
+            self.driver.close()
+            self.driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": self.context_ids.pop(name)})
+            self.handles.pop(name)
+            self.current = None
+            if not self.handles:
+                self.driver.quit()
+
+
+class _ContextProxy:
+    """ Runs every call of the wrapped object in the tab of its context """
+
+    def __init__(self, browser, name, target):
+        object.__setattr__(self, "_browser", browser)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_target", target)
+
+    def _wrap(self, value):
+        if hasattr(value, "_parent") and hasattr(value, "get_attribute"):
+            return _ContextProxy(self._browser, self._name, value)
+        if isinstance(value, list):
+            return [self._wrap(each) for each in value]
+        return value
+
+    @staticmethod
+    def _unwrap(value):
+        if isinstance(value, _ContextProxy):
+            return value._target
+        if isinstance(value, (list, tuple)):
+            return type(value)(_ContextProxy._unwrap(each) for each in value)
+        return value
+
+    def __getattr__(self, name):
+        with self._browser.lock:
+            self._browser.switch(self._name)
+            value = getattr(self._target, name)
+        if not callable(value):
+            return self._wrap(value)
+
+        def call_in_context(*args, **kwargs):
+            with self._browser.lock:
+                self._browser.switch(self._name)
+                return self._wrap(value(*self._unwrap(args), **{key: self._unwrap(each) for key, each in kwargs.items()}))
+        return call_in_context
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class ContextDriver(_ContextProxy):
+    """ Driver of one account inside a SharedBrowser """
+
+    def __init__(self, browser, name):
+        super().__init__(browser, name, browser.driver)
+
+    def sleep(self, seconds):
+        # Let the other contexts use the browser while this one waits
+        time.sleep(seconds)
+
+    def uc_open(self, url):
+        # uc_open reconnects the whole driver, which would disturb the other contexts
+        return self.__getattr__("get")(url)
+
+    def set_window_size(self, width, height):
+        # All the tabs share the browser window
+        pass
+
+    def quit(self):
+        self._browser.close_context(self._name)
+
+    def close(self):
+        self._browser.close_context(self._name)
+
+
+class BrowserPool:
+    """
+    Hands out a driver per account. With Settings.ACCOUNTS_PER_BROWSER above 1 the accounts share
+    chrome processes, each one in its own browser context. Browsers are created as they are needed.
+    Shared browsers never use the persistent account profiles.
+    """
+
+    def __init__(self, platform, accounts_per_browser=Settings.ACCOUNTS_PER_BROWSER):
+        self.platform = platform
+        self.accounts_per_browser = accounts_per_browser
+        self._browser = None
+        self._no_of_contexts = 0
+        self._lock = threading.Lock()
+
+    def driver_for(self, name):
+        """
+        :param name: Account username
+        :return: A seleniumbase driver or a ContextDriver
+        """
+        if self.accounts_per_browser <= 1:
+            return create_driver(self.platform, account=name)
+        with self._lock:
+            if self._browser is None or self._no_of_contexts >= self.accounts_per_browser:
+                self._browser = SharedBrowser(self.platform)
+                self._no_of_contexts = 0
+            self._no_of_contexts += 1
+            return self._browser.new_context(name)
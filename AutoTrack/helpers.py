@@ -1,10 +1,13 @@
+import fnmatch
+import json
 import logging
+import os
+import shutil
+import socket
+import subprocess
+import time
 
 from settings import Settings
-from selenium.common import TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 logging.basicConfig(filename="stderr.log",
                     format="%(asctime)s  --  %(levelname)s -- %(message)s")
@@ -12,6 +15,13 @@ logger = logging.getLogger()
 
 logger.setLevel(logging.INFO)
 
+# URL patterns used to block a CDP resource type with Network.setBlockedURLs
+RESOURCE_TYPE_EXTENSIONS = {
+    "Font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "Media": ["mp3", "mp4", "m4a", "webm", "ogg", "wav"],
+    "Image": ["png", "jpg", "jpeg", "gif", "webp", "svg", "ico"],
+}
+
 
 def retry_func(func, no_of_retries, *args, **kwargs):
     if no_of_retries == 0:
@@ -56,6 +66,11 @@ def wait_for_elements_presence(driver, selector: str) -> list:
     :param selector: CSS locator of an element
     :return: The list of elements it waited for, if the function did not enter timeout
     """
+    from selenium.common import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.wait import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     try:
         WebDriverWait(driver, Settings.TIMEOUT).until(
             EC.presence_of_all_elements_located((By.CSS_SELECTOR, selector)))
@@ -79,6 +94,10 @@ def wait_for_elements_to_be_clickable(driver, selector: str, timeout=Settings.TI
     :param timeout: No of secs to wait until element is clickable. Defaults to settings timeout
     :return:
     """
+    from selenium.common import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.wait import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
 
     try:
         WebDriverWait(driver, timeout).until(
@@ -94,16 +113,238 @@ def wait_for_elements_to_be_clickable(driver, selector: str, timeout=Settings.TI
             return []
 
 
-def create_driver():
+# DRIVER_CONFIG display -> seleniumbase Driver arguments
+DISPLAY_OPTIONS = {
+    "headed": {},
+    "headless": {"headless": True},
+    "new-headless": {"headless2": True},
+    "xvfb": {"xvfb": True},
+}
+
+
+def create_driver(platform=None, block_resources=Settings.BLOCK_RESOURCES, account=None, config=None):
     """
     Creates a webdriver
+    @param platform: Website the driver is used for. suno / soundcloud. Selects the resource policy to apply
+    @param block_resources: flag, apply the platform resource policy from Settings.RESOURCE_POLICIES
+    @param account: Account the driver is for. With Settings.PERSISTENT_PROFILES it gets its own chrome profile
+    @param config: Launch options overriding Settings.DRIVER_CONFIG, e.g. {"display": "new-headless"}
     @return:  object
     """
     from seleniumbase import Driver as webDriver
+    from asset_proxy import get_driver_options
+
+    if Settings.PERSISTENT_PROFILES and platform and account:
+        from profiles import prepare_profile
+
+        user_data_dir, profile_state = prepare_profile(platform, account)
+        profile_options = {"user_data_dir": user_data_dir}
+    else:
+        profile_state = "guest"
+        profile_options = {"guest_mode": True, "incognito": True}
+    config = {**Settings.DRIVER_CONFIG, **(config or {})}
 
     driver = webDriver(
-        uc=True, undetectable=True, headless=Settings.HEADLESS, guest_mode=True, disable_gpu=True,
-        no_sandbox=True, incognito=True
+        uc=config["uc"], undetectable=config["uc"], disable_gpu=True, no_sandbox=True,
+        log_cdp_events=platform in Settings.CAPTURE_NETWORK_PLATFORMS, **DISPLAY_OPTIONS[config["display"]],
+        **profile_options, **get_driver_options()
     )
-    driver.set_window_size(1920, 1080)
+    # Read by profiles.record_first_load on the first page the bot opens
+    driver._profile_state = profile_state
+    # Read by uc_open_with_policy to block the resources again after a reconnect
+    driver._resource_platform = platform if block_resources else None
+    driver.set_window_size(*config["window_size"])
+    if platform and block_resources:
+        apply_resource_policy(driver, platform)
+
+    if platform and Settings.RECORD_SESSIONS_DIR:
+        from session_recorder import RecordingDriver
+
+        os.makedirs(Settings.RECORD_SESSIONS_DIR, exist_ok=True)
+        recording_path = os.path.join(Settings.RECORD_SESSIONS_DIR,
+                                      f"{platform}-{time.strftime('%Y%m%d-%H%M%S')}-{id(driver)}.json")
+        driver = RecordingDriver(driver, recording_path)
     return driver
+
+
+def get_blocked_urls(platform) -> list:
+    """
+    Build the list of URL patterns to block for a platform from its resource policy.
+    Patterns that match any of the policy allowed URLs are left out so the flows keep working.
+    :param platform: suno / soundcloud
+    :return: List of URL patterns for Network.setBlockedURLs
+    """
+    policy = Settings.RESOURCE_POLICIES.get(platform, {})
+
+    all_patterns = list(policy.get("block_patterns", []))
+    for resource_type in policy.get("block_types", []):
+        for extension in RESOURCE_TYPE_EXTENSIONS.get(resource_type, []):
+            all_patterns += [f"*.{extension}", f"*.{extension}?*"]
+
+    blocked_urls = []
+    for pattern in all_patterns:
+        allowed_urls = [url for url in policy.get("allow", []) if fnmatch.fnmatch(url, pattern)]
+        if allowed_urls:
+            logger.info(f"Not blocking {pattern} on {platform}. It matches allowed {allowed_urls}")
+            continue
+        blocked_urls.append(pattern)
+    return blocked_urls
+
+
+def apply_resource_policy(driver, platform):
+    """
+    Block the resources the bots never use (fonts, analytics, ads, media previews) on a driver through CDP.
+    The blocked list is bound to the devtools session, open pages with uc_open_with_policy to keep it after a
+    uc_open reconnect.
+    :param driver: an active chrome webdriver
+    :param platform: suno / soundcloud
+    """
+    blocked_urls = get_blocked_urls(platform)
+    if not blocked_urls:
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+
+
+def uc_open_with_policy(driver, url):
+    """
+    Open a page with uc_open, then apply the resource policy of the driver again. The reconnect of uc_open starts a
+    new devtools session without the blocked list, so only the pages opened after it are filtered
+    :param driver: a webdriver made by create_driver
+    :param url: Page to open
+    """
+    driver.uc_open(url)
+    platform = getattr(driver, "_resource_platform", None)
+    if platform:
+        apply_resource_policy(driver, platform)
+
+
+def measure_page_load(driver, url) -> dict:
+    """
+    Open a page and read its load timing from the browser navigation performance entry
+    :param driver: an active chrome webdriver
+    :param url: Page to load
+    :return: Dictionary with the url, load time in ms, number of resources and transferred bytes
+    """
+    driver.get(url)
+    return read_page_load(driver)
+
+
+def read_page_load(driver) -> dict:
+    """
+    Read the load timing of the page open in a driver from the browser navigation performance entry
+    :param driver: an active chrome webdriver
+    :return: Dictionary with the url, load time in ms, number of resources and transferred bytes
+    """
+    return driver.execute_script("""
+        let navigation = performance.getEntriesByType("navigation")[0];
+        let resources = performance.getEntriesByType("resource");
+        let transferred = resources.reduce((total, entry) => total + (entry.transferSize || 0), 0);
+        return {
+            "url": location.href,
+            "load_ms": navigation ? navigation.loadEventEnd - navigation.startTime : null,
+            "resources": resources.length,
+            "bytes": transferred + (navigation ? navigation.transferSize : 0)
+        };
+    """)
+
+
+def _binary_version(binary_path) -> str:
+    """
+    Returns the version string printed by a chrome or chromedriver binary
+    :param binary_path: Path to the executable
+    :return: The version output or an empty string if the binary cannot be run
+    """
+    try:
+        output = subprocess.run([binary_path, "--version"], capture_output=True, text=True, timeout=30)
+        return output.stdout.strip() if output.returncode == 0 else ""
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _major_version(version: str) -> str:
+    """ Extract the major version number from a binary version string """
+    for part in version.split():
+        if part[:1].isdigit():
+            return part.split(".")[0]
+    return ""
+
+
+def _find_driver_binaries() -> tuple:
+    """
+    Locate the uc chromedriver patched by seleniumbase and the Chrome browser binary on the host
+    :return: (uc_driver_path, chrome_path). Any of the two is None if not found
+    """
+    from seleniumbase import drivers
+
+    drivers_dir = os.path.dirname(drivers.__file__)
+    uc_driver_path = os.path.join(drivers_dir, "uc_driver.exe" if os.name == "nt" else "uc_driver")
+    if not os.path.exists(uc_driver_path):
+        uc_driver_path = None
+
+    chrome_path = None
+    for name in Settings.CHROME_BINARY_NAMES:
+        chrome_path = shutil.which(name)
+        if chrome_path:
+            break
+    return uc_driver_path, chrome_path
+
+
+def _check_driver_binaries() -> dict:
+    """
+    Validate that the uc chromedriver runs and matches the major version of the installed Chrome
+    :return: The host binaries details. The "valid" key is False if the binaries are unusable
+    """
+    uc_driver_path, chrome_path = _find_driver_binaries()
+    details = {
+        "host": socket.gethostname(),
+        "uc_driver": uc_driver_path,
+        "uc_driver_mtime": os.path.getmtime(uc_driver_path) if uc_driver_path else None,
+        "chrome": chrome_path,
+        "uc_driver_version": _binary_version(uc_driver_path) if uc_driver_path else "",
+        "chrome_version": _binary_version(chrome_path) if chrome_path else "",
+    }
+    driver_major = _major_version(details["uc_driver_version"])
+    # Chrome may not be on the PATH (e.g. on windows). Only compare versions when both are known
+    chrome_major = _major_version(details["chrome_version"]) or driver_major
+    details["valid"] = bool(driver_major) and driver_major == chrome_major
+    return details
+
+
+def prepare_driver():
+    """
+    Prepare and validate the Chrome/chromedriver binaries once per host before any worker starts.
+
+    Seleniumbase downloads and patches the uc driver the first time a driver is created, and every thread
+    calling create_driver() at the same time races on that patch through driver_fixing.lock.
+    Running this once beforehand means workers always find a ready-made driver.
+    The result is saved in Settings.DRIVER_PREFLIGHT_FILE so later runs on the same host skip the warm-up launch.
+    :return: The validated host binaries details
+    """
+    try:
+        with open(Settings.DRIVER_PREFLIGHT_FILE, "r") as file:
+            saved_details = json.load(file)
+    except (FileNotFoundError, ValueError):
+        saved_details = {}
+
+    details = _check_driver_binaries()
+    same_binaries = all(saved_details.get(key) == details[key] for key in
+                        ("host", "uc_driver", "uc_driver_mtime", "uc_driver_version", "chrome_version"))
+    if details["valid"] and same_binaries:
+        print("Driver preflight: binaries already prepared on this host\n")
+        return details
+
+    print("Driver preflight: preparing the uc driver ...\n")
+    # Launching a driver makes seleniumbase fetch and patch the uc driver a single time
+    driver = create_driver()
+    driver.quit()
+
+    details = _check_driver_binaries()
+    if not details["valid"]:
+        logger.error(f"Driver preflight failed: {details}")
+        raise RuntimeError(f"Invalid chrome/chromedriver binaries on this host: {details}")
+
+    with open(Settings.DRIVER_PREFLIGHT_FILE, "w") as file:
+        json.dump(details, file, indent=2)
+    print(f"Driver preflight done: {details['uc_driver_version']} | {details['chrome_version']}\n")
+    return details
@@ -0,0 +1,187 @@
+"""
+Background cleanup of the downloaded tracks, artwork and cookies, within a disk quota.
+
+Rules, checked every Settings.JANITOR_INTERVAL secs:
+  - a track published on the result bus is kept until its upload is confirmed with confirm_uploaded()
+  - confirmed tracks are removed JANITOR_UPLOADED_RETENTION_SECS after the confirmation
+  - files no run knows about (left by a crashed run, stale .part downloads) are removed after JANITOR_ORPHAN_MAX_AGE_SECS
+  - over DISK_QUOTA_MB, the least recently used files that are not waiting for an upload are removed first
+  - cookie files not refreshed for COOKIE_MAX_AGE_SECS are removed, the account logs in again the next time
+The bot threads never wait for it.
+"""
+import os
+import shutil
+import threading
+import time
+
+from helpers import logger
+from records import TrackRecord
+from result_bus import ResultBus
+from settings import Settings
+
+# Files the janitor never removes
+KEEP_FILES = {"driver_fixing.lock"}
+# Files changed this recently may still be written to, e.g. a .part download
+MIN_IDLE_SECS = 10 * 60
+
+
+def get_track_files(track) -> list:
+    """
+    :param track: TrackRecord
+    :return: Absolute paths of the audio and artwork files of the track
+    """
+    download_dir = os.path.join(os.getenv("CURRENT_DIR") or os.getcwd(), "downloaded_files")
+    audio_path = track.audio_path or os.path.join(download_dir, f"{track.title}.mp3")
+    images_dir = track.img_path if track.img_path and os.path.isdir(track.img_path) else os.path.join(download_dir, "images")
+    image_name = os.path.basename(audio_path).rsplit(".", 1)[0] + ".png"
+    return [os.path.abspath(audio_path), os.path.abspath(os.path.join(images_dir, image_name))]
+
+
+def list_files(directory) -> list:
+    """
+    :param directory: Folder to scan, sub folders included
+    :return: List of (path, size, last use time) of the files
+    """
+    all_files = []
+    for root, _, all_names in os.walk(directory):
+        for name in all_names:
+            if name in KEEP_FILES:
+                continue
+            path = os.path.abspath(os.path.join(root, name))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            all_files.append((path, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+    return all_files
+
+
+class DiskJanitor:
+
+    def __init__(self, result_bus=None, quota_bytes=Settings.DISK_QUOTA_MB * 1024 ** 2,
+                 interval=Settings.JANITOR_INTERVAL):
+        """
+        :param result_bus: ResultBus the suno bots publish their tracks to. Published tracks are kept until uploaded
+        :param quota_bytes: Max size of the downloaded files
+        :param interval: No of secs between two sweeps
+        """
+        self.download_dir = os.path.join(os.getenv("CURRENT_DIR") or os.getcwd(), "downloaded_files")
+        self.cookies_dir = os.path.join(os.getcwd(), "cookies")
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        # Path -> account of the tracks waiting for their upload
+        self.pending = {}
+        # Path -> time the upload was confirmed
+        self.uploaded = {}
+        self.no_of_removed_files = 0
+        self.removed_bytes = 0
+        self.last_usage = 0
+        self._tracks_queue = result_bus.subscribe(TrackRecord.KIND) if result_bus else None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def protect(self, track):
+        """ Keep the files of a track until its upload is confirmed """
+        with self._lock:
+            for path in get_track_files(track):
+                self.pending[path] = track.account
+
+    def _protect_published(self):
+        """ Protect the tracks published on the result bus since the last call """
+        if self._tracks_queue:
+            for track in ResultBus.drain(self._tracks_queue):
+                self.protect(track)
+
+    def confirm_uploaded(self, all_tracks):
+        """
+        The tracks are uploaded, their files can go
+        :param all_tracks: List of TrackRecord
+        """
+        # Published tracks not seen yet must not be protected again after this
+        self._protect_published()
+        with self._lock:
+            for track in all_tracks:
+                for path in get_track_files(track):
+                    self.pending.pop(path, None)
+                    self.uploaded[path] = time.time()
+
+    def _remove(self, path, size, reason):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.info(f"Janitor unable to remove {path}: {e}")
+            return 0
+        logger.info(f"Janitor removed {path} ({reason})")
+        self.uploaded.pop(path, None)
+        self.no_of_removed_files += 1
+        self.removed_bytes += size
+        return size
+
+    def sweep(self):
+        """ Apply the retention rules and the quota once """
+        self._protect_published()
+
+        now = time.time()
+        with self._lock:
+            all_files = list_files(self.download_dir)
+            usage = sum(size for _, size, _ in all_files)
+            evictable = []
+            for path, size, last_used in all_files:
+                if path in self.pending:
+                    continue
+                if path in self.uploaded:
+                    if now - self.uploaded[path] >= Settings.JANITOR_UPLOADED_RETENTION_SECS:
+                        usage -= self._remove(path, size, "uploaded")
+                        continue
+                elif now - last_used >= Settings.JANITOR_ORPHAN_MAX_AGE_SECS:
+                    usage -= self._remove(path, size, "orphan")
+                    continue
+                elif now - last_used < MIN_IDLE_SECS:
+                    continue
+                evictable.append((last_used, path, size))
+
+            # Over quota, the least recently used files go first
+            for _, path, size in sorted(evictable):
+                if usage <= self.quota_bytes:
+                    break
+                usage -= self._remove(path, size, "over quota")
+            if usage > self.quota_bytes:
+                logger.info(f"Downloaded files use {usage} bytes, over the {self.quota_bytes} bytes quota. "
+                            f"The rest is waiting for upload")
+            self.last_usage = usage
+
+        for path, size, last_used in list_files(self.cookies_dir):
+            if now - last_used >= Settings.COOKIE_MAX_AGE_SECS:
+                self._remove(path, size, "expired cookies")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.info(f"Janitor sweep failed: {e}")
+
+    def stop(self):
+        """ Stop the background sweeps and run a last one """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        self.sweep()
+
+    def report(self) -> str:
+        """
+        :return: Disk use of the downloaded files and cookies, and what was removed
+        """
+        download_usage = sum(size for _, size, _ in list_files(self.download_dir))
+        cookies_usage = sum(size for _, size, _ in list_files(self.cookies_dir))
+        free = shutil.disk_usage(os.getcwd()).free
+        return (f"Disk: downloads {download_usage / 1024 ** 2:.1f}MB / {self.quota_bytes / 1024 ** 2:.0f}MB quota, "
+                f"cookies {cookies_usage / 1024:.0f}KB, {len(self.pending)} files waiting for upload, "
+                f"{self.no_of_removed_files} files removed ({self.removed_bytes / 1024 ** 2:.1f}MB), "
+                f"{free / 1024 ** 3:.1f}GB free")
@@ -2,62 +2,82 @@
 This is to be run only on local testing
 """
 
-import os
 import time
+
+STARTED_AT = time.perf_counter()
+
+import os
+import argparse
 from threading import Thread
 from settings import Settings
-from helpers import create_driver
-from utils import parse_prompts, get_available_platform_accounts_v2, delete_downloaded_files, send_daily_statistics
-from WebAutomations.AutoTrack.soundcloud_uploads.soundcloud import run_soundcloud_bot
-from sunodownloads.suno_ai_spider import run_suno_bot
+from helpers import prepare_driver
+from utils import get_daily_genre_prompts, get_available_platform_accounts_v2, send_daily_statistics
 from dotenv import load_dotenv
-import datetime  # import the datetime module to get the current date
-import random  # import the random module
 import traceback  # import the traceback module
 
-# Charger les variables d'environnement
-load_dotenv()
-
-print("Started !\n")
-
 # Définir une fonction qui exécute le processus d'automatisation
 
 
-def automation_process():
+def automation_process(status_port=None, bot_execution=Settings.BOT_EXECUTION):
+    # Les modules des bots chargent selenium et requests. Ils ne sont importés qu'au moment de lancer les bots
+    from soundcloud_uploads.soundcloud import run_soundcloud_bot
+    from sunodownloads.suno_ai_spider import run_suno_bot
+    from sunodownloads.credit_planner import get_credit_balances, plan_prompts
+    from memory_watchdog import memory_watchdog
+    from browser_contexts import BrowserPool
+    from result_bus import ResultBus
+    from records import TrackRecord, UploadResult
+    from janitor import DiskJanitor
+    from supervisor import Supervisor
+    from pacing import pacer
+
     # Initialiser le nombre total de téléchargements à zéro
     no_of_all_downloads = 0
     # Obtenir la liste des comptes disponibles pour Suno et Soundcloud
     all_suno_accounts = get_available_platform_accounts_v2("suno")
     all_soundcloud_account = get_available_platform_accounts_v2("soundcloud")
-    # Créer une liste vide pour stocker les résultats de Soundcloud
-    result_from_soundcloud = list()
+    # Les bots publient leurs résultats sur le bus, qui les journalise aussi dans Settings.RUN_JOURNAL
+    result_bus = ResultBus()
+    # Abonnement aux résultats de Soundcloud pour toute la journée
+    soundcloud_results_queue = result_bus.subscribe(UploadResult.KIND)
+    # Le nettoyage des fichiers se fait en arrière-plan. Les chansons publiées sont gardées jusqu'à leur téléversement
+    janitor = DiskJanitor(result_bus).start()
+    # Le superviseur annule les threads bloqués ou hors budget pour que la journée finisse à temps
+    supervisor = Supervisor().start()
+    # Page de suivi de la progression de chaque thread pendant la journée
+    status_server = None
+    if status_port is not None:
+        from status_server import start_status_server
+        status_server = start_status_server(result_bus, port=status_port)
+    # Chaque bot tourne dans son propre processus si bot_execution vaut "processes"
+    bot_pool = None
+    if bot_execution == "processes":
+        from process_pool import BotProcessPool
+        bot_pool = BotProcessPool(result_bus, deadline_secs=supervisor.remaining_secs())
     print(f"Got {len(all_suno_accounts)} Suno accounts\n")
     print(f"Got {len(all_soundcloud_account)} Soundcloud accounts\n")
 
-    # Obtenir la liste des invites quotidiens à utiliser pour chaque genre
-    all_daily_prompts = parse_prompts()
+    # Obtenir le genre du jour et la liste des invites de ce genre
+    genre_used, all_daily_prompts = get_daily_genre_prompts()
 
-    # Obtenir le jour actuel du mois
-    today = datetime.date.today()
-    day = today.day
+    # Répartir les invites selon les crédits de chaque compte et ignorer les comptes épuisés
+    prompts_plan = plan_prompts(get_credit_balances([account[0] for account in all_suno_accounts]), all_daily_prompts)
+    all_suno_accounts = [account for account in all_suno_accounts if account[0] in prompts_plan]
+    print(f"{len(all_suno_accounts)} Suno accounts have enough credits\n")
 
-    # Obtenir le nom du genre à utiliser en fonction du jour et du nombre de genres
-    # Utiliser le modulo pour boucler si le jour est supérieur au nombre de genres
-    genre_names = sorted(set(prompt["genre"] for prompt in all_daily_prompts))
-    num_genres = len(genre_names)
-    genre_index = (day - 1) % num_genres
-    genre_used = genre_names[genre_index]
-
-    # Filtrer la liste des invites par le nom du genre
-    all_daily_prompts = [
-        prompt for prompt in all_daily_prompts if prompt["genre"] == genre_used]
-
-    # Créer un dictionnaire qui contient une liste d'invites aléatoires pour chaque thread Suno
+    # Créer un dictionnaire qui contient la liste d'invites de chaque thread Suno
     selected_prompts = {}
-    for j in range(len(all_suno_accounts)):
+    for j, account in enumerate(all_suno_accounts):
         key = f"\nSuno Thread {j + 1}"
-        value = random.sample(all_daily_prompts, 5)
-        selected_prompts[key] = value
+        selected_prompts[key] = prompts_plan[account[0]]
+
+    # Préparer les binaires chrome/chromedriver une seule fois avant de lancer les threads
+    prepare_driver()
+    print(f"Startup took {time.perf_counter() - STARTED_AT:.2f}s\n")
+
+    # Les comptes partagent des processus chrome si Settings.ACCOUNTS_PER_BROWSER > 1
+    suno_browsers = BrowserPool("suno")
+    soundcloud_browsers = BrowserPool("soundcloud")
 
     # Créer des index pour parcourir la liste des comptes Suno
     suno_start_index = 0
@@ -65,10 +85,14 @@ def automation_process():
     # Créer une variable d'arrêt pour contrôler la boucle
     stop = False
     while not stop:
+        # Ne plus lancer de comptes une fois l'heure limite de la journée passée
+        if supervisor.remaining_secs() == 0:
+            print("Run deadline reached, no more accounts are started\n")
+            break
         # Créer une liste vide pour stocker les threads Suno
         all_suno_threads = []
-        # Créer une liste vide pour stocker les informations sur les fichiers audio téléchargés
-        all_downloaded_audios_info = list()
+        # Abonnement aux chansons téléchargées par cette tranche de comptes
+        tracks_queue = result_bus.subscribe(TrackRecord.KIND)
         # Parcourir la liste des comptes Suno par tranches de Settings.CONCURRENT_PROCESS
         for account in all_suno_accounts[suno_start_index:suno_end_index]:
 
@@ -80,27 +104,41 @@ def automation_process():
             thread_prompts = selected_prompts[thread_name]
             print(thread_prompts)
 
-            # Créer un thread Suno qui exécute la fonction run_suno_bot avec les arguments appropriés
-            suno_thread = Thread(name=thread_name,
-                                 target=run_suno_bot,
-                                 args=(create_driver(), username, password, thread_prompts,
-                                       all_downloaded_audios_info))
-            suno_thread.start()
-            print(suno_thread.name + " started !\n")
-            # Ajouter le thread à la liste des threads Suno
-            all_suno_threads.append(suno_thread)
+            if bot_pool:
+                # Le bot Suno tourne dans un processus du pool, qui crée son propre navigateur
+                bot_pool.submit("suno", {"username": username, "password": password, "prompts": thread_prompts})
+                print(thread_name + " queued on the bot processes !\n")
+            else:
+                # Créer un thread Suno qui exécute la fonction run_suno_bot avec les arguments appropriés
+                suno_thread = Thread(name=thread_name, daemon=True,
+                                     target=run_suno_bot,
+                                     args=(suno_browsers.driver_for(username), username, password, thread_prompts,
+                                           result_bus))
+                suno_thread.start()
+                print(suno_thread.name + " started !\n")
+                # Ajouter le thread à la liste des threads Suno
+                all_suno_threads.append(suno_thread)
             time.sleep(2)
             break
 
         # Attendre que tous les threads Suno se terminent
         for suno_thread in all_suno_threads:
-            suno_thread.join()
+            supervisor.join(suno_thread)
+        if bot_pool:
+            wait_for_bot_pool(bot_pool, supervisor)
+
+        # Récupérer les informations sur les fichiers audio téléchargés. L'abonnement ne sert qu'à cette tranche
+        result_bus.unsubscribe(tracks_queue)
+        all_downloaded_audios_info = result_bus.drain(tracks_queue)
 
         # Mettre à jour le nombre total de téléchargements
         no_of_all_downloads += len(all_downloaded_audios_info)
 
+        # Abonnement aux résultats Soundcloud de cette tranche, pour savoir quelles chansons ont été téléversées
+        batch_results_queue = result_bus.subscribe(UploadResult.KIND)
+        all_started_usernames = []
         # Vérifier s'il y a des fichiers audio à télécharger
-        if not all_downloaded_audios_info:
+        if all_downloaded_audios_info:
             # Créer des index pour parcourir la liste des comptes Soundcloud
             soundcloud_start_index = 0
             soundcloud_end_index = Settings.CONCURRENT_PROCESS
@@ -112,24 +150,35 @@ def automation_process():
                     # Créer une instance de bot Soundcloud
                     username = account[0]
                     password = account[1]
+                    all_started_usernames.append(username)
 
-                    driver = create_driver()
-
-                    # Créer un thread Soundcloud qui exécute la fonction run_soundcloud_bot avec les arguments appropriés
-                    soundcloud_thread = Thread(name=f"\nSoundcloud account: {username}", target=run_soundcloud_bot,
-                                               args=(driver, os.getenv("SOUNDCLOUD_LINK"), username, password,
-                                                     all_downloaded_audios_info, result_from_soundcloud)
-                                               )
-                    soundcloud_thread.start()
-                    print(soundcloud_thread.name + " started !\n")
-                    # Ajouter le thread à la liste des threads Soundcloud
-                    all_soundcloud_threads.append(soundcloud_thread)
+                    if bot_pool:
+                        # Les chansons sont envoyées au processus du bot sous forme de dictionnaires
+                        bot_pool.submit("soundcloud", {
+                            "link": os.getenv("SOUNDCLOUD_LINK"), "username": username, "password": password,
+                            "tracks": [track.to_dict() for track in all_downloaded_audios_info]})
+                        print(f"\nSoundcloud account: {username} queued on the bot processes !\n")
+                    else:
+                        driver = soundcloud_browsers.driver_for(username)
+
+                        # Créer un thread Soundcloud qui exécute la fonction run_soundcloud_bot avec les arguments
+                        soundcloud_thread = Thread(name=f"\nSoundcloud account: {username}", daemon=True,
+                                                   target=run_soundcloud_bot,
+                                                   args=(driver, os.getenv("SOUNDCLOUD_LINK"), username, password,
+                                                         all_downloaded_audios_info, result_bus)
+                                                   )
+                        soundcloud_thread.start()
+                        print(soundcloud_thread.name + " started !\n")
+                        # Ajouter le thread à la liste des threads Soundcloud
+                        all_soundcloud_threads.append(soundcloud_thread)
                     time.sleep(2)
                     break
 
                 # Attendre que tous les threads Soundcloud se terminent
                 for soundcloud_thread in all_soundcloud_threads:
-                    soundcloud_thread.join()
+                    supervisor.join(soundcloud_thread)
+                if bot_pool:
+                    wait_for_bot_pool(bot_pool, supervisor)
 
                 # Vérifier si on a atteint la fin de la liste des comptes Soundcloud
                 if soundcloud_end_index >= len(all_soundcloud_account):
@@ -138,8 +187,14 @@ def automation_process():
                 soundcloud_start_index = soundcloud_end_index
                 soundcloud_end_index += Settings.CONCURRENT_PROCESS
 
-        # Supprimer les fichiers téléchargés
-        delete_downloaded_files()
+        # Seules les chansons présentes sur tous les comptes lancés sont confirmées. Les autres restent protégées
+        result_bus.unsubscribe(batch_results_queue)
+        results_by_account = {result.account: result for result in result_bus.drain(batch_results_queue)}
+        all_uploaded_tracks = [track for track in all_downloaded_audios_info if all_started_usernames and all(
+            track.key() in getattr(results_by_account.get(username), "track_keys", ())
+            for username in all_started_usernames)]
+        # Les fichiers téléversés seront supprimés par le nettoyage en arrière-plan
+        janitor.confirm_uploaded(all_uploaded_tracks)
 
         # Vérifier si on a atteint la fin de la liste des comptes Suno
         if suno_end_index >= len(all_suno_accounts):
@@ -152,26 +207,133 @@ def automation_process():
 
     print("\nSending Message...")
     # Envoyer le rapport statistique pour le processus de la journée entière
-    # Fusionner les résultats de Soundcloud par compte
-    merged_soundcloud_result = []
-    for result in result_from_soundcloud:
-        for each in merged_soundcloud_result:
-            if result["account"] == each["account"]:
-                result["upload_count"] += each["upload_count"]
-                result["monetization_count"] += each["monetization_count"]
-                merged_soundcloud_result.remove(each)
-
-        merged_soundcloud_result.append(result)
-
+    # send_daily_statistics fusionne les résultats de Soundcloud par compte
     send_daily_statistics(no_of_all_downloads, len(
-        all_suno_accounts), genre_used, merged_soundcloud_result)
+        all_suno_accounts), genre_used, result_bus.drain(soundcloud_results_queue))
+
+    print("\n" + memory_watchdog.report())
+    print(pacer.report())
+    if bot_pool:
+        bot_pool.close(Settings.CANCEL_GRACE_SECS)
+        print(bot_pool.report())
+    supervisor.stop()
+    print(supervisor.report())
+    janitor.stop()
+    print(janitor.report())
+    if status_server:
+        status_server.shutdown()
 
     print("\nDone !\n")
 
 
-# Exécuter la fonction d'automatisation
-try:
-    automation_process()
-except Exception as e:
-    print("\nError on main.py : ", e)
-    traceback.print_exc()  # print the full traceback
+def wait_for_bot_pool(bot_pool, supervisor):
+    """
+    Wait for the bots queued on the worker processes, at most until the run deadline and the grace period
+    :param bot_pool: BotProcessPool
+    :param supervisor: Supervisor of the run
+    """
+    remaining_secs = supervisor.remaining_secs()
+    if not bot_pool.wait(None if remaining_secs is None else remaining_secs + Settings.CANCEL_GRACE_SECS):
+        print("Giving up on the bot processes still running after the run deadline\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Suno track generation and SoundCloud upload automation")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Print the import time of the heavy modules and exit")
+    parser.add_argument("--mode", choices=["local", "coordinator", "worker"], default="local",
+                        help="local runs every account on this host. coordinator/worker share them over a work queue")
+    parser.add_argument("--queue-host", default=Settings.WORK_QUEUE_HOST,
+                        help="Work queue address of the coordinator. The coordinator listens on it: use an address "
+                             "the workers can reach when they run on other hosts")
+    parser.add_argument("--queue-port", type=int, default=Settings.WORK_QUEUE_PORT)
+    parser.add_argument("--worker-id", help="Unique worker name. Defaults to hostname-pid")
+    parser.add_argument("--profile", action="store_true",
+                        help="Sample the stacks of the bot threads and write a flame graph file and a hot spot report")
+    parser.add_argument("--profile-rate", type=int, default=Settings.PROFILE_SAMPLE_RATE, help="Samples per second")
+    parser.add_argument("--status", action="store_true", default=Settings.STATUS_SERVER,
+                        help="Serve the live status of the run on a local HTTP page")
+    parser.add_argument("--status-port", type=int, default=Settings.STATUS_SERVER_PORT)
+    parser.add_argument("--bot-execution", choices=["threads", "processes"], default=Settings.BOT_EXECUTION,
+                        help="Run every bot in a thread, or in its own worker process restarted if it crashes")
+    subparsers = parser.add_subparsers(dest="command",
+                                       help="Run one stage over the stage queue. Without it the whole flow runs")
+    for name, help_text in (("generate", "Generate and download suno tracks and queue them for upload"),
+                            ("upload", "Upload the queued tracks to every soundcloud account"),
+                            ("sync", "Sync the queued soundcloud accounts for monetization"),
+                            ("monetize", "Monetize the new tracks of the queued soundcloud accounts"),
+                            ("report", "Print the stage queue and the results")):
+        stage_parser = subparsers.add_parser(name, help=help_text)
+        if name == "report":
+            continue
+        stage_parser.add_argument("--concurrency", type=int,
+                                  help="Max no of accounts at the same time. Defaults to Settings.STAGE_CONCURRENCY")
+        stage_parser.add_argument("--every", type=int, help="Run the stage again every EVERY secs")
+        if name in ("sync", "monetize"):
+            stage_parser.add_argument("--all", action="store_true",
+                                      help="Run on every soundcloud account, not only the queued ones")
+    refresh_parser = subparsers.add_parser(
+        "refresh-sessions", help="Sign in ahead of the run the accounts whose saved session expires soon")
+    refresh_parser.add_argument("--platform", choices=["suno", "soundcloud"],
+                                help="Only refresh this platform. Both if not set")
+    refresh_parser.add_argument("--concurrency", type=int, help="Max no of accounts at the same time. "
+                                                                "Defaults to Settings.SESSION_REFRESH_CONCURRENCY")
+    refresh_parser.add_argument("--every", type=int, help="Refresh again every EVERY secs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.startup_report:
+        from startup import report_import_times
+        report_import_times()
+    else:
+        # Charger les variables d'environnement
+        load_dotenv()
+
+        print("Started !\n")
+
+        # Échantillonner les piles des threads pendant toute la journée
+        profiler = None
+        if args.profile:
+            from profiler import SamplingProfiler
+            profiler = SamplingProfiler(args.profile_rate).start()
+
+        # Proxy local partagé par tous les chrome, qui met en cache les fichiers JS/CSS/polices des sites
+        asset_proxy = None
+        if Settings.ASSET_PROXY and args.mode != "coordinator" and args.command != "report":
+            from asset_proxy import start_asset_proxy
+            asset_proxy = start_asset_proxy()
+
+        # Exécuter la fonction d'automatisation
+        try:
+            if args.command == "refresh-sessions":
+                from session_refresher import PLATFORMS, run_session_refresh
+                run_session_refresh([args.platform] if args.platform else PLATFORMS, args.concurrency, args.every)
+            elif args.command:
+                from stages import run_stage
+                run_stage(args.command, getattr(args, "concurrency", None), getattr(args, "every", None),
+                          getattr(args, "all", False))
+            elif args.mode == "coordinator":
+                from sharding import run_coordinator
+                run_coordinator(args.queue_host, args.queue_port)
+            elif args.mode == "worker":
+                from sharding import run_worker
+                from work_queue import QueueClient
+                prepare_driver()
+                run_worker(QueueClient(args.queue_host, args.queue_port), args.worker_id)
+            else:
+                automation_process(args.status_port if args.status else None, args.bot_execution)
+        except Exception as e:
+            print("\nError on main.py : ", e)
+            traceback.print_exc()  # print the full traceback
+        finally:
+            if asset_proxy:
+                from asset_proxy import stop_asset_proxy
+                print("\n" + asset_proxy.report())
+                stop_asset_proxy()
+            if profiler:
+                profiler.stop()
+                print("\n" + profiler.report())
+                print(f"\nProfile saved to {profiler.save()}.collapsed / .txt")
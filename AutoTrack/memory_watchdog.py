@@ -0,0 +1,266 @@
+"""
+Tracks the memory used by each driver chrome process tree and recycles the bloated ones.
+
+The watchdog only flags a driver. The bots call recycle_if_needed() between two steps, where their
+progress is kept, so the browser is restarted with the saved session and the bot carries on.
+The accounts sharing a chrome (browser_contexts.SharedBrowser) are measured together, against the sum of their
+limits, and only one of them renews its browser context at a time.
+"""
+import os
+import signal
+import threading
+
+from settings import Settings
+from browser_contexts import ContextDriver
+from helpers import logger
+
+
+def get_driver_pids(driver) -> list:
+    """
+    In uc mode chrome is started by python, not by chromedriver, so it is not in the chromedriver process tree
+    :param driver: Seleniumbase webdriver
+    :return: The pids of the chromedriver and chrome processes of the driver. Empty if unknown
+    """
+    all_pids = []
+    for get_pid in (lambda: driver.service.process.pid, lambda: driver.browser_pid):
+        try:
+            pid = get_pid()
+        except AttributeError:
+            continue
+        if pid and pid not in all_pids:
+            all_pids.append(pid)
+    return all_pids
+
+
+def get_browser_name(name, driver) -> str:
+    """
+    :param name: Account the driver is registered with
+    :param driver: Seleniumbase webdriver or ContextDriver
+    :return: Name the chrome of the driver is measured under. The accounts of a shared browser share it
+    """
+    return driver._browser.name if isinstance(driver, ContextDriver) else name
+
+
+def get_process_tree(pid) -> list:
+    """
+    List processes and all their descendants. Only available on linux (reads /proc)
+    :param pid: Root process id, or list of root process ids e.g. from get_driver_pids()
+    :return: List of pids, each once
+    """
+    all_pids = list(pid) if isinstance(pid, (list, tuple)) else [pid]
+    for parent_pid in all_pids:
+        try:
+            for task in os.listdir(f"/proc/{parent_pid}/task"):
+                with open(f"/proc/{parent_pid}/task/{task}/children", "r") as file:
+                    all_pids += [int(child_pid) for child_pid in file.read().split()
+                                 if int(child_pid) not in all_pids]
+        except OSError:
+            continue
+    return all_pids
+
+
+def get_process_tree_rss(pid) -> int:
+    """
+    :param pid: Root process id or list of root process ids
+    :return: Resident memory in bytes of the process and all its descendants
+    """
+    total_rss = 0
+    for each_pid in get_process_tree(pid):
+        try:
+            with open(f"/proc/{each_pid}/status", "r") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total_rss += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total_rss
+
+
+def get_process_tree_cpu_secs(pid) -> float:
+    """
+    :param pid: Root process id or list of root process ids
+    :return: CPU time in secs (user + system) used so far by the process and all its descendants
+    """
+    total_ticks = 0
+    for each_pid in get_process_tree(pid):
+        try:
+            with open(f"/proc/{each_pid}/stat", "r") as file:
+                # The process name may contain spaces, the fields are counted from its closing parenthesis
+                all_fields = file.read().rsplit(")", 1)[1].split()
+            total_ticks += int(all_fields[11]) + int(all_fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return total_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def kill_process_tree(pid) -> int:
+    """
+    Kill a process and all its descendants, the youngest first
+    :param pid: Root process id or list of root process ids
+    :return: No of processes killed
+    """
+    no_of_killed = 0
+    for each_pid in reversed(get_process_tree(pid)):
+        try:
+            os.kill(each_pid, signal.SIGKILL)
+            no_of_killed += 1
+        except OSError:
+            continue
+    return no_of_killed
+
+
+class MemoryWatchdog:
+    """
+    Periodically measures the RSS of every registered driver and flags the ones above the memory limit
+    """
+
+    def __init__(self, limit_mb=Settings.DRIVER_MEMORY_LIMIT_MB, interval=Settings.MEMORY_WATCHDOG_INTERVAL):
+        self.limit = limit_mb * 1024 * 1024
+        self.interval = interval
+        self.drivers = {}
+        # Measured chromes: {browser name: webdriver}, and the accounts running in each of them
+        self.browsers = {}
+        self.browser_accounts = {}
+        # Every account a browser has run, kept for the report once they are unregistered
+        self._all_browser_accounts = {}
+        self.peaks = {}
+        self.recycles = {}
+        self._flagged = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """ Start the watchdog thread if it is not running yet """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._watch, name="Memory watchdog", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def register(self, name, driver):
+        """
+        Watch a driver
+        :param name: Unique name of the driver. e.g. the account username
+        :param driver: Seleniumbase webdriver or ContextDriver
+        """
+        browser_name = get_browser_name(name, driver)
+        with self._lock:
+            self.drivers[name] = driver
+            self._flagged.discard(name)
+            self.browsers[browser_name] = driver._browser.driver if isinstance(driver, ContextDriver) else driver
+            for accounts in (self.browser_accounts.setdefault(browser_name, []),
+                             self._all_browser_accounts.setdefault(browser_name, [])):
+                if name not in accounts:
+                    accounts.append(name)
+        self.start()
+
+    def unregister(self, name):
+        with self._lock:
+            self.drivers.pop(name, None)
+            self._flagged.discard(name)
+            for browser_name, accounts in list(self.browser_accounts.items()):
+                if name in accounts:
+                    accounts.remove(name)
+                if not accounts:
+                    self.browsers.pop(browser_name, None)
+                    self.browser_accounts.pop(browser_name)
+
+    def get_browsers(self) -> list:
+        """
+        :return: List of (browser name, webdriver, accounts) of the measured chromes
+        """
+        with self._lock:
+            return [(browser_name, driver, list(self.browser_accounts[browser_name]))
+                    for browser_name, driver in self.browsers.items()]
+
+    def needs_recycle(self, name) -> bool:
+        with self._lock:
+            return name in self._flagged
+
+    def check(self):
+        """ Measure every chrome once """
+        for browser_name, driver, accounts in self.get_browsers():
+            all_pids = get_driver_pids(driver)
+            if not all_pids:
+                continue
+            rss = get_process_tree_rss(all_pids)
+            with self._lock:
+                self.peaks[browser_name] = max(self.peaks.get(browser_name, 0), rss)
+                # Chrome is measured again after the flagged account restarted, before flagging another one
+                accounts = [name for name in accounts if name in self.drivers]
+                if not accounts or rss <= self.limit * len(accounts) or self._flagged.intersection(accounts):
+                    continue
+                name = min(accounts, key=lambda account: self.recycles.get(account, 0))
+                logger.warning(f"Driver {browser_name} uses {rss / 1024 ** 2:.0f}MB. {name} flagged for restart")
+                self._flagged.add(name)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.info(f"Memory watchdog error: {e}")
+
+    def report(self) -> str:
+        """
+        :return: The memory high-water mark and number of restarts of every chrome
+        """
+        lines = ["Driver memory high-water marks:"]
+        for browser_name, peak in sorted(self.peaks.items(), key=lambda x: x[1], reverse=True):
+            accounts = self._all_browser_accounts.get(browser_name, [])
+            no_of_recycles = sum(self.recycles.get(name, 0) for name in accounts)
+            if accounts != [browser_name]:
+                browser_name += f" ({', '.join(accounts)})"
+            lines.append(f"  {browser_name}: {peak / 1024 ** 2:.0f}MB, restarted {no_of_recycles} times")
+        return "\n".join(lines)
+
+
+memory_watchdog = MemoryWatchdog()
+
+
+def recycle_if_needed(bot, platform, account) -> bool:
+    """
+    Restart the bot browser if the watchdog flagged it. The session cookies are saved first, loaded in the
+    new browser and the current page is opened again. If the cookies can not be loaded, the bot signs in again
+    with the credentials of its last login.
+    In a shared browser only the context of the account is renewed, chrome keeps running for the other accounts.
+    :param bot: SunoAI or SoundCloud bot instance. Its driver attribute is replaced
+    :param platform: suno / soundcloud
+    :param account: Account username the driver is registered with
+    :return: True if the browser has been restarted
+    """
+    from helpers import create_driver
+    from utils import save_cookies, load_cookies
+
+    if not memory_watchdog.needs_recycle(account):
+        return False
+
+    print(f"Restarting the browser of {account} to free memory ...\n")
+    current_url = bot.driver.current_url
+    save_cookies(bot.driver, platform, account)
+    if isinstance(bot.driver, ContextDriver):
+        bot.driver = bot.driver._browser.renew_context(account)
+    else:
+        bot.driver.quit()
+        bot.driver = create_driver(platform, account=account)
+    bot.driver.get(Settings.SUNO_BASE_URL if platform == "suno" else Settings.SOUND_CLOUD_BASE_URL)
+    try:
+        is_restored = load_cookies(bot.driver, platform, account)
+    except Exception as e:
+        print(f"Unable to load the cookies of {account}: {e}")
+        is_restored = False
+    if not is_restored:
+        logger.warning(f"Signing in again to {platform} with {account} after the browser restart")
+        login = bot.login if platform == "soundcloud" else bot.sign_in
+        if not bot.login_args or not login(*bot.login_args, use_cookies=False):
+            raise RuntimeError(f"Unable to sign in again to {platform} with {account} after the browser restart")
+    bot.driver.get(current_url)
+
+    memory_watchdog.register(account, bot.driver)
+    memory_watchdog.recycles[account] = memory_watchdog.recycles.get(account, 0) + 1
+    return True
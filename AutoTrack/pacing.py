@@ -0,0 +1,132 @@
+"""
+Request pacing shared by every bot thread of the process, so concurrent accounts do not hit a site in bursts.
+
+Each (platform, operation) of Settings.PACING_RATES has a token bucket: at most `burst` calls at once, then
+`per_minute` calls a minute. The bots call pace() before the browser actions and HTTP calls that reach the sites
+(login, create, download, upload, sync, monetize). A call without a token waits its turn, and the time waited is
+kept per bucket for the end of run report. A long wait keeps sending heartbeats, so the supervisor sees it as progress.
+"""
+import threading
+import time
+
+from run_state import heartbeat
+from settings import Settings
+
+# Max no of secs between two heartbeats while waiting for a token
+HEARTBEAT_SECS = 5
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute, burst):
+        """
+        :param per_minute: No of tokens added every minute
+        :param burst: Max no of tokens available at once
+        """
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1) -> float:
+        """
+        Take tokens, ahead of time if there are not enough. The later callers wait for them too
+        :param tokens: No of tokens to take
+        :return: No of secs the caller has to wait before using its tokens
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.burst)
+            self.updated_at = now
+            self.tokens -= tokens
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class Pacer:
+
+    def __init__(self, all_rates=Settings.PACING_RATES):
+        """
+        :param all_rates: {platform: {operation: (per minute, burst)}}
+        """
+        self.all_rates = all_rates
+        self.share = 1
+        self.buckets = {}
+        # (platform, operation) -> {"calls", "waits", "wait_secs", "max_wait_secs"}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def set_share(self, share):
+        """
+        Give this process 1 / share of the rates, e.g. in each of the share worker processes of a run
+        :param share: No of processes sharing the rates
+        """
+        with self._lock:
+            self.share = max(share, 1)
+            self.buckets = {}
+
+    def get_bucket(self, platform, operation):
+        """
+        :return: TokenBucket of the operation, None if its rate is not set
+        """
+        with self._lock:
+            key = (platform, operation)
+            if key not in self.buckets:
+                rate = self.all_rates.get(platform, {}).get(operation)
+                self.buckets[key] = TokenBucket(rate[0] / self.share, max(rate[1] // self.share, 1)) if rate else None
+            return self.buckets[key]
+
+    def pace(self, platform, operation, tokens=1) -> float:
+        """
+        Wait until the operation may be done
+        :param platform: suno / soundcloud
+        :param operation: login / create / download / upload / sync / monetize
+        :param tokens: No of calls the operation makes, e.g. the no of tracks of an upload
+        :return: No of secs waited
+        """
+        bucket = self.get_bucket(platform, operation) if Settings.PACING else None
+        wait_secs = bucket.reserve(tokens) if bucket else 0
+        waited_until = time.monotonic() + wait_secs
+        while time.monotonic() < waited_until:
+            heartbeat()
+            time.sleep(min(waited_until - time.monotonic(), HEARTBEAT_SECS))
+        with self._lock:
+            stats = self.stats.setdefault((platform, operation),
+                                          {"calls": 0, "waits": 0, "wait_secs": 0.0, "max_wait_secs": 0.0})
+            stats["calls"] += tokens
+            stats["waits"] += wait_secs > 0
+            stats["wait_secs"] += wait_secs
+            stats["max_wait_secs"] = max(stats["max_wait_secs"], wait_secs)
+        return wait_secs
+
+    def get_stats(self) -> list:
+        """
+        :return: List of {"platform", "operation", "calls", "waits", "wait_secs", "max_wait_secs"}
+        """
+        with self._lock:
+            return [{"platform": platform, "operation": operation, **stats}
+                    for (platform, operation), stats in sorted(self.stats.items())]
+
+    def report(self) -> str:
+        """
+        :return: Time spent waiting on every bucket
+        """
+        all_stats = self.get_stats()
+        if not all_stats:
+            return "Pacing: no paced calls"
+        lines = [f"Pacing: {sum(stats['wait_secs'] for stats in all_stats) / 60:.1f} min waited in total"]
+        for stats in all_stats:
+            lines.append(f"  {stats['platform']} {stats['operation']}: {stats['calls']} calls, "
+                         f"{stats['waits']} waited, {stats['wait_secs']:.0f}s in total, "
+                         f"{stats['max_wait_secs']:.0f}s at most")
+        return "\n".join(lines)
+
+
+pacer = Pacer()
+
+
+def pace(platform, operation, tokens=1) -> float:
+    """
+    Wait until the operation may be done, see Pacer.pace
+    """
+    return pacer.pace(platform, operation, tokens)
@@ -0,0 +1,257 @@
+"""
+Pool of worker processes running the bots, one bot at a time per process (Settings.BOT_EXECUTION = "processes").
+
+Each bot gets its own interpreter, with no GIL or memory shared with the other accounts, and its chrome is a child
+of its worker. The worker publishes the records of the bot on a local ResultBus forwarded to the parent over a pipe
+as compact (kind, values) tuples. They are written right away, so a worker that crashes later does not lose them.
+The parent publishes them again on the run ResultBus, so the rest of the run works the same as in thread mode.
+Each worker runs its own Supervisor for the stalls and the stage budgets of its bot, and paces its calls with an
+equal share of Settings.PACING_RATES. A worker that dies, or still
+runs a bot Settings.CANCEL_GRACE_SECS after its account budget, is killed with its chrome and replaced.
+Its task is recorded as failed, it is not run again: a suno task spends credits.
+"""
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+import traceback
+from dataclasses import astuple
+
+from helpers import logger
+from memory_watchdog import kill_process_tree
+from records import RECORD_TYPES, TrackRecord
+from result_bus import ResultBus
+from settings import Settings
+
+# No of secs between two checks of the workers
+POLL_INTERVAL = 0.5
+
+
+class RecordForwarder:
+    """ Subscriber of the worker ResultBus sending the records to the parent process """
+
+    def __init__(self, connection, task_id):
+        self.connection = connection
+        self.task_id = task_id
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        # Les threads du bot publient en même temps
+        with self._lock:
+            self.connection.send(message)
+
+    def put(self, record, timeout=None):
+        self.send(("record", self.task_id, record.KIND, astuple(record)))
+
+
+def run_bot_task(kind, payload, result_bus):
+    """
+    Run a bot in the worker process
+    :param kind: suno / soundcloud
+    :param payload: Account and work of the bot
+    :param result_bus: ResultBus of the worker
+    """
+    from helpers import create_driver
+
+    if kind == "suno":
+        from sunodownloads.suno_ai_spider import run_suno_bot
+        run_suno_bot(create_driver("suno", account=payload["username"]), payload["username"], payload["password"],
+                     payload["prompts"], result_bus)
+    elif kind == "soundcloud":
+        from soundcloud_uploads.soundcloud import run_soundcloud_bot
+        run_soundcloud_bot(create_driver("soundcloud", account=payload["username"]), payload["link"],
+                           payload["username"], payload["password"],
+                           [TrackRecord.from_dict(track) for track in payload["tracks"]], result_bus)
+    else:
+        raise ValueError(f"Unknown bot task {kind}")
+
+
+def _worker_main(inbox, connection, runner, deadline, no_of_workers):
+    """ Run the tasks sent to this worker until it gets None """
+    from pacing import pacer
+    from supervisor import Supervisor
+
+    # Les workers se partagent les débits de Settings.PACING_RATES
+    pacer.set_share(no_of_workers)
+
+    # Le superviseur du processus parent ne voit pas les threads des workers
+    supervisor = Supervisor(deadline_secs=max(deadline - time.time(), 1) if deadline else None).start()
+    while True:
+        task = inbox.get()
+        if task is None:
+            supervisor.stop()
+            return
+        task_id, kind, payload = task
+        result_bus = ResultBus(journal_path=None)
+        forwarder = RecordForwarder(connection, task_id)
+        result_bus.forward(forwarder)
+        try:
+            runner(kind, payload, result_bus)
+            error = None
+        except BaseException as e:
+            traceback.print_exc()
+            error = repr(e)
+        forwarder.send(("done", task_id, error))
+
+
+class BotProcessPool:
+
+    def __init__(self, result_bus, no_of_processes=Settings.CONCURRENT_PROCESS, runner=run_bot_task,
+                 task_timeout=Settings.ACCOUNT_BUDGET_SECS, deadline_secs=Settings.RUN_DEADLINE_SECS):
+        """
+        :param result_bus: ResultBus of the run. The records of the bots are published on it
+        :param no_of_processes: No of worker processes, i.e. of bots running at the same time
+        :param runner: Module level function(kind, payload, result_bus) running a task in a worker
+        :param task_timeout: No of secs after which the bot of a task is cancelled. No limit if None
+        :param deadline_secs: No of secs the bots may run from now. No deadline if None
+        """
+        self.result_bus = result_bus
+        self.runner = runner
+        self.no_of_processes = no_of_processes
+        # Le bot annulé a CANCEL_GRACE_SECS pour s'arrêter avant que son worker soit tué
+        self.task_timeout = task_timeout + Settings.CANCEL_GRACE_SECS if task_timeout else None
+        self.deadline = time.time() + deadline_secs if deadline_secs else None
+        # Chrome and its threads do not survive a fork
+        self._context = multiprocessing.get_context("spawn")
+        # Worker no -> {"process", "inbox", "connection", "task_id", "started_at"}
+        self.workers = {}
+        # (task id, kind, payload) waiting for a free worker
+        self.pending_tasks = []
+        self.failed_tasks = {}
+        self.no_of_done_tasks = 0
+        self.no_of_restarts = 0
+        self._next_task_id = 0
+        self._no_of_open_tasks = 0
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        for worker_no in range(no_of_processes):
+            self._start_worker(worker_no)
+        self._thread = threading.Thread(target=self._run, name="bot process pool", daemon=True)
+        self._thread.start()
+
+    def _start_worker(self, worker_no):
+        inbox = self._context.Queue()
+        connection, child_connection = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker_main,
+                                        args=(inbox, child_connection, self.runner, self.deadline,
+                                              self.no_of_processes),
+                                        name=f"bot-worker-{worker_no}", daemon=True)
+        process.start()
+        # La fin du pipe du worker n'est gardée que par lui, pour que sa lecture finisse quand il meurt
+        child_connection.close()
+        self.workers[worker_no] = {"process": process, "inbox": inbox, "connection": connection, "task_id": None,
+                                   "started_at": None}
+
+    def submit(self, kind, payload) -> int:
+        """
+        Queue a bot run
+        :param kind: suno / soundcloud
+        :param payload: Picklable account and work of the bot
+        :return: Task id
+        """
+        with self._condition:
+            self._next_task_id += 1
+            self.pending_tasks.append((self._next_task_id, kind, payload))
+            self._no_of_open_tasks += 1
+            return self._next_task_id
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Wait for every submitted task to be done or failed
+        :return: False if the timeout was reached first
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._no_of_open_tasks == 0, timeout)
+
+    def _task_finished(self, worker_no, error=None):
+        with self._condition:
+            worker = self.workers[worker_no]
+            if error:
+                self.failed_tasks[worker["task_id"]] = error
+                print(f"\nBot task {worker['task_id']} failed on worker {worker_no}: {error}\n")
+            else:
+                self.no_of_done_tasks += 1
+            worker["task_id"] = None
+            self._no_of_open_tasks -= 1
+            self._condition.notify_all()
+
+    def _handle_message(self, worker_no, message):
+        if message[0] == "record":
+            _, _, kind, values = message
+            self.result_bus.publish(RECORD_TYPES[kind](*values))
+        elif message[0] == "done" and self.workers[worker_no]["task_id"] == message[1]:
+            self._task_finished(worker_no, message[2])
+
+    def _read_messages(self, all_worker_nos, timeout=0):
+        """
+        Handle the messages waiting from the workers
+        :param all_worker_nos: Workers to read from
+        :param timeout: Max no of secs to wait for a first message
+        """
+        connections = {self.workers[worker_no]["connection"]: worker_no for worker_no in all_worker_nos}
+        for connection in multiprocessing.connection.wait(list(connections), timeout):
+            try:
+                while connection.poll():
+                    self._handle_message(connections[connection], connection.recv())
+            except (EOFError, OSError):
+                continue
+
+    def _check_workers(self):
+        for worker_no, worker in list(self.workers.items()):
+            process = worker["process"]
+            is_late = (worker["task_id"] and self.task_timeout
+                       and time.time() - worker["started_at"] > self.task_timeout)
+            if process.is_alive() and not is_late:
+                continue
+            # Les enregistrements déjà envoyés par le worker sont lus avant de le remplacer
+            self._read_messages([worker_no])
+            if worker["task_id"] is None and process.is_alive():
+                continue
+            reason = "timed out" if is_late else f"worker exited with code {process.exitcode}"
+            kill_process_tree(process.pid)
+            process.join(5)
+            worker["connection"].close()
+            logger.warning(f"Bot worker {worker_no} replaced: {reason}")
+            if worker["task_id"] is not None:
+                self._task_finished(worker_no, reason)
+            self.no_of_restarts += 1
+            self._start_worker(worker_no)
+
+    def _assign_tasks(self):
+        with self._condition:
+            for worker_no, worker in self.workers.items():
+                if not self.pending_tasks:
+                    return
+                if worker["task_id"] is None:
+                    task = self.pending_tasks.pop(0)
+                    worker["task_id"] = task[0]
+                    worker["started_at"] = time.time()
+                    worker["inbox"].put(task)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._read_messages(list(self.workers), POLL_INTERVAL)
+                self._check_workers()
+                self._assign_tasks()
+            except Exception as e:
+                logger.info(f"Bot process pool error: {e}")
+
+    def close(self, timeout=None):
+        """
+        Stop the workers once their current task is done
+        :param timeout: Max no of secs to wait for the tasks. The workers still running are killed after it
+        """
+        self.wait(timeout)
+        self._stop_event.set()
+        self._thread.join()
+        for worker in self.workers.values():
+            worker["inbox"].put(None)
+        for worker in self.workers.values():
+            worker["process"].join(Settings.TIMEOUT)
+            if worker["process"].is_alive():
+                kill_process_tree(worker["process"].pid)
+
+    def report(self) -> str:
+        return (f"Bot processes: {self.no_of_done_tasks} tasks done, {len(self.failed_tasks)} failed, "
+                f"{self.no_of_restarts} workers restarted")
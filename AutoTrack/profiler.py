@@ -0,0 +1,158 @@
+"""
+Sampling profiler for whole runs: python main.py --profile
+
+A background thread reads the stack of every other thread at Settings.PROFILE_SAMPLE_RATE samples per second.
+Each sample is tagged with the account and stage of its thread from run_state. At the end of the run it writes
+  - <name>.collapsed: one "account;stage;frame;frame... count" line per stack, for flamegraph.pl / speedscope
+  - <name>.txt: the hottest functions, split between running python code and waiting (sleep, socket, locks)
+Nothing is traced between two samples, so the cost stays the same whatever the bots do.
+"""
+import linecache
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from run_state import get_all_states
+from settings import Settings
+
+# A leaf frame in these modules is waiting on I/O or on another thread
+WAIT_MODULES = {"socket.py", "ssl.py", "selectors.py", "threading.py", "queue.py", "client.py", "connection.py",
+                "subprocess.py"}
+# A leaf frame on a line with one of these calls is blocked in C code (time.sleep, lock.acquire ...)
+WAIT_CALLS = ("sleep(", ".wait(", ".acquire(", "select(")
+# (code, line no) -> is a wait site. Saves reading the source line on every sample
+_wait_frames_cache = {}
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def is_wait_frame(frame) -> bool:
+    """ Tell if the innermost python frame of a thread is waiting rather than running python code """
+    key = (frame.f_code, frame.f_lineno)
+    if key not in _wait_frames_cache:
+        line = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+        _wait_frames_cache[key] = (os.path.basename(frame.f_code.co_filename) in WAIT_MODULES
+                                   or any(call in line for call in WAIT_CALLS))
+    return _wait_frames_cache[key]
+
+
+class SamplingProfiler:
+
+    def __init__(self, sample_rate=Settings.PROFILE_SAMPLE_RATE):
+        """
+        :param sample_rate: No of samples taken per second
+        """
+        self.interval = 1 / sample_rate
+        # "account;stage;frame;..." -> no of samples
+        self.collapsed = Counter()
+        # Innermost frame -> no of samples, for the python code and the waits
+        self.cpu_functions = Counter()
+        self.wait_sites = Counter()
+        # Any frame of the stack -> no of samples
+        self.inclusive_functions = Counter()
+        self.stage_samples = Counter()
+        self.no_of_samples = 0
+        self.sampling_secs = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        self.stopped_at = time.time()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            started_at = time.perf_counter()
+            self.sample()
+            self.sampling_secs += time.perf_counter() - started_at
+
+    def sample(self):
+        """ Record the current stack of every thread but the profiler """
+        all_states = get_all_states()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == threading.get_ident():
+                continue
+            state = all_states.get(thread_id, {})
+            account = state.get("account") or thread_names.get(thread_id, str(thread_id)).strip()
+            stage = state.get("stage") or "-"
+
+            leaf = frame
+            all_frames = []
+            while frame:
+                all_frames.append(frame)
+                frame = frame.f_back
+            all_names = [frame_name(each) for each in reversed(all_frames)]
+            # The threading bootstrap frames are the same for every thread
+            while len(all_names) > 1 and all_names[0].startswith("threading.py:"):
+                all_names.pop(0)
+
+            self.collapsed[";".join([account, stage] + all_names)] += 1
+            self.stage_samples[f"{account} / {stage}"] += 1
+            for name in set(all_names):
+                self.inclusive_functions[name] += 1
+            if is_wait_frame(leaf):
+                self.wait_sites[f"{all_names[-1]}:{leaf.f_lineno}"] += 1
+            else:
+                self.cpu_functions[all_names[-1]] += 1
+        self.no_of_samples += 1
+
+    def write_collapsed(self, path):
+        """
+        :param path: File to write the collapsed stacks to
+        """
+        with open(path, "w") as file:
+            for stack, count in self.collapsed.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def report(self, top_n=Settings.PROFILE_TOP_N) -> str:
+        """
+        :param top_n: No of entries per table
+        :return: Text report of the hottest functions, wait sites and stages
+        """
+        duration = (self.stopped_at or time.time()) - self.started_at
+        total_cpu = sum(self.cpu_functions.values()) or 1
+        total_wait = sum(self.wait_sites.values()) or 1
+        lines = [
+            f"Profiled {duration:.0f}s, {self.no_of_samples} samples at {1 / self.interval:.0f}/s. "
+            f"Sampling overhead {self.sampling_secs / duration if duration else 0:.2%}",
+            f"Thread samples running python: {total_cpu}, waiting: {total_wait}",
+            "",
+            f"Top {top_n} functions running python (self samples):",
+        ]
+        lines += [f"  {count:>8} {count / total_cpu:>7.1%}  {name}" for name, count in self.cpu_functions.most_common(top_n)]
+        lines += ["", f"Top {top_n} wait sites:"]
+        lines += [f"  {count:>8} {count / total_wait:>7.1%}  {name}" for name, count in self.wait_sites.most_common(top_n)]
+        lines += ["", f"Top {top_n} functions (inclusive samples):"]
+        lines += [f"  {count:>8}  {name}" for name, count in self.inclusive_functions.most_common(top_n)]
+        lines += ["", "Samples per account / stage:"]
+        lines += [f"  {count:>8}  {name}" for name, count in sorted(self.stage_samples.items())]
+        return "\n".join(lines)
+
+    def save(self, output_dir=Settings.PROFILE_DIR) -> str:
+        """
+        Write the collapsed stacks and the report of the run
+        :param output_dir: Folder to write the files to
+        :return: Path of the files without extension
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        base_path = os.path.join(output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+        self.write_collapsed(base_path + ".collapsed")
+        with open(base_path + ".txt", "w") as file:
+            file.write(self.report())
+        return base_path
@@ -0,0 +1,109 @@
+"""
+Persistent chrome profiles, one per platform and account, so repeat runs start with a warm HTTP cache, the service
+workers already installed and the session still open (Settings.PERSISTENT_PROFILES).
+
+Before chrome starts on a profile, the caches are dropped when the profile is over Settings.PROFILE_MAX_MB or has not
+been compacted for PROFILE_COMPACT_INTERVAL_DAYS. Cookies and local storage are kept.
+The first page load of every launch is appended to Settings.PROFILE_LOAD_TIMES_FILE with the profile state
+(guest, cold, warm) so the gain can be compared with: python benchmarks.py profile-loads
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+from helpers import logger, read_page_load
+from settings import Settings
+
+# Profile folders that only hold caches. Chrome rebuilds them as needed
+CACHE_DIRS = [
+    "Default/Cache", "Default/Code Cache", "Default/GPUCache", "Default/Service Worker/CacheStorage",
+    "Default/Service Worker/ScriptCache", "GrShaderCache", "GraphiteDawnCache", "ShaderCache", "Crashpad",
+]
+# Lock files left behind by a chrome that did not quit cleanly
+SINGLETON_FILES = ["SingletonLock", "SingletonCookie", "SingletonSocket"]
+COMPACTED_MARKER = ".compacted_at"
+
+load_times_lock = threading.Lock()
+
+
+def get_profile_dir(platform, account) -> str:
+    return os.path.abspath(os.path.join(Settings.PROFILES_DIR, platform, account))
+
+
+def get_dir_size(directory) -> int:
+    size = 0
+    for root, _, all_names in os.walk(directory):
+        for name in all_names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def compact_profile(profile_dir, force=False) -> int:
+    """
+    Drop the caches of a profile that is over its size cap or due for its periodic compaction.
+    Chrome must not be running on it.
+    :param profile_dir: Profile folder
+    :param force: flag, compact whatever the size and the last compaction
+    :return: No of bytes freed
+    """
+    marker_path = os.path.join(profile_dir, COMPACTED_MARKER)
+    compacted_at = os.path.getmtime(marker_path) if os.path.exists(marker_path) else 0
+    size = get_dir_size(profile_dir)
+    is_due = time.time() - compacted_at > Settings.PROFILE_COMPACT_INTERVAL_DAYS * 24 * 3600
+    if not (force or size > Settings.PROFILE_MAX_MB * 1024 ** 2 or (is_due and compacted_at)):
+        if not compacted_at:
+            # Start the compaction period from the creation of the profile
+            open(marker_path, "w").close()
+        return 0
+
+    for cache_dir in CACHE_DIRS:
+        shutil.rmtree(os.path.join(profile_dir, cache_dir), ignore_errors=True)
+    open(marker_path, "w").close()
+    freed = size - get_dir_size(profile_dir)
+    logger.info(f"Compacted chrome profile {profile_dir}: {size} -> {size - freed} bytes")
+    return freed
+
+
+def prepare_profile(platform, account) -> tuple:
+    """
+    Get the profile folder of an account ready for chrome
+    :param platform: suno / soundcloud
+    :param account: Account username
+    :return: (profile folder, "warm" if the profile existed else "cold")
+    """
+    profile_dir = get_profile_dir(platform, account)
+    is_warm = os.path.isdir(os.path.join(profile_dir, "Default"))
+    os.makedirs(profile_dir, exist_ok=True)
+    for name in SINGLETON_FILES:
+        path = os.path.join(profile_dir, name)
+        if os.path.lexists(path):
+            os.remove(path)
+    compact_profile(profile_dir)
+    return profile_dir, "warm" if is_warm else "cold"
+
+
+def record_first_load(driver, platform, account):
+    """
+    Save the load time of the page just opened if it is the first one since the browser was launched.
+    create_driver sets the profile state of the launch on the driver: guest / cold (new profile) / warm
+    :param driver: Driver of the account
+    :param platform: suno / soundcloud
+    :param account: Account username
+    """
+    profile_state = getattr(driver, "_profile_state", None)
+    if profile_state is None:
+        return
+    driver._profile_state = None
+    try:
+        page_load = read_page_load(driver)
+    except Exception as e:
+        logger.info(f"Unable to read the page load of {account}: {e}")
+        return
+    page_load.update({"time": time.time(), "platform": platform, "account": account, "profile": profile_state})
+    with load_times_lock, open(Settings.PROFILE_LOAD_TIMES_FILE, "a") as file:
+        file.write(json.dumps(page_load) + "\n")
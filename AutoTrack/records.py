@@ -0,0 +1,53 @@
+"""
+Records passed between the bots: the tracks downloaded from suno and the results of the soundcloud bot
+"""
+from dataclasses import asdict, dataclass, field, fields
+from typing import ClassVar
+
+
+@dataclass(slots=True)
+class TrackRecord:
+    """ A track downloaded from suno, with what is needed to upload it """
+    KIND: ClassVar[str] = "track"
+
+    account: str
+    title: str
+    genre: str
+    tag_list: list = field(default_factory=list)
+    img_path: str = ""
+    audio_path: str = ""
+    clip_id: str = ""
+
+    def key(self) -> str:
+        """ Identifies the track in UploadResult.track_keys """
+        return self.clip_id or self.title
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{each.name: data[each.name] for each in fields(cls) if each.name in data})
+
+
+@dataclass(slots=True)
+class UploadResult:
+    """ Result of the soundcloud bot run on an account """
+    KIND: ClassVar[str] = "upload_result"
+
+    account: str = ""
+    upload_count: int = 0
+    monetization_count: int = 0
+    # TrackRecord.key() of the given tracks that are on the account: uploaded by this run or already there
+    track_keys: list = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{each.name: data[each.name] for each in fields(cls) if each.name in data})
+
+
+# KIND -> record class, to rebuild the records sent between processes
+RECORD_TYPES = {TrackRecord.KIND: TrackRecord, UploadResult.KIND: UploadResult}
@@ -0,0 +1,90 @@
+"""
+Thread-safe bus the bots publish their records to, instead of appending to shared lists.
+
+Every subscriber gets its own queue. A bounded subscriber queue blocks the publishers once it is full,
+so a slow consumer slows the producers down instead of piling up records in memory.
+Published records are also appended to the run journal.
+"""
+import json
+import queue
+import threading
+import time
+
+from settings import Settings
+
+
+class ResultBus:
+
+    def __init__(self, journal_path=Settings.RUN_JOURNAL):
+        """
+        :param journal_path: JSON lines file every published record is appended to. None disables the journal
+        """
+        self.journal_path = journal_path
+        self.published = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, kind=None, maxsize=0) -> queue.Queue:
+        """
+        :param kind: Only receive the records of this kind (TrackRecord.KIND, UploadResult.KIND). All if None
+        :param maxsize: Max no of records waiting in the queue. 0 for no limit
+        :return: The queue the records are delivered to
+        """
+        subscriber = queue.Queue(maxsize)
+        with self._lock:
+            self._subscribers.append((kind, subscriber))
+        return subscriber
+
+    def forward(self, subscriber, kind=None):
+        """
+        Deliver the records to an existing subscriber, e.g. one sending them to another process
+        :param subscriber: Object with a put(record, timeout) method
+        :param kind: Only forward the records of this kind. All if None
+        """
+        with self._lock:
+            self._subscribers.append((kind, subscriber))
+
+    def unsubscribe(self, subscriber):
+        """
+        Stop delivering records to a subscriber. The records already in its queue can still be drained
+        :param subscriber: Queue returned by subscribe(), or a subscriber given to forward()
+        """
+        with self._lock:
+            self._subscribers = [(kind, each) for kind, each in self._subscribers if each is not subscriber]
+
+    def publish(self, record, timeout=None):
+        """
+        Deliver a record to the subscribers. Blocks while a bounded subscriber queue is full
+        :param record: TrackRecord or UploadResult
+        :param timeout: Max no of secs to wait for a full subscriber. Raises queue.Full when exceeded
+        """
+        with self._lock:
+            self.published[record.KIND] = self.published.get(record.KIND, 0) + 1
+            all_subscribers = [subscriber for kind, subscriber in self._subscribers if kind in (None, record.KIND)]
+            if self.journal_path:
+                with open(self.journal_path, "a") as file:
+                    file.write(json.dumps({"time": time.time(), "kind": record.KIND, "record": record.to_dict()}) + "\n")
+
+        for subscriber in all_subscribers:
+            subscriber.put(record, timeout=timeout)
+
+    def queue_depths(self) -> list:
+        """
+        :return: List of (kind, no of records waiting, maxsize) of every subscriber queue
+        """
+        with self._lock:
+            return [(kind or "all", subscriber.qsize(), subscriber.maxsize) for kind, subscriber in self._subscribers
+                    if isinstance(subscriber, queue.Queue)]
+
+    @staticmethod
+    def drain(subscriber) -> list:
+        """
+        :param subscriber: Queue returned by subscribe()
+        :return: All the records waiting in the queue
+        """
+        all_records = []
+        while True:
+            try:
+                all_records.append(subscriber.get_nowait())
+            except queue.Empty:
+                return all_records
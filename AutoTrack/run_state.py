@@ -0,0 +1,113 @@
+"""
+Registry of what each bot thread is doing: the account it works for and its current stage
+(sign_in, generate, download, upload, monetize ...).
+
+The bots set their stage as they go and call heartbeat() in their wait loops. The profiler tags its samples with
+the stage, the supervisor cancels the threads over their time budget: their next heartbeat() raises RunCancelled.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Thread id -> {"account", "stage", "since", "account_since", "beat"}
+_thread_states = {}
+# Thread id -> reason the supervisor cancelled the thread for
+_cancelled = {}
+_lock = threading.Lock()
+
+
+class RunCancelled(BaseException):
+    """
+    Raised by heartbeat() in a cancelled thread. Not an Exception, so the retry and error handlers of the bots
+    let it through
+    """
+
+
+def set_stage(stage, account=None):
+    """
+    Set the stage of the calling thread
+    :param stage: Name of the stage
+    :param account: Account the thread works for. Keeps the previous one if None
+    """
+    thread_id = threading.get_ident()
+    with _lock:
+        previous_state = _thread_states.get(thread_id, {})
+        now = time.time()
+        is_same_account = account is None or account == previous_state.get("account")
+        _thread_states[thread_id] = {
+            "account": account or previous_state.get("account"),
+            "stage": stage,
+            "since": now,
+            "account_since": previous_state.get("account_since", now) if is_same_account else now,
+            "beat": now,
+        }
+        if not is_same_account:
+            # Une annulation visait le compte précédent du thread
+            _cancelled.pop(thread_id, None)
+
+
+def heartbeat():
+    """
+    Tell the supervisor the calling thread is still making progress
+    :raise RunCancelled: if the supervisor cancelled the thread. Raised once
+    """
+    thread_id = threading.get_ident()
+    with _lock:
+        if thread_id in _thread_states:
+            _thread_states[thread_id]["beat"] = time.time()
+        reason = _cancelled.pop(thread_id, None)
+    if reason:
+        raise RunCancelled(reason)
+
+
+def cancel(thread_id, reason):
+    """
+    Ask a thread to stop at its next heartbeat
+    :param thread_id: threading.get_ident() of the thread
+    :param reason: Why the thread is cancelled
+    """
+    with _lock:
+        _cancelled[thread_id] = reason
+
+
+@contextmanager
+def stage(name, account=None):
+    """
+    Run a block under a stage, then go back to the previous stage of the thread. The previous stage keeps its start
+    time, so its budget still counts the time spent in the block
+    """
+    thread_id = threading.get_ident()
+    previous_state = get_state(thread_id)
+    set_stage(name, account)
+    try:
+        yield
+    finally:
+        if previous_state:
+            with _lock:
+                _thread_states[thread_id] = {**previous_state, "beat": time.time()}
+        else:
+            clear_stage()
+
+
+def clear_stage():
+    """ Forget the calling thread, once its bot is done """
+    with _lock:
+        _thread_states.pop(threading.get_ident(), None)
+        _cancelled.pop(threading.get_ident(), None)
+
+
+def get_state(thread_id) -> dict:
+    """
+    :param thread_id: threading.get_ident() of a thread
+    :return: Copy of the state of the thread. Empty if it never set a stage
+    """
+    with _lock:
+        return dict(_thread_states.get(thread_id, {}))
+
+
+def get_all_states() -> dict:
+    """
+    :return: Dictionary of thread id to a copy of its state
+    """
+    with _lock:
+        return {thread_id: dict(state) for thread_id, state in _thread_states.items()}
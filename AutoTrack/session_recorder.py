@@ -0,0 +1,249 @@
+"""
+Record and replay of driver sessions.
+
+RecordingDriver wraps a seleniumbase driver and saves every command it receives (name, arguments, result,
+duration) to a JSON file. ReplayDriver serves a recording back without a browser so a full bot flow can be
+run offline and its command count and modeled latency compared between two versions of the code.
+
+Only the driver is replayed. HTTP calls the bots make on their own (e.g. track downloads) still go out.
+"""
+import importlib
+import json
+import threading
+import time
+from collections import Counter
+
+# Driver attributes read by helpers (memory watchdog, preflight) rather than by the bot flows. Not recorded
+UNRECORDED_ATTRIBUTES = {"service", "capabilities", "session_id", "annotate"}
+
+
+def annotate_session(driver, **meta):
+    """
+    Save details of the run along with the recording if the driver is being recorded
+    :param driver: Seleniumbase webdriver, RecordingDriver or ReplayDriver
+    """
+    annotate = getattr(driver, "annotate", None)
+    if annotate:
+        annotate(**meta)
+
+
+class ReplayDivergence(Exception):
+    """ Raised when a replayed flow issues a command that is not in the recording """
+
+
+def _is_element(value) -> bool:
+    return hasattr(value, "id") and hasattr(value, "_parent") and hasattr(value, "get_attribute")
+
+
+class _RecordingProxy:
+    """ Records the calls and attribute reads made on the wrapped object """
+
+    def __init__(self, recorder, target, target_name):
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_target_name", target_name)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in UNRECORDED_ATTRIBUTES or name.startswith("_"):
+            return value
+        if not callable(value):
+            return self._recorder.record(self._target_name, name, "get", value=value)
+
+        def recorded_call(*args, **kwargs):
+            return self._recorder.record(self._target_name, name, "call", func=value, args=args, kwargs=kwargs)
+        return recorded_call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class RecordingElement(_RecordingProxy):
+    pass
+
+
+class RecordingDriver(_RecordingProxy):
+    """
+    Wraps a driver and records the session to a JSON file when the driver is closed
+    """
+
+    def __init__(self, driver, path):
+        """
+        :param driver: Seleniumbase webdriver
+        :param path: File to save the recording to
+        """
+        super().__init__(self, driver, "driver")
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "events", [])
+        object.__setattr__(self, "meta", {})
+        object.__setattr__(self, "_element_refs", {})
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "_started_at", time.perf_counter())
+
+    def annotate(self, **meta):
+        """ Save details of the run (bot, account, prompts) along with the recording """
+        self.meta.update(meta)
+
+    def _encode(self, value):
+        if isinstance(value, _RecordingProxy):
+            value = value._target
+        if _is_element(value):
+            ref = self._element_refs.setdefault(value.id, len(self._element_refs))
+            return {"__element__": ref}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(each) for each in value]
+        if isinstance(value, dict):
+            return {str(key): self._encode(each) for key, each in value.items()}
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return {"__repr__": repr(value)}
+
+    def _wrap(self, value):
+        if _is_element(value):
+            return RecordingElement(self, value, f"element:{self._encode(value)['__element__']}")
+        if isinstance(value, list):
+            return [self._wrap(each) for each in value]
+        return value
+
+    @staticmethod
+    def _unwrap(value):
+        if isinstance(value, _RecordingProxy):
+            return value._target
+        if isinstance(value, (list, tuple)):
+            return type(value)(RecordingDriver._unwrap(each) for each in value)
+        return value
+
+    def record(self, target_name, name, kind, func=None, args=(), kwargs=None, value=None):
+        """ Run a command on the wrapped driver or element and save it """
+        kwargs = kwargs or {}
+        started_at = time.perf_counter()
+        event = {"t": round(started_at - self._started_at, 4), "target": target_name, "name": name, "kind": kind}
+        try:
+            if kind == "call":
+                event["args"] = self._encode(args)
+                event["kwargs"] = self._encode(kwargs)
+                value = func(*self._unwrap(args), **{key: self._unwrap(each) for key, each in kwargs.items()})
+            event["result"] = self._encode(value)
+            return self._wrap(value)
+        except Exception as e:
+            event["error"] = {"module": type(e).__module__, "type": type(e).__name__, "message": str(e)}
+            raise
+        finally:
+            event["elapsed"] = round(time.perf_counter() - started_at, 4)
+            with self._lock:
+                self.events.append(event)
+            if target_name == "driver" and name in ("quit", "close"):
+                self.save()
+
+    def save(self):
+        with self._lock:
+            with open(self.path, "w") as file:
+                json.dump({"meta": self.meta, "events": self.events}, file)
+        print(f"Driver session recorded to {self.path}")
+
+
+class _ReplayOpaque:
+    """ Stands for a recorded value that could not be serialized """
+
+    def __init__(self, representation):
+        self.representation = representation
+
+    def __repr__(self):
+        return self.representation
+
+
+class ReplayElement:
+
+    def __init__(self, replay, ref):
+        self._replay = replay
+        self._ref = ref
+        self.id = f"replay-{ref}"
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._replay.serve(f"element:{self._ref}", name)
+
+
+class ReplayDriver:
+    """
+    Serves a recorded session back. Commands are matched in order on their target and name,
+    recorded commands the new flow does not issue anymore are skipped and counted.
+    """
+
+    def __init__(self, path, lookahead=50):
+        """
+        :param path: Recording file saved by RecordingDriver
+        :param lookahead: Max number of recorded commands to skip when looking for the next matching one
+        """
+        with open(path, "r") as file:
+            recording = json.load(file)
+        self.meta = recording["meta"]
+        self.events = recording["events"]
+        self.lookahead = lookahead
+        self.cursor = 0
+        self.served = Counter()
+        self.skipped = 0
+        self.modeled_latency = 0.0
+        self._lock = threading.Lock()
+
+    def annotate(self, **meta):
+        pass
+
+    def _decode(self, value):
+        if isinstance(value, list):
+            return [self._decode(each) for each in value]
+        if isinstance(value, dict):
+            if "__element__" in value:
+                return ReplayElement(self, value["__element__"])
+            if "__repr__" in value:
+                return _ReplayOpaque(value["__repr__"])
+            return {key: self._decode(each) for key, each in value.items()}
+        return value
+
+    def _next_event(self, target, name):
+        for index in range(self.cursor, min(self.cursor + self.lookahead, len(self.events))):
+            event = self.events[index]
+            if event["target"] == target and event["name"] == name:
+                self.skipped += index - self.cursor
+                self.cursor = index + 1
+                return event
+        raise ReplayDivergence(f"{target}.{name} not found in the recording after command {self.cursor}")
+
+    def _replay(self, event):
+        self.served[event["name"]] += 1
+        self.modeled_latency += event["elapsed"]
+        if "error" in event:
+            error = event["error"]
+            try:
+                error_class = getattr(importlib.import_module(error["module"]), error["type"])
+                raise error_class(error["message"])
+            except (ImportError, AttributeError, TypeError):
+                raise RuntimeError(f"{error['type']}: {error['message']}")
+        return self._decode(event.get("result"))
+
+    def serve(self, target, name):
+        """ Serve the next recorded command of a target """
+        with self._lock:
+            event = self._next_event(target, name)
+        if event["kind"] == "get":
+            return self._replay(event)
+        return lambda *args, **kwargs: self._replay(event)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in UNRECORDED_ATTRIBUTES:
+            return None
+        return self.serve("driver", name)
+
+    def summary(self) -> dict:
+        """
+        :return: Number of served commands per name, skipped commands and the modeled latency in secs
+        """
+        return {
+            "commands": sum(self.served.values()),
+            "by_name": dict(self.served),
+            "skipped": self.skipped + len(self.events) - self.cursor,
+            "modeled_latency": round(self.modeled_latency, 3),
+        }
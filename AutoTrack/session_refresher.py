@@ -0,0 +1,187 @@
+"""
+Off-peak refresh of the saved sessions, so the daily run signs in with cookies instead of the slow Microsoft and
+Google logins: python main.py refresh-sessions
+
+Every account whose saved session expires within Settings.SESSION_REFRESH_AHEAD_SECS, or has none, signs in with
+the bot login, a few accounts at a time, then the fresh cookies are saved. A session expires with the first of its
+Settings.SESSION_COOKIES, or when the janitor removes its file, Settings.COOKIE_MAX_AGE_SECS after its last use.
+Signing in with the saved cookies only renews the file, not the session cookies: when those expire soon the bot goes
+straight to the UI login. A sign in whose saved session does not expire later than before is reported as not renewed.
+Each UI login done here is one the daily run does not have to do.
+"""
+import os
+import pickle
+import threading
+import time
+
+from helpers import logger
+from pacing import pacer
+from run_state import RunCancelled, clear_stage, set_stage
+from settings import Settings
+from supervisor import Supervisor
+from utils import get_available_platform_accounts_v2
+
+PLATFORMS = ("suno", "soundcloud")
+
+
+def get_cookie_path(platform, username) -> str:
+    return f"cookies/{platform}/{username}.pkl"
+
+
+def get_session_expiry(platform, username, cookies_only=False):
+    """
+    :param platform: suno / soundcloud
+    :param username: Account username
+    :param cookies_only: Only look at the Settings.SESSION_COOKIES, not at the cleanup of the file
+    :return: Time the saved session of the account expires, None without a saved session, or with cookies_only
+        without an expiring session cookie
+    """
+    path = get_cookie_path(platform, username)
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as file:
+            all_cookies = pickle.load(file)
+        # La lecture ne compte pas comme une utilisation pour le nettoyage
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    # Le nettoyage supprime les cookies non utilisés depuis COOKIE_MAX_AGE_SECS
+    expiry = max(stat.st_atime, stat.st_mtime) + Settings.COOKIE_MAX_AGE_SECS
+    all_expiries = [cookie["expiry"] for cookie in all_cookies
+                    if cookie.get("name") in Settings.SESSION_COOKIES.get(platform, ()) and cookie.get("expiry")]
+    if cookies_only:
+        return min(all_expiries, default=None)
+    return min([expiry] + all_expiries)
+
+
+def sign_in(platform, driver, username, password, use_cookies=True):
+    """
+    Sign in with the bot of the platform and save the session
+    :param use_cookies: Try the saved cookies before the UI login
+    :return: "cookies" / "credentials" as returned by the bot login, None if it failed
+    """
+    from utils import save_cookies
+
+    if platform == "suno":
+        from sunodownloads.suno_ai_spider import SunoAI
+        login_type = SunoAI(driver).sign_in(username, password, use_cookies=use_cookies)
+    else:
+        from soundcloud_uploads.soundcloud import SoundCloud
+        login_type = SoundCloud(driver).login(os.getenv("SOUNDCLOUD_LINK"), username, password,
+                                              use_cookies=use_cookies)
+    if login_type:
+        # Les cookies relus par le site sont enregistrés à nouveau, avec leur nouvelle date d'expiration
+        save_cookies(driver, platform, username)
+    return login_type
+
+
+class SessionRefresher:
+
+    def __init__(self, ahead_secs=Settings.SESSION_REFRESH_AHEAD_SECS):
+        """
+        :param ahead_secs: Sessions expiring within this no of secs are refreshed
+        """
+        self.ahead_secs = ahead_secs
+        # Platform -> {"fresh", "cookies", "credentials", "not_renewed", "failed"} -> list of usernames
+        self.outcomes = {platform: {"fresh": [], "cookies": [], "credentials": [], "not_renewed": [], "failed": []}
+                         for platform in PLATFORMS}
+        self._lock = threading.Lock()
+
+    def needs_refresh(self, platform, username) -> bool:
+        expiry = get_session_expiry(platform, username)
+        return expiry is None or expiry - time.time() < self.ahead_secs
+
+    def _record(self, platform, outcome, username):
+        with self._lock:
+            self.outcomes[platform][outcome].append(username)
+
+    def refresh(self, platform, username, password):
+        """
+        Sign in to an account if its saved session expires soon
+        :param platform: suno / soundcloud
+        :param username: Account username
+        :param password: Account password
+        """
+        from helpers import create_driver
+
+        if not self.needs_refresh(platform, username):
+            self._record(platform, "fresh", username)
+            return
+        expiry = get_session_expiry(platform, username)
+        # Les cookies de session qui expirent bientôt ne sont pas renouvelés par une connexion avec ces cookies
+        cookie_expiry = get_session_expiry(platform, username, cookies_only=True)
+        use_cookies = cookie_expiry is None or cookie_expiry - time.time() >= self.ahead_secs
+        set_stage("sign_in", username)
+        driver = create_driver(platform, account=username)
+        login_type = None
+        try:
+            login_type = sign_in(platform, driver, username, password, use_cookies)
+        except RunCancelled as e:
+            print(f"Session refresh of {username} cancelled: {e}")
+        except Exception as e:
+            print(f"Session refresh of {username} failed: {e}")
+        finally:
+            clear_stage()
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        outcome = login_type or "failed"
+        new_expiry = get_session_expiry(platform, username)
+        if login_type and expiry is not None and (new_expiry is None or new_expiry <= expiry):
+            outcome = "not_renewed"
+        self._record(platform, outcome, username)
+        logger.info(f"Session of {platform} account {username} refreshed: {outcome}")
+
+    def run(self, all_platforms=PLATFORMS, concurrency=Settings.SESSION_REFRESH_CONCURRENCY):
+        """
+        Refresh the sessions of every account of the platforms
+        :param all_platforms: Platforms to refresh
+        :param concurrency: Max no of accounts signing in at the same time
+        """
+        from helpers import prepare_driver
+        from stages import run_accounts
+
+        prepare_driver()
+        for platform in all_platforms:
+            all_accounts = get_available_platform_accounts_v2(platform)
+            print(f"Checking the sessions of {len(all_accounts)} {platform} accounts\n")
+            run_accounts(lambda username, password: self.refresh(platform, username, password), all_accounts,
+                         concurrency, f"refresh {platform}")
+
+    def report(self) -> str:
+        """
+        :return: Outcome per platform and the no of UI logins moved off the daily run
+        """
+        lines = []
+        for platform, outcomes in self.outcomes.items():
+            if any(outcomes.values()):
+                lines.append(f"  {platform}: {len(outcomes['fresh'])} still fresh, {len(outcomes['cookies'])} renewed "
+                             f"with cookies, {len(outcomes['credentials'])} UI logins, "
+                             f"{len(outcomes['not_renewed'])} not renewed {outcomes['not_renewed'] or ''}, "
+                             f"{len(outcomes['failed'])} failed {outcomes['failed'] or ''}")
+        no_of_ui_logins = sum(len(outcomes["credentials"]) for outcomes in self.outcomes.values())
+        return "\n".join([f"Session refresh: {no_of_ui_logins} UI logins moved off the daily run"] + lines)
+
+
+def run_session_refresh(all_platforms=PLATFORMS, concurrency=None, every=None):
+    """
+    Refresh the sessions once, or every `every` secs until interrupted
+    :param all_platforms: Platforms to refresh
+    :param concurrency: Max no of accounts at the same time. Settings.SESSION_REFRESH_CONCURRENCY if None
+    :param every: No of secs between two refreshes. Run once if None
+    """
+    while True:
+        started_at = time.time()
+        refresher = SessionRefresher()
+        supervisor = Supervisor(deadline_secs=None).start()
+        refresher.run(all_platforms, concurrency or Settings.SESSION_REFRESH_CONCURRENCY)
+        supervisor.stop()
+        print("\n" + refresher.report())
+        print(supervisor.report())
+        print(pacer.report())
+        if not every:
+            break
+        wait_secs = max(every - (time.time() - started_at), 0)
+        print(f"Next session refresh in {wait_secs / 60:.0f} min\n")
+        time.sleep(wait_secs)
@@ -1,5 +1,9 @@
 class Settings:
     HEADLESS = False
+    # Chrome launch options of create_driver (python benchmarks.py driver-configs measures the alternatives)
+    #   display: "headed", "headless", "new-headless" (chrome --headless=new) or "xvfb" (headed on a virtual display)
+    #   window_size: (width, height). uc: undetected chromedriver mode
+    DRIVER_CONFIG = {"display": "headless" if HEADLESS else "headed", "window_size": (1920, 1080), "uc": True}
 
     TIMEOUT: int = 60
 
@@ -11,8 +15,202 @@ class Settings:
 
     # No of process to run concurrently
     CONCURRENT_PROCESS = 6
+    # "threads": the bots run as threads of the main process. "processes": each bot runs in a worker process of
+    # process_pool.BotProcessPool, restarted if it crashes (python main.py --bot-execution processes)
+    BOT_EXECUTION = "threads"
 
     MAX_RETRY = 3
 
     # No of secs to wait for a suno track to be ready for download
     MAX_TIME_FOR_SUNO_GENERATION = 120
+
+    # Names of the chrome executable to look for on the PATH during the driver preflight
+    CHROME_BINARY_NAMES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome"]
+    # Keeps the validated driver binaries details. Stored outside downloaded_files as that folder gets cleaned
+    DRIVER_PREFLIGHT_FILE = ".driver_preflight.json"
+
+    # Block the requests the bots never use (fonts, analytics, ads, media previews) in every driver
+    BLOCK_RESOURCES = True
+    # Per platform resource policy applied with CDP Network.setBlockedURLs
+    # - block_types: CDP resource types to block (Font, Media, Image)
+    # - block_patterns: URL wildcard patterns to block
+    # - allow: URLs the flows need. Any block pattern that matches one of them is not applied
+    RESOURCE_POLICIES = {
+        "suno": {
+            "block_types": ["Font", "Media"],
+            "block_patterns": [
+                "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+                "*hotjar.com*", "*segment.io*", "*segment.com/analytics*", "*sentry.io*", "*intercom.io*",
+            ],
+            "allow": [
+                "https://login.microsoftonline.com/common/oauth2/v2.0/authorize",
+                "https://clerk.suno.ai/v1/client",
+            ],
+        },
+        "soundcloud": {
+            "block_types": ["Font", "Media"],
+            "block_patterns": [
+                "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+                "*scorecardresearch.com*", "*quantserve.com*", "*adsrvr.org*", "*sentry.io*",
+            ],
+            "allow": [
+                "https://accounts.google.com/v3/signin/identifier",
+                "https://www.gstatic.com/recaptcha/releases/latest/recaptcha__en.js",
+            ],
+        },
+    }
+
+    # Coordinator / worker mode. The coordinator serves the work queue on this address
+    WORK_QUEUE_HOST = "127.0.0.1"
+    WORK_QUEUE_PORT = 8765
+    WORK_QUEUE_DB = "work_queue.sqlite3"
+    # No of secs a worker owns a work item without sending a heartbeat
+    WORK_QUEUE_LEASE_SECS = 120
+    # No of times a work item is leased before it is marked as failed
+    WORK_QUEUE_MAX_ATTEMPTS = 3
+
+    # Suno credits spent by one prompt (it generates NO_OF_TRACKS_SUNO_ACCOUNT_GENERATES tracks)
+    SUNO_CREDITS_PER_PROMPT = 10
+    # Credits a suno account gets back every day
+    SUNO_DAILY_CREDITS = 50
+    # Max no of prompts given to one suno account in a run
+    SUNO_MAX_PROMPTS_PER_ACCOUNT = 5
+    # Last known credits balance of every suno account
+    SUNO_CREDITS_FILE = "suno_credits.json"
+
+    # Restart a driver browser when its chrome process tree uses more memory than this (in MB)
+    DRIVER_MEMORY_LIMIT_MB = 1500
+    # No of secs between two memory checks of the drivers
+    MEMORY_WATCHDOG_INTERVAL = 10
+
+    # Record every driver session to this folder for offline replay benchmarks. None disables the recording
+    RECORD_SESSIONS_DIR = None
+
+    # Soundcloud HTTP API used to upload tracks when the account has an OAuth token (SOUNDCLOUD_TOKEN_<n>)
+    SOUND_CLOUD_API_BASE_URL = "https://api.soundcloud.com/"
+    # No of tracks uploaded at the same time through the API
+    SOUND_CLOUD_API_UPLOAD_CONCURRENCY = 3
+    # Folder of the per-account index of the tracks already uploaded to soundcloud
+    UPLOAD_INDEX_DIR = "upload_index"
+    # Folder of the per-account record of the tracks already monetized or pending
+    MONETIZATION_INDEX_DIR = "monetization_index"
+    # Rows of the monetization view, newest tracks first, and the title inside a row (first line of the row if missing)
+    MONETIZATION_ROW_SELECTOR = "table tbody tr"
+    MONETIZATION_TITLE_SELECTOR = "td:first-child a, td:first-child"
+    # Safety cap on the no of pages of the monetization view read in one run
+    MONETIZATION_MAX_PAGES = 20
+
+    # Submit all the prompts of an account first, then download the clips as they get ready
+    SUNO_PIPELINED_GENERATION = False
+
+    # Platforms whose drivers keep the chrome performance log, to read the API responses of the pages
+    CAPTURE_NETWORK_PLATFORMS = ["suno"]
+    # Suno API responses the clip index reads the clips from
+    SUNO_CLIP_API_PATTERNS = [
+        "https://studio-api.suno.ai/api/feed*", "https://studio-api.suno.ai/api/generate*",
+        "https://studio-api.suno.ai/api/clip*",
+    ]
+    # Response returning the clips created by a submitted prompt
+    SUNO_GENERATE_API_PATTERN = "https://studio-api.suno.ai/api/generate*"
+    # No of secs without any feed response before the create page is refreshed to get the clips status
+    SUNO_FEED_STALE_SECS = 30
+    # Max no of clip API responses kept per tab until the clip index of that tab reads them. The oldest are dropped
+    SUNO_PENDING_EVENTS_LIMIT = 200
+
+    # Suno downloads. A failed download is resumed with a Range request up to DOWNLOAD_MAX_RETRY times
+    DOWNLOAD_MAX_RETRY = 5
+    # Files from this size are fetched as DOWNLOAD_PARALLEL_CHUNKS range chunks at the same time
+    DOWNLOAD_PARALLEL_CHUNKS = 4
+    DOWNLOAD_PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+    # No of tracks of an account downloaded in the background at the same time
+    DOWNLOAD_WORKERS = 2
+
+    # main.py --profile. Stack samples per second, folder of the output files and no of entries per report table
+    PROFILE_SAMPLE_RATE = 20
+    PROFILE_DIR = "profiles"
+    PROFILE_TOP_N = 25
+
+    # Queue between the stage commands (python main.py generate / upload / sync / monetize / report), kept between runs
+    STAGE_QUEUE_DB = "stage_queue.sqlite3"
+    # No of accounts each stage command runs at the same time
+    STAGE_CONCURRENCY = {"generate": CONCURRENT_PROCESS, "upload": CONCURRENT_PROCESS, "sync": CONCURRENT_PROCESS,
+                         "monetize": CONCURRENT_PROCESS}
+    # Max no of queued tracks one upload run takes
+    STAGE_UPLOAD_BATCH_SIZE = 50
+
+    # Local HTTP page with the live status of the run (python main.py --status)
+    STATUS_SERVER = False
+    STATUS_SERVER_HOST = "127.0.0.1"
+    STATUS_SERVER_PORT = 8766
+    # No of secs the tracks per hour are measured over
+    STATUS_WINDOW_SECS = 3600
+    # A thread in the same stage for longer is shown as stalled
+    STATUS_STALL_SECS = 15 * 60
+
+    # Supervisor of the bot threads. No of secs a run may last (None for no deadline)
+    RUN_DEADLINE_SECS = 10 * 3600
+    # No of secs an account may keep a thread busy, and no of secs a thread may stay in a stage
+    ACCOUNT_BUDGET_SECS = 2 * 3600
+    STAGE_BUDGET_SECS = {"sign_in": 10 * 60, "generate": 60 * 60, "wait_generation": 30 * 60, "download": 15 * 60,
+                         "upload": 45 * 60, "sync": 15 * 60, "monetize": 45 * 60}
+    # A thread without heartbeat for this no of secs is stuck
+    STALL_SECS = 10 * 60
+    SUPERVISOR_INTERVAL = 15
+    # No of secs given to a cancelled thread to stop after the run deadline
+    CANCEL_GRACE_SECS = 60
+
+    # Background cleanup of downloaded_files and cookies. No of secs between two sweeps
+    JANITOR_INTERVAL = 60
+    # Max size of downloaded_files. The least recently used files that are not waiting for an upload go first
+    DISK_QUOTA_MB = 2048
+    # No of secs uploaded tracks are kept after the upload is confirmed
+    JANITOR_UPLOADED_RETENTION_SECS = 0
+    # No of secs before files no run knows about (crashed runs, stale .part downloads) are removed
+    JANITOR_ORPHAN_MAX_AGE_SECS = 2 * 24 * 3600
+    # No of secs before cookies that were not refreshed by a login are removed
+    COOKIE_MAX_AGE_SECS = 30 * 24 * 3600
+
+    # Pacing of the calls to the sites, shared by every bot of the process (pacing.py)
+    PACING = True
+    # Platform -> operation -> (calls per minute, burst). Operations not listed are not paced
+    PACING_RATES = {
+        "suno": {"login": (6, 2), "create": (20, 4), "download": (60, 10)},
+        "soundcloud": {"login": (6, 2), "upload": (30, 10), "sync": (10, 2), "monetize": (30, 5)},
+    }
+
+    # Off-peak session refresh (python main.py refresh-sessions): the accounts whose saved session expires within
+    # this no of secs sign in again ahead of the daily run
+    SESSION_REFRESH_AHEAD_SECS = 2 * 24 * 3600
+    SESSION_REFRESH_CONCURRENCY = 2
+    # Cookies that carry the login of each platform. A saved session expires with the first of them
+    SESSION_COOKIES = {"suno": ["__client"], "soundcloud": ["oauth_token"]}
+
+    # No of accounts sharing one chrome process, each one in its own browser context. 1 gives each account its own chrome
+    ACCOUNTS_PER_BROWSER = 1
+
+    # Give each account its own chrome profile kept between runs (warm cache, open sessions) instead of a guest window.
+    # Only with ACCOUNTS_PER_BROWSER = 1
+    PERSISTENT_PROFILES = False
+    PROFILES_DIR = "chrome_profiles"
+    # The profile caches are dropped before chrome starts when the profile is over PROFILE_MAX_MB,
+    # and every PROFILE_COMPACT_INTERVAL_DAYS
+    PROFILE_MAX_MB = 500
+    PROFILE_COMPACT_INTERVAL_DAYS = 7
+    # First page load time of every browser launch, with the profile state (guest, cold, warm)
+    PROFILE_LOAD_TIMES_FILE = "profile_load_times.jsonl"
+
+    # Local caching proxy shared by every chrome of the run. The fingerprinted JS/CSS/font files of ASSET_PROXY_HOSTS are
+    # served from its cache, everything else goes through untouched. Needs the cryptography package
+    ASSET_PROXY = False
+    # 0 picks a free port
+    ASSET_PROXY_PORT = 0
+    # Hosts whose TLS the proxy opens to cache their assets. The other hosts (logins, APIs) are tunneled as they are
+    ASSET_PROXY_HOSTS = ["suno.com", "app.suno.ai", "a-v2.sndcdn.com"]
+    ASSET_PROXY_EXTENSIONS = ["js", "css", "woff", "woff2", "ttf", "otf"]
+    # The least recently used assets are dropped past these sizes. The disk cache is kept between runs
+    ASSET_PROXY_MEMORY_MB = 128
+    ASSET_PROXY_DISK_MB = 512
+    ASSET_PROXY_DIR = "asset_cache"
+
+    # Every track downloaded and every soundcloud result of a run is appended to this JSON lines file
+    RUN_JOURNAL = "run_journal.jsonl"
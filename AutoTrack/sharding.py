@@ -0,0 +1,218 @@
+"""
+Coordinator / worker mode to spread the accounts of a run over several hosts.
+
+    python main.py --mode coordinator
+    python main.py --mode worker --worker-id host-1 --queue-host <coordinator ip>
+
+The coordinator publishes one work item per Suno account with its prompts, then one per SoundCloud account
+once the generation is done, and sends the merged daily report. Workers only receive usernames,
+passwords are read from each host environment.
+The coordinator listens on --queue-host, which must be an address the workers can reach (not the default
+127.0.0.1) when they run on other hosts.
+The soundcloud items hold the paths of the files downloaded by the suno workers, not the files. A soundcloud worker
+that does not see a file, e.g. on another host without a shared folder, downloads it again from the suno cdn with
+the clip id of the track. A soundcloud item with an audio file it can not get fails instead of uploading part of
+the tracks.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+
+from records import TrackRecord, UploadResult
+from result_bus import ResultBus
+from settings import Settings
+from utils import get_available_platform_accounts_v2, get_daily_genre_prompts, send_daily_statistics
+from work_queue import QueueServer, WorkQueue
+
+# No of secs between two checks of the queue
+POLL_INTERVAL = 5
+# Files of a suno clip, downloaded again by the soundcloud workers that do not have them
+SUNO_AUDIO_URL = "https://cdn1.suno.ai/{clip_id}.mp3"
+SUNO_IMAGE_URL = "https://cdn1.suno.ai/image_{clip_id}.png"
+
+
+def run_suno_job(payload) -> dict:
+    """
+    Generate and download tracks with a suno account
+    :param payload: Dictionary with the account username and the prompts to use
+    :return: Dictionary with the account username, the downloaded tracks details and the credits left, None if
+        they were not read
+    """
+    from helpers import create_driver
+    from sunodownloads.credit_planner import get_recorded_credits
+    from sunodownloads.suno_ai_spider import run_suno_bot
+
+    # The coordinator keeps the results, no journal on the workers
+    result_bus = ResultBus(journal_path=None)
+    tracks_queue = result_bus.subscribe(TrackRecord.KIND)
+    run_suno_bot(create_driver("suno", account=payload["username"]), payload["username"], os.environ.get("SUNO_PASSWORD"), payload["prompts"],
+                 result_bus)
+    # Le coordinateur planifie avec son propre fichier de crédits
+    return {"username": payload["username"], "tracks": [track.to_dict() for track in result_bus.drain(tracks_queue)],
+            "credits": get_recorded_credits(payload["username"])}
+
+
+def get_local_tracks(all_tracks) -> list:
+    """
+    Make the files of the tracks available on this worker. The missing ones are downloaded again from the suno cdn
+    :param all_tracks: List of the downloaded tracks details sent by the coordinator
+    :return: List of TrackRecord with the paths of the files on this worker
+    :raise FileNotFoundError: if a missing audio file has no clip id to download it from
+    """
+    import requests
+    from janitor import get_track_files
+    from sunodownloads.downloader import DownloadError, download_file
+
+    download_dir = os.path.join(os.getenv("CURRENT_DIR") or os.getcwd(), "downloaded_files")
+    all_local_tracks = []
+    for each in all_tracks:
+        track = TrackRecord.from_dict(each)
+        audio_path, image_path = get_track_files(track)
+        if not os.path.isfile(audio_path):
+            if not track.clip_id:
+                raise FileNotFoundError(f"{audio_path} missing on {socket.gethostname()}, without a clip id to "
+                                        f"download it again")
+            print(f"Downloading {track.title} again from the suno cdn\n")
+            track.audio_path = os.path.join(download_dir, os.path.basename(audio_path))
+            track.img_path = os.path.join(download_dir, "images")
+            os.makedirs(track.img_path, exist_ok=True)
+            download_file(SUNO_AUDIO_URL.format(clip_id=track.clip_id), track.audio_path)
+            try:
+                download_file(SUNO_IMAGE_URL.format(clip_id=track.clip_id),
+                              os.path.join(track.img_path, os.path.basename(image_path)), parallel_chunks=1)
+            except (requests.RequestException, DownloadError) as e:
+                print(f"Unable to download the image of {track.title}: {e}")
+        all_local_tracks.append(track)
+    return all_local_tracks
+
+
+def run_soundcloud_job(payload) -> list:
+    """
+    Upload and monetize the downloaded tracks with a soundcloud account
+    :param payload: Dictionary with the account username and the downloaded tracks details
+    :return: List of the soundcloud bot results
+    """
+    from helpers import create_driver
+    from soundcloud_uploads.soundcloud import run_soundcloud_bot
+
+    # Sans dossier partagé, les fichiers téléchargés par un autre worker sont récupérés sur le cdn de suno
+    all_tracks = get_local_tracks(payload["tracks"])
+    result_bus = ResultBus(journal_path=None)
+    results_queue = result_bus.subscribe(UploadResult.KIND)
+    run_soundcloud_bot(create_driver("soundcloud", account=payload["username"]), os.getenv("SOUNDCLOUD_LINK"), payload["username"],
+                       os.environ.get("SOUNDCLOUD_PASSWORD"),
+                       all_tracks, result_bus)
+    return [result.to_dict() for result in result_bus.drain(results_queue)]
+
+
+JOB_HANDLERS = {
+    "suno": run_suno_job,
+    "soundcloud": run_soundcloud_job,
+}
+
+
+def _keep_lease(queue, item_id, worker_id, stop_event):
+    """ Send heartbeats for a leased item until the job is done """
+    while not stop_event.wait(Settings.WORK_QUEUE_LEASE_SECS / 3):
+        try:
+            if not queue.heartbeat(item_id=item_id, worker_id=worker_id):
+                print(f"Lost the lease of work item {item_id}")
+                return
+        except (OSError, RuntimeError) as e:
+            print(f"Unable to send heartbeat for work item {item_id}: {e}")
+
+
+def run_worker(queue, worker_id=None, handlers=None):
+    """
+    Lease and run work items until the coordinator has nothing left
+    :param queue: QueueClient connected to the coordinator (or a local WorkQueue)
+    :param worker_id: Unique name of the worker. Defaults to hostname-pid
+    :param handlers: Dictionary of work item kind to the function running it. Defaults to JOB_HANDLERS
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    handlers = handlers or JOB_HANDLERS
+    print(f"Worker {worker_id} started\n")
+
+    while True:
+        try:
+            item = queue.lease(worker_id=worker_id)
+            if item is None and queue.is_closed():
+                break
+        except OSError as e:
+            print(f"Work queue unreachable, stopping worker {worker_id}: {e}")
+            break
+        if item is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        print(f"Worker {worker_id} leased {item['kind']} item {item['id']}\n")
+        stop_event = threading.Event()
+        threading.Thread(target=_keep_lease, args=(queue, item["id"], worker_id, stop_event), daemon=True).start()
+        try:
+            result = handlers[item["kind"]](item["payload"])
+            queue.complete(item_id=item["id"], worker_id=worker_id, result=result)
+        except Exception as e:
+            print(f"Work item {item['id']} failed on {worker_id}: {e}")
+            traceback.print_exc()
+            queue.fail(item_id=item["id"], worker_id=worker_id, error=str(e))
+        finally:
+            stop_event.set()
+
+    print(f"Worker {worker_id} done\n")
+
+
+def wait_for_kind(queue, kind):
+    """ Block until every work item of a kind is done or failed """
+    while not queue.is_finished(kind):
+        counts = queue.counts(kind)
+        print(f"Waiting for {kind} work items: {counts}")
+        time.sleep(POLL_INTERVAL)
+
+
+def run_coordinator(host=Settings.WORK_QUEUE_HOST, port=Settings.WORK_QUEUE_PORT, db_path=Settings.WORK_QUEUE_DB):
+    """
+    Publish the work of the day, wait for the workers to process it and send the merged daily report
+    """
+    # Start from an empty queue for the run
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    queue = WorkQueue(db_path)
+    server = QueueServer(queue, host, port).start()
+    print(f"Coordinator serving work queue on {host}:{port}\n")
+
+    all_suno_accounts = get_available_platform_accounts_v2("suno")
+    all_soundcloud_account = get_available_platform_accounts_v2("soundcloud")
+    genre_used, all_daily_prompts = get_daily_genre_prompts()
+
+    from sunodownloads.credit_planner import get_credit_balances, plan_prompts, record_credits
+
+    # Spread the prompts by credits. Exhausted accounts get no work item
+    prompts_plan = plan_prompts(get_credit_balances([account[0] for account in all_suno_accounts]), all_daily_prompts)
+    for username, prompts in prompts_plan.items():
+        queue.publish("suno", {"username": username, "prompts": prompts})
+    wait_for_kind(queue, "suno")
+
+    all_suno_results = queue.results("suno")
+    for result in all_suno_results:
+        if result["credits"] is not None:
+            record_credits(result["username"], result["credits"])
+    all_downloaded_audios_info = [track for result in all_suno_results for track in result["tracks"]]
+    print(f"Workers downloaded {len(all_downloaded_audios_info)} tracks\n")
+
+    if all_downloaded_audios_info:
+        for username, _ in all_soundcloud_account:
+            queue.publish("soundcloud", {"username": username, "tracks": all_downloaded_audios_info})
+        wait_for_kind(queue, "soundcloud")
+
+    queue.close_queue()
+    result_from_soundcloud = [UploadResult.from_dict(each) for result in queue.results("soundcloud") for each in result]
+    print(f"Work queue summary: suno {queue.counts('suno')} | soundcloud {queue.counts('soundcloud')}\n")
+
+    print("\nSending Message...")
+    send_daily_statistics(len(all_downloaded_audios_info), len(all_suno_accounts), genre_used, result_from_soundcloud)
+
+    # Give the idle workers time to see the queue is closed before stopping the server
+    time.sleep(POLL_INTERVAL * 2)
+    server.shutdown()
@@ -0,0 +1,103 @@
+"""
+Local stand-in for the SoundCloud API track endpoints, to exercise the API uploader without a real account.
+
+    python soundcloud_uploads/api_stub_server.py --port 8099
+
+Then set Settings.SOUND_CLOUD_API_BASE_URL to http://127.0.0.1:8099/
+"""
+import argparse
+import json
+import re
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+
+def get_filename(part) -> str:
+    """ Like the real API, the UTF-8 filename* parameter wins over the plain filename """
+    raw_header = dict(part.raw_items()).get("Content-Disposition", "")
+    match = re.search(r"filename\*=UTF-8''([^;\s]+)", raw_header, re.IGNORECASE)
+    return unquote(match.group(1)) if match else part.get_filename()
+
+
+class SoundCloudStubHandler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if not self.headers.get("Authorization", "").startswith("OAuth "):
+            self._send_json(401, {"error": "Missing OAuth token"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path.split("?")[0] == "/me/tracks":
+            self._send_json(200, self.server.tracks)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path != "/tracks":
+            return self._send_json(404, {"error": "Not found"})
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        all_fields = {}
+        all_filenames = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            all_fields[name] = part.get_payload(decode=True)
+            all_filenames[name] = get_filename(part)
+
+        if "track[asset_data]" not in all_fields:
+            return self._send_json(422, {"error": "Missing track[asset_data]"})
+
+        with self.server.lock:
+            track = {
+                "id": len(self.server.tracks) + 1,
+                "title": all_fields.get("track[title]", b"").decode(),
+                "genre": all_fields.get("track[genre]", b"").decode(),
+                "tag_list": all_fields.get("track[tag_list]", b"").decode(),
+                "original_content_size": len(all_fields["track[asset_data]"]),
+                "original_filename": all_filenames["track[asset_data]"],
+                "artwork_url": "stub://artwork" if "track[artwork_data]" in all_fields else None,
+            }
+            self.server.tracks.append(track)
+        self._send_json(201, track)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port=0) -> ThreadingHTTPServer:
+    """
+    Start the stand-in API in a background thread
+    :param port: Port to listen on. 0 picks a free port
+    :return: The server. Its tracks attribute lists the uploaded tracks
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), SoundCloudStubHandler)
+    server.tracks = []
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the SoundCloud API")
+    parser.add_argument("--port", type=int, default=8099)
+    server = start_stub_server(parser.parse_args().port)
+    print(f"SoundCloud API stand-in listening on http://127.0.0.1:{server.server_address[1]}/")
+    threading.Event().wait()
@@ -0,0 +1,181 @@
+"""
+Uploads tracks through the SoundCloud HTTP API with the account OAuth token.
+
+Files are streamed from disk in a multipart body, never loaded whole in memory, and several tracks are
+uploaded at the same time. Title, genre, tags and artwork are sent with the audio in the same request.
+"""
+import mimetypes
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+from helpers import logger
+from pacing import pace
+from settings import Settings
+
+# Size of the blocks read from the files being uploaded
+CHUNK_SIZE = 64 * 1024
+
+
+def get_filename_params(path) -> str:
+    """
+    The file names come from the track titles. A quote or a line break in the plain filename would end the
+    header, so they are replaced along with the non-ASCII characters, and the exact name is sent in filename*
+    :param path: File path
+    :return: Content-Disposition filename parameters of the file
+    """
+    filename = os.path.basename(path)
+    safe_filename = "".join("_" if char in '"\\\r\n' or not char.isascii() else char for char in filename)
+    if safe_filename == filename:
+        return f'filename="{filename}"'
+    return f'filename="{safe_filename}"; filename*=UTF-8\'\'{quote(filename, safe="")}'
+
+
+class MultipartStream:
+    """
+    File-like multipart/form-data body. Its length is known beforehand so it is sent with a Content-Length,
+    and the files are read block by block while the request is being sent.
+    """
+
+    def __init__(self, fields, files):
+        """
+        :param fields: List of (name, value) text fields
+        :param files: List of (name, file path) file fields
+        """
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = []
+        for name, value in fields:
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, path in files:
+            file_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            self._parts.append(
+                (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                 f'{get_filename_params(path)}\r\nContent-Type: {file_type}\r\n\r\n').encode())
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+        self._length = sum(os.path.getsize(part) if isinstance(part, str) else len(part) for part in self._parts)
+        self._current = None
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=CHUNK_SIZE) -> bytes:
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        while self._parts or self._current:
+            if self._current is None:
+                part = self._parts.pop(0)
+                if isinstance(part, bytes):
+                    return part
+                self._current = open(part, "rb")
+            block = self._current.read(size)
+            if block:
+                return block
+            self._current.close()
+            self._current = None
+        return b""
+
+    def close(self):
+        if self._current:
+            self._current.close()
+            self._current = None
+
+
+def get_track_files(track) -> tuple:
+    """
+    :param track: TrackRecord downloaded by the suno bot
+    :return: (audio file path, artwork file path or None)
+    """
+    audio_path = track.audio_path or os.path.join(os.getcwd(), "downloaded_files", f"{track.title}.mp3")
+    artwork_path = track.img_path
+    if not artwork_path or not os.path.isfile(artwork_path):
+        artwork_path = os.path.join(os.getcwd(), "downloaded_files", "images", f"{track.title}.png")
+    return audio_path, artwork_path if os.path.isfile(artwork_path) else None
+
+
+class SoundCloudAPIUploader:
+
+    def __init__(self, token, base_url=Settings.SOUND_CLOUD_API_BASE_URL,
+                 max_workers=Settings.SOUND_CLOUD_API_UPLOAD_CONCURRENCY):
+        """
+        :param token: OAuth token of the soundcloud account
+        :param base_url: API base url. Point it to a local stand-in server for testing
+        :param max_workers: No of tracks uploaded at the same time
+        """
+        self.token = token
+        self.base_url = base_url.rstrip("/") + "/"
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"OAuth {token}"
+
+    def upload_track(self, track) -> dict:
+        """
+        Upload a track with its title, genre, tags and artwork in a single request
+        :param track: TrackRecord downloaded by the suno bot
+        :return: The created track returned by the API
+        """
+        audio_path, artwork_path = get_track_files(track)
+        # Tags with spaces must be quoted
+        tag_list = " ".join(f'"{tag}"' if " " in tag else tag for tag in track.tag_list if tag)
+        fields = [
+            ("track[title]", track.title),
+            ("track[genre]", track.genre or ""),
+            ("track[tag_list]", tag_list),
+            ("track[sharing]", "public"),
+        ]
+        files = [("track[asset_data]", audio_path)]
+        if artwork_path:
+            files.append(("track[artwork_data]", artwork_path))
+
+        body = MultipartStream(fields, files)
+        pace("soundcloud", "upload")
+        try:
+            response = self.session.post(self.base_url + "tracks", data=body, timeout=Settings.TIMEOUT * 10,
+                                         headers={"Content-Type": body.content_type})
+        finally:
+            body.close()
+        response.raise_for_status()
+        return response.json()
+
+    def get_track_titles(self) -> list:
+        """
+        :return: Titles of all the tracks of the account
+        """
+        all_titles = []
+        url = self.base_url + "me/tracks?limit=200&linked_partitioning=true"
+        while url:
+            response = self.session.get(url, timeout=Settings.TIMEOUT)
+            response.raise_for_status()
+            page = response.json()
+            # Without pagination support the API returns a plain list
+            if isinstance(page, list):
+                page = {"collection": page}
+            all_titles += [track.get("title", "") for track in page.get("collection", [])]
+            url = page.get("next_href")
+        return all_titles
+
+    def upload_tracks(self, all_tracks) -> list:
+        """
+        Upload tracks in parallel
+        :param all_tracks: List of TrackRecord downloaded by the suno bot
+        :return: List of the TrackRecord uploaded. Tracks that failed to upload are left out
+        """
+        def upload(track):
+            try:
+                self.upload_track(track)
+                print(f"Uploaded {track.title} through the API")
+                return track
+            except (OSError, requests.RequestException) as e:
+                print(f"Unable to upload {track.title} through the API: {e}")
+                logger.info(f"API upload failed for {track.title}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            all_uploaded_tracks = list(executor.map(upload, all_tracks))
+        return [track for track in all_uploaded_tracks if track]
@@ -0,0 +1,79 @@
+"""
+Per-account record of the tracks already monetized or waiting for the monetization review, so the bot only looks at
+the new uploads instead of paging through the whole catalog.
+
+Each account has a JSON file in Settings.MONETIZATION_INDEX_DIR: normalized title -> {"title", "status", "updated_at"}.
+The record is reconciled with the monetization view as it is read: a track offered for monetization again (e.g. a
+rejected submission) leaves the record, a track already monetized from elsewhere joins it.
+"""
+import json
+import os
+import threading
+import time
+
+from settings import Settings
+from soundcloud_uploads.upload_index import normalize_title
+
+MONETIZED = "monetized"
+PENDING = "pending"
+# Not offered for monetization, e.g. a cover
+INELIGIBLE = "ineligible"
+
+index_lock = threading.Lock()
+
+
+class MonetizationIndex:
+
+    def __init__(self, account):
+        """
+        :param account: Soundcloud account username
+        """
+        self.account = account
+        self.path = os.path.join(Settings.MONETIZATION_INDEX_DIR, f"{account}.json")
+        self.entries = {}
+        if os.path.exists(self.path):
+            with index_lock, open(self.path, "r") as file:
+                self.entries = json.load(file)
+
+    def is_known(self, title) -> bool:
+        return normalize_title(title) in self.entries
+
+    def get_candidates(self, all_titles) -> set:
+        """
+        :param all_titles: Titles of the tracks uploaded to the account
+        :return: Normalized titles not monetized nor pending yet
+        """
+        return {normalize_title(title) for title in all_titles if title and not self.is_known(title)}
+
+    def mark(self, title, status):
+        """
+        :param title: Track title
+        :param status: MONETIZED / PENDING / INELIGIBLE
+        """
+        self.entries[normalize_title(title)] = {"title": title, "status": status, "updated_at": time.time()}
+
+    def reconcile(self, all_rows) -> int:
+        """
+        Update the record with the rows read from the monetization view
+        :param all_rows: List of {"title", "status", "button"}. button is set if the track can be monetized
+        :return: No of rows that were not in the record, or not in the same state
+        """
+        no_of_changes = 0
+        for row in all_rows:
+            key = normalize_title(row["title"])
+            if row["button"]:
+                if self.entries.pop(key, None):
+                    no_of_changes += 1
+                elif key:
+                    no_of_changes += 1
+            elif key and self.entries.get(key, {}).get("status") != row["status"]:
+                self.mark(row["title"], row["status"])
+                no_of_changes += 1
+        return no_of_changes
+
+    def save(self):
+        os.makedirs(Settings.MONETIZATION_INDEX_DIR, exist_ok=True)
+        with index_lock:
+            with open(self.path + ".tmp", "w") as file:
+                json.dump(self.entries, file, indent=2)
+            os.replace(self.path + ".tmp", self.path)
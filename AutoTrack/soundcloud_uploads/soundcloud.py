@@ -6,9 +6,20 @@ import traceback
 from selenium.webdriver import Keys
 from selenium.common import ElementClickInterceptedException, JavascriptException, NoSuchElementException, TimeoutException
 
-from WebAutomations.AutoTrack.helpers import handle_exception, wait_for_elements_presence, wait_for_elements_to_be_clickable
-from WebAutomations.AutoTrack.settings import Settings
-from WebAutomations.AutoTrack.utils import sign_in_with_google, get_all_downloaded_audios, save_cookies, load_cookies
+from helpers import handle_exception, uc_open_with_policy, wait_for_elements_presence, \
+    wait_for_elements_to_be_clickable
+from settings import Settings
+from utils import sign_in_with_google, save_cookies, load_cookies, get_platform_account_token, \
+    scroll_down
+from memory_watchdog import memory_watchdog, recycle_if_needed
+from session_recorder import annotate_session
+from records import UploadResult
+from run_state import RunCancelled, clear_stage, heartbeat, set_stage
+from soundcloud_uploads.upload_index import UploadIndex, normalize_title
+from soundcloud_uploads.monetization_index import MonetizationIndex, PENDING
+from profiles import record_first_load
+from pacing import pace
+from helpers import logger
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -16,39 +27,50 @@ from selenium.webdriver.support import expected_conditions as EC
 
 
 SOUND_CLOUD_BASE_URL = "https://api.soundcloud.com/"
+# Steps of the soundcloud bot, in order
+SOUNDCLOUD_STAGES = ("upload", "sync", "monetize")
+# Title input of each track form of the upload page. The form leaves the page once the track is saved
+UPLOAD_TITLE_SELECTOR = 'div.baseFields__data > div.baseFields__title > div.textfield > div.textfield__inputWrapper > input'
 
 
 class SoundCloud:
 
     def __init__(self, driver):
         self.driver = driver
-        self.result = {
-            "account": "",
-            "upload_count": 0,
-            "monetization_count": 0
-        }
+        self.result = UploadResult()
+        # Tracks whose upload form has been saved, for the upload index
+        self.uploaded_tracks = []
+        # (link, username, password) of the last login
+        self.login_args = None
 
     # Login into soundcloud
-    def login(self, link, username, password, retry=Settings.MAX_RETRY):
+    def login(self, link, username, password, retry=Settings.MAX_RETRY, use_cookies=True):
         """
         Log in to soundcloud account using Google credentials
         :param link: A soundcloud redirect link with client_id, request_type data
         :param username: Account username
         :param password: Account password
         :param retry: Number of attempts to retry login in case of failure
+        :param use_cookies: Try the saved cookies before the Google login
+        :return: "cookies" if the saved session was still valid, "credentials" after a Google login,
+            None if the login failed
         """
         # Vérifier si le nombre d'essais est positif
         if retry > 0:
-            self.result['account'] = username
+            self.result.account = username
+            # Pour se reconnecter après un redémarrage du navigateur
+            self.login_args = (link, username, password)
 
             try:
                 print(f"Logging in to Soundcloud with: {username}\n")
+                pace("soundcloud", "login")
 
                 # Check if a cookie file exists for the account username
                 account_cookie_file_path = f"cookies/soundcloud/{username}.pkl"
-                if os.path.exists(account_cookie_file_path):
+                if use_cookies and os.path.exists(account_cookie_file_path):
                     # Open the upload page
-                    self.driver.uc_open("https://soundcloud.com/upload")
+                    uc_open_with_policy(self.driver, "https://soundcloud.com/upload")
+                    record_first_load(self.driver, "soundcloud", username)
                     # Load the cookies
                     load_cookies(self.driver, "soundcloud", username)
                     # Wait a bit for the cookies to become active
@@ -57,13 +79,14 @@ class SoundCloud:
                     logged_out = self.driver.execute_script("return (document.querySelector('.loginButton'))")
                     if not logged_out:
                         print("Login Success with cookies")
-                        return
+                        return "cookies"
                     else:
                         # delete the cookies file
                         os.remove(account_cookie_file_path)
 
                 # Ouvrir le lien de redirection de SoundCloud
-                self.driver.uc_open(link)
+                uc_open_with_policy(self.driver, link)
+                record_first_load(self.driver, "soundcloud", username)
 
 
                 # Cliquer sur le bouton de connexion avec Google
@@ -101,12 +124,13 @@ class SoundCloud:
                 except TimeoutException:
                     print("Cannot find cookies\n")
                     pass
+                return "credentials"
 
             except Exception as e:
                 # En cas d'exception, afficher le message d'erreur et réessayer avec un essai en moins
                 print(
                     f"Unable to login {username}. Error: {e}. Retrying ...\n")
-                return self.login(link, username, password, (retry - 1))
+                return self.login(link, username, password, (retry - 1), use_cookies)
         else:
             # Si le nombre d'essais est nul ou négatif, fermer le navigateur et sortir de la fonction
             print(
@@ -133,24 +157,28 @@ class SoundCloud:
     def upload_tracks(self, downloaded_audios_info: list):
         """
         Upload downloaded tracks from suno_ai_spider run to the given to the artist profile
+        :param downloaded_audios_info: List of TrackRecord to upload. Tracks already on the account are filtered out before
         """
-        # Select the choose file to upload btn
-        selected_audios = get_all_downloaded_audios()
+        # Un nouvel essai ne renvoie pas les pistes déjà enregistrées
+        downloaded_audios_info = [track for track in downloaded_audios_info if track not in self.uploaded_tracks]
+        # Only the files of the given tracks are uploaded
+        selected_audios = [audio_path for audio_path in
+                           (os.path.abspath(track.audio_path or os.path.join("downloaded_files", f"{track.title}.mp3"))
+                            for track in downloaded_audios_info) if os.path.isfile(audio_path)]
 
         if len(selected_audios) == 0:
             print("No tracks to upload.")
             return
 
-        self.driver.uc_open(
-            Settings.SOUND_CLOUD_BASE_URL.replace("secure.", "") + "upload")
+        uc_open_with_policy(self.driver, Settings.SOUND_CLOUD_BASE_URL.replace("secure.", "") + "upload")
 
         # Dismiss if any pop up window shows up
         self.driver.sleep(2)
         self.driver.press_keys("button", Keys.ESCAPE)
 
         # Extract and save the cookies only if the cookie as not been set for the account
-        if not os.path.exists(f"cookies/soundcloud/{self.result['account']}.pkl"):
-            save_cookies(self.driver, "soundcloud", self.result['account'])
+        if not os.path.exists(f"cookies/soundcloud/{self.result.account}.pkl"):
+            save_cookies(self.driver, "soundcloud", self.result.account)
 
         # Click on not to create playlist
         self.driver.execute_script(
@@ -159,10 +187,12 @@ class SoundCloud:
 
         # Upload the audio files
         print("Uploading files")
+        # Un jeton par piste du lot téléversé
+        pace("soundcloud", "upload", len(selected_audios))
 
         wait_for_elements_to_be_clickable(self.driver, "input.chooseFiles__input.sc-visuallyhidden")[0].send_keys(
             "\n".join(selected_audios))
-        genre_name = downloaded_audios_info[0]['genre']
+        genre_name = downloaded_audios_info[0].genre
         print(f"Genre name is: {genre_name}")
 
         # Wait for all audio to upload
@@ -170,28 +200,30 @@ class SoundCloud:
         upload_status = self.driver.get_text(
             "span.uploadButton__title", timeout=Settings.TIMEOUT)
         while "processing" in upload_status.lower() or "uploading" in upload_status.lower():
+            heartbeat()
             self.driver.sleep(1)
             upload_status = self.driver.get_text("span.uploadButton__title")
         print("Upload processing done")
 
-        all_uploads_titles = wait_for_elements_presence(self.driver,
-                                                        'div.baseFields__data > div.baseFields__title > div.textfield > div.textfield__inputWrapper > input')
+        all_uploads_titles = wait_for_elements_presence(self.driver, UPLOAD_TITLE_SELECTOR)
         all_uploads_img = wait_for_elements_presence(
             self.driver, 'input.imageChooser__fileInput.sc-visuallyhidden')
         all_uploads_tags = wait_for_elements_presence(
             self.driver, 'input.tagInput__input.tokenInput__input')
 
         print("Filling Tracks upload form ...")
+        filled_tracks = []
         for each in all_uploads_titles:
             for audio_info in downloaded_audios_info:
-                if each.get_attribute("value").lower() == audio_info["title"].lower():
+                if each.get_attribute("value").lower() == audio_info.title.lower():
+                    filled_tracks.append(audio_info)
                     track_index = all_uploads_titles.index(each)
                     # Upload the track image
                     all_uploads_img[track_index].send_keys(
-                        audio_info["img_path"])
+                        audio_info.img_path)
                     # Set the additional tracks tags
                     # Convert the tag list to a string separated by spaces
-                    tag_list_str = " ".join(audio_info["tag_list"])
+                    tag_list_str = " ".join(audio_info.tag_list)
                     # Copy the tag list string to the clipboard
                     pyperclip.copy(tag_list_str)
                     # Paste the tag list string from the clipboard
@@ -200,13 +232,38 @@ class SoundCloud:
                     break
         self.driver.execute_script(
             open("soundcloud_uploads/upload.js").read(), genre_name)
-        print(f"{len(all_uploads_titles)} tracks has been uploaded")
-        self.result['upload_count'] = len(all_uploads_img)
-        # Wait for all tracks to get uploaded
-        self.driver.sleep(30)
 
-    def fill_monetization_form(self, btn_ele, no_of_retry=3):
-        """ Fills the monetization form for a track and retry for the no_of_retry if a javascript error is raised"""
+        # Les pistes ne comptent comme téléversées qu'une fois leur formulaire enregistré
+        unsaved_titles = self.wait_for_saved_uploads()
+        saved_tracks = [track for track in filled_tracks if track.title.lower() not in unsaved_titles]
+        self.uploaded_tracks += saved_tracks
+        self.result.upload_count = len(self.uploaded_tracks)
+        print(f"{len(saved_tracks)} tracks has been uploaded")
+        if unsaved_titles:
+            logger.warning(f"{self.result.account}: upload not saved for {sorted(unsaved_titles)}")
+
+    def wait_for_saved_uploads(self, timeout=Settings.TIMEOUT) -> set:
+        """
+        Wait for the track forms of the upload page to be saved
+        :param timeout: Max no of secs to wait
+        :return: Lower case titles of the forms still not saved
+        """
+        waited_until = time.time() + timeout
+        while True:
+            heartbeat()
+            self.driver.sleep(3)
+            unsaved_titles = set(self.driver.execute_script(
+                "return Array.from(document.querySelectorAll(arguments[0]), input => input.value.toLowerCase())",
+                UPLOAD_TITLE_SELECTOR) or [])
+            if not unsaved_titles or time.time() > waited_until:
+                return unsaved_titles
+
+    def fill_monetization_form(self, btn_ele, no_of_retry=3) -> bool:
+        """
+        Fills the monetization form for a track and retry for the no_of_retry if a javascript error is raised
+        :return: True if the form has been submitted
+        """
+        pace("soundcloud", "monetize")
         self.driver.execute_script("arguments[0].click()", btn_ele)
         wait_for_elements_presence(self.driver, "#monetization-form")
         self.driver.sleep(1)
@@ -235,21 +292,73 @@ class SoundCloud:
         """
         try:
             self.driver.execute_script(fill_form_js_script)
+            return True
         except JavascriptException:
             # If this exception is raised. Re-run the function and execute the script again
             self.driver.execute_script("arguments[0].click()", btn_ele)
             if not no_of_retry <= 0:
-                self.fill_monetization_form(btn_ele, (no_of_retry - 1))
-            else:
-                print("Retry exceeded")
+                return self.fill_monetization_form(btn_ele, (no_of_retry - 1))
+            print("Retry exceeded")
         except NoSuchElementException:
             pass
         except Exception as e:
             print(e)
+        return False
 
-    def monetize_track(self, max_num_of_pages=3):
+    def read_monetization_rows(self) -> list:
+        """
+        Read the tracks listed on the current page of the monetization view
+        :return: List of {"title", "status", "button"}. button is the "Monetize this track" button, None if there is none
         """
-        Monetize tracks on the account. Paginates to the next page if needed.
+        return self.driver.execute_script("""
+            return Array.from(document.querySelectorAll(arguments[0]), row => {
+                let button = Array.from(row.querySelectorAll("button"))
+                    .find(btn => btn.textContent.includes("Monetize this track"));
+                let title_ele = row.querySelector(arguments[1]);
+                let text = row.innerText.toLowerCase();
+                let status = "ineligible";
+                if (button) status = null;
+                else if (/pending|review|processing/.test(text)) status = "pending";
+                else if (text.includes("monetiz")) status = "monetized";
+                return {
+                    title: (title_ele ? title_ele.textContent : row.innerText.split("\\n")[0]).trim(),
+                    status: status,
+                    button: button || null,
+                };
+            });
+        """, Settings.MONETIZATION_ROW_SELECTOR, Settings.MONETIZATION_TITLE_SELECTOR) or []
+
+    def go_to_next_monetization_page(self, first_title) -> bool:
+        """
+        Click on the next page of the monetization view and wait for its rows
+        :param first_title: Title of the first row of the current page
+        :return: False if there is no next page
+        """
+        has_next_page = self.driver.execute_script("""
+            var paginationButton = document.querySelector('button[aria-label="Go to next page"]');
+            if (!paginationButton || paginationButton.disabled) return false;
+            paginationButton.scrollIntoView();
+            paginationButton.click();
+            return true;
+        """)
+        if not has_next_page:
+            return False
+        try:
+            WebDriverWait(self.driver, Settings.TIMEOUT).until(
+                lambda driver: [row["title"] for row in self.read_monetization_rows()][:1] not in ([], [first_title]))
+        except TimeoutException:
+            print("The next monetization page did not load")
+            return False
+        return True
+
+    def monetize_track(self, monetization_index, all_uploaded_titles=(), max_num_of_pages=Settings.MONETIZATION_MAX_PAGES):
+        """
+        Monetize the new tracks of the account.
+        The monetization view lists the newest tracks first, so the pages are read until none of the uploaded tracks
+        is left to monetize and a page only has tracks the monetization index already knows
+        :param monetization_index: MonetizationIndex of the account, reconciled with the pages read
+        :param all_uploaded_titles: Titles of the tracks uploaded to the account
+        :param max_num_of_pages: Max no of pages to read
         """
         print("Monetizing Tracks ....")
 
@@ -262,50 +371,61 @@ class SoundCloud:
         except TimeoutException:
             pass
 
-        self.driver.sleep(2)
-
-        i = 1  # Counter for the number of monetized songs
-        while max_num_of_pages > 0:
-            # Get the monetization btn elements
-            all_monetize_track_btns = self.driver.find_elements(
-                By.XPATH, "//button[contains(text(), 'Monetize this track')]")
-
-            print(
-                f"Found {len(all_monetize_track_btns)} tracks to monetize on Page {4 - max_num_of_pages}")
-
-            # Monetize tracks if available
-            if all_monetize_track_btns:
-                # Monetize all tracks on the current page
-                for btn_ele in all_monetize_track_btns:
-                    print(f"{i} monetized song...")
-                    self.fill_monetization_form(btn_ele)
-                    self.driver.sleep(2)
-                    i += 1
-
-            js_script = """
-            var paginationButton = document.querySelector('button[aria-label="Go to next page"]');
-            if (paginationButton) {
-                paginationButton.scrollIntoView();
-                paginationButton.click();
-            }
-            """
-            try:
-                # Execute JavaScript to scroll to and click the pagination button
-                self.driver.execute_script(js_script)
-                print(
-                    f"Navigating to monetization next page - Page {3 - max_num_of_pages}")
-                self.driver.sleep(7)
-                max_num_of_pages -= 1
-                continue
-            except TimeoutException:
-                print("No more pages to navigate.")
+        # Titres téléversés qui ne sont encore ni monétisés ni en attente
+        all_candidates = monetization_index.get_candidates(all_uploaded_titles)
+        print(f"{len(all_candidates)} uploaded tracks are not monetized yet")
+        wait_for_elements_presence(self.driver, Settings.MONETIZATION_ROW_SELECTOR)
+
+        for page in range(1, max_num_of_pages + 1):
+            heartbeat()
+            all_rows = self.read_monetization_rows()
+            no_of_changes = monetization_index.reconcile(all_rows)
+            print(f"Found {len([row for row in all_rows if row['button']])} tracks to monetize on Page {page}")
+
+            # La page est relue après chaque envoi : les boutons lus avant ne sont plus valides une fois la liste
+            # redessinée
+            all_tried_titles = set()
+            while True:
+                row = next((row for row in self.read_monetization_rows()
+                            if row["button"] and row["title"] not in all_tried_titles), None)
+                if row is None:
+                    break
+                all_tried_titles.add(row["title"])
+                print(f"{self.result.monetization_count + 1} monetized song...")
+                if not self.fill_monetization_form(row["button"]):
+                    logger.warning(f"{self.result.account}: monetization form of {row['title']} not submitted")
+                    continue
+                self.driver.sleep(2)
+                monetization_index.mark(row["title"], PENDING)
+                self.result.monetization_count += 1
+            all_candidates -= {normalize_title(row["title"]) for row in all_rows}
+            monetization_index.save()
+
+            # Les pages suivantes ne contiennent que des pistes plus anciennes, déjà connues
+            if not all_rows or not all_candidates or not no_of_changes:
                 break
-            except Exception as e:
-                print(f"Pagination button not found or not clickable: {e}")
-                traceback.print_exc()  # print the full traceback
+            if not self.go_to_next_monetization_page(all_rows[0]["title"]):
                 break
+            print(f"Navigating to monetization next page - Page {page + 1}")
+            # Restart the browser between two pages if it uses too much memory.
+            # The index tells which tracks were already seen on the reloaded pages
+            recycle_if_needed(self, "soundcloud", self.result.account)
+
+        if all_candidates:
+            print(f"{len(all_candidates)} uploaded tracks are not in the monetization view yet")
+        print(f"{self.result.monetization_count} tracks have been monetized")
 
-        print(f"{i-1} tracks have been monetized")
+    def get_account_track_titles(self) -> list:
+        """
+        Read the titles of all the tracks on the logged in account
+        """
+        self.driver.get(Settings.SOUND_CLOUD_BASE_URL + "you/tracks")
+        self.driver.sleep(3)
+        # La liste se charge au fur et à mesure du défilement
+        scroll_down(self.driver)
+        return self.driver.execute_script("""
+            return Array.from(document.querySelectorAll("a.soundTitle__title span"), element => element.textContent.trim());
+        """) or []
 
     @handle_exception()
     def sync_soundcloud_tracks(self):
@@ -314,6 +434,7 @@ class SoundCloud:
         :return:
         """
         print("Synchronizing ...")
+        pace("soundcloud", "sync")
         self.driver.get(Settings.SOUND_CLOUD_ARTIST_BASE_URL + "monetization")
         try:
             WebDriverWait(self.driver, timeout=Settings.TIMEOUT).until(EC.element_to_be_clickable(
@@ -330,37 +451,112 @@ class SoundCloud:
             return False
 
 
-def run_soundcloud_bot(driver, link, username, password, store, soundcloud_result: list):
+def get_track_keys(store, tracks_to_upload, uploaded_tracks) -> list:
+    """
+    :param store: Tracks given to the bot
+    :param tracks_to_upload: Tracks of the store that were not on the account yet
+    :param uploaded_tracks: Tracks the bot uploaded
+    :return: TrackRecord.key() of the tracks of the store now on the account
+    """
+    all_keys_to_upload = {track.key() for track in tracks_to_upload}
+    return [track.key() for track in store if track.key() not in all_keys_to_upload] \
+        + [track.key() for track in uploaded_tracks]
+
+
+def skip_uploaded_tracks(upload_index, all_tracks) -> list:
+    """
+    :param upload_index: UploadIndex of the account
+    :param all_tracks: List of TrackRecord to upload
+    :return: The tracks not on the account yet. The others are reported
+    """
+    tracks_to_upload, already_uploaded, same_titles = upload_index.filter_tracks(all_tracks)
+    if same_titles:
+        logger.warning(f"{upload_index.account}: uploading new tracks named like older ones "
+                       f"{[track.title for track in same_titles]}")
+    if already_uploaded:
+        print(f"Skipping {len(already_uploaded)} tracks already on {upload_index.account}: "
+              f"{', '.join(track.title for track in already_uploaded)}")
+        logger.info(f"{upload_index.account}: skipped already uploaded {[track.title for track in already_uploaded]}")
+    return tracks_to_upload
+
+
+def run_soundcloud_bot(driver, link, username, password, store, result_bus, stages=SOUNDCLOUD_STAGES):
     """
     Run the soundcloud action bot
     :@param driver: Seleniumbase webdriver object
     :param link: Authentication link from soundcloud
     :param username:  registered username
     :param password: Soundcloud password
-    :param store: List of all downloaded tracks from suno AI bot
-    :param soundcloud_result: List to store the result of the soundcloud bot run
+    :param store: List of all downloaded tracks TrackRecord from suno AI bot
+    :param result_bus: ResultBus to publish the UploadResult of the soundcloud bot run to
+    :param stages: Steps to run among SOUNDCLOUD_STAGES. The stage commands of main.py run them one at a time
     """
-    # Vérifier si la liste des pistes à télécharger n'est pas vide
-    if store:
+    # Vérifier si la liste des pistes à télécharger n'est pas vide, sauf si le bot ne fait que synchroniser ou monétiser
+    if store or "upload" not in stages:
         # Créer un objet SoundCloud avec le driver
         soundcloud_bot = SoundCloud(driver)
+        annotate_session(driver, bot="soundcloud", username=username, link=link,
+                         store=[track.to_dict() for track in store])
+        memory_watchdog.register(username, driver)
         # Essayer de se connecter, de télécharger les pistes, de les synchroniser et de les monétiser
         try:
-            soundcloud_bot.login(link, username, password)
-            soundcloud_bot.upload_tracks(store)
-            if soundcloud_bot.sync_soundcloud_tracks():
+            # Avec un token OAuth, les pistes sont téléversées par l'API. Le navigateur ne sert qu'à la monétisation
+            # Index des pistes déjà présentes sur le compte, pour ne pas les téléverser deux fois
+            upload_index = UploadIndex(username)
+            token = get_platform_account_token("soundcloud", username) if "upload" in stages else None
+            if token:
+                from soundcloud_uploads.api_uploader import SoundCloudAPIUploader
+                set_stage("api_upload", username)
+                api_uploader = SoundCloudAPIUploader(token)
+                if not upload_index.exists:
+                    upload_index.rebuild(api_uploader.get_track_titles())
+                tracks_to_upload = skip_uploaded_tracks(upload_index, store)
+                uploaded_tracks = api_uploader.upload_tracks(tracks_to_upload)
+                upload_index.add_tracks(uploaded_tracks)
+                soundcloud_bot.result.account = username
+                soundcloud_bot.result.upload_count = len(uploaded_tracks)
+                soundcloud_bot.result.track_keys = get_track_keys(store, tracks_to_upload, uploaded_tracks)
+                if set(stages) - {"upload"}:
+                    set_stage("sign_in")
+                    soundcloud_bot.login(link, username, password)
+            else:
+                set_stage("sign_in", username)
+                soundcloud_bot.login(link, username, password)
+                if "upload" in stages:
+                    if not upload_index.exists:
+                        upload_index.rebuild(soundcloud_bot.get_account_track_titles())
+                    tracks_to_upload = skip_uploaded_tracks(upload_index, store)
+                    set_stage("upload")
+                    if tracks_to_upload:
+                        soundcloud_bot.upload_tracks(tracks_to_upload)
+                        upload_index.add_tracks(soundcloud_bot.uploaded_tracks)
+                    soundcloud_bot.result.track_keys = get_track_keys(store, tracks_to_upload,
+                                                                      soundcloud_bot.uploaded_tracks)
+            recycle_if_needed(soundcloud_bot, "soundcloud", username)
+            is_synced = True
+            if "sync" in stages:
+                set_stage("sync")
+                is_synced = soundcloud_bot.sync_soundcloud_tracks()
+            if "monetize" in stages and is_synced:
+                set_stage("monetize")
                 soundcloud_bot.driver.get(
                     Settings.SOUND_CLOUD_ARTIST_BASE_URL + "monetization")
-                soundcloud_bot.monetize_track()
-            # Ajouter le résultat à la liste soundcloud_result
-            soundcloud_result.append(soundcloud_bot.result)
+                soundcloud_bot.monetize_track(MonetizationIndex(username),
+                                              [entry["title"] for entry in upload_index.entries])
+            # Publier le résultat du compte
+            result_bus.publish(soundcloud_bot.result)
+        except RunCancelled as e:
+            # Le superviseur a déjà tué le navigateur
+            print(f"Soundcloud bot of {username} cancelled: {e}")
         # En cas d'exception, afficher l'erreur et la trace complète
         except Exception as e:
             print("Error on soundcloud.py : ", e)
             traceback.print_exc()
         # Fermer le driver
         finally:
-            driver.quit()
+            memory_watchdog.unregister(username)
+            clear_stage()
+            soundcloud_bot.driver.quit()
     # Sinon, afficher un message indiquant qu'il n'y a pas de pistes à télécharger
     else:
         print("No Tracks to upload. ")
@@ -0,0 +1,113 @@
+"""
+Per-account index of the tracks already uploaded to soundcloud, to skip duplicates when a run is restarted.
+
+Each account has a JSON file in Settings.UPLOAD_INDEX_DIR with the sha256 of the uploaded audio files, their suno
+clip ids and titles. A track is already uploaded if its clip id or its audio hash is in the index. When the file is
+missing the index is rebuilt from the titles of the account track list. Those entries only have a title: a track
+downloaded before the rebuild with one of those titles is taken as uploaded, e.g. by the run that lost the index.
+A newer track with an old title is a different song, it is uploaded and only reported.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from settings import Settings
+
+index_lock = threading.Lock()
+
+
+def get_audio_hash(path) -> str:
+    """
+    :param path: Audio file
+    :return: sha256 hex digest of the file, or "" if it does not exist
+    """
+    if not path or not os.path.isfile(path):
+        return ""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def normalize_title(title) -> str:
+    return " ".join(title.lower().split())
+
+
+class UploadIndex:
+
+    def __init__(self, account):
+        """
+        :param account: Soundcloud account username
+        """
+        self.account = account
+        self.path = os.path.join(Settings.UPLOAD_INDEX_DIR, f"{account}.json")
+        self.entries = []
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            with index_lock, open(self.path, "r") as file:
+                self.entries = json.load(file)
+
+    def _keys(self):
+        all_rebuilt_titles = {}
+        for entry in self.entries:
+            if entry.get("rebuilt"):
+                title = normalize_title(entry["title"])
+                all_rebuilt_titles[title] = max(all_rebuilt_titles.get(title, 0), entry.get("rebuilt_at", 0))
+        return ({entry["clip_id"] for entry in self.entries if entry.get("clip_id")},
+                {entry["sha256"] for entry in self.entries if entry.get("sha256")},
+                all_rebuilt_titles)
+
+    def filter_tracks(self, all_tracks) -> tuple:
+        """
+        :param all_tracks: List of TrackRecord to upload
+        :return: (tracks not uploaded yet, tracks already on the account, tracks not uploaded yet whose title is
+            one of the rebuilt index)
+        """
+        all_clip_ids, all_hashes, all_rebuilt_titles = self._keys()
+        to_upload, already_uploaded, same_titles = [], [], []
+        for track in all_tracks:
+            rebuilt_at = all_rebuilt_titles.get(normalize_title(track.title))
+            if (track.clip_id and track.clip_id in all_clip_ids) or get_audio_hash(track.audio_path) in all_hashes:
+                already_uploaded.append(track)
+            elif rebuilt_at and track.audio_path and os.path.isfile(track.audio_path) \
+                    and os.path.getmtime(track.audio_path) < rebuilt_at:
+                already_uploaded.append(track)
+            else:
+                to_upload.append(track)
+                if rebuilt_at is not None:
+                    same_titles.append(track)
+        return to_upload, already_uploaded, same_titles
+
+    def add_tracks(self, all_tracks):
+        """
+        Save uploaded tracks to the index
+        :param all_tracks: List of TrackRecord
+        """
+        for track in all_tracks:
+            self.entries.append({
+                "clip_id": track.clip_id,
+                "sha256": get_audio_hash(track.audio_path),
+                "title": track.title,
+                "uploaded_at": time.time(),
+            })
+        self.save()
+
+    def rebuild(self, all_titles):
+        """
+        Create the index from the titles of the tracks on the account
+        :param all_titles: Titles of the account tracks
+        """
+        rebuilt_at = time.time()
+        self.entries = [{"title": title, "rebuilt": True, "rebuilt_at": rebuilt_at} for title in all_titles if title]
+        self.save()
+
+    def save(self):
+        os.makedirs(Settings.UPLOAD_INDEX_DIR, exist_ok=True)
+        with index_lock:
+            with open(self.path + ".tmp", "w") as file:
+                json.dump(self.entries, file, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+        self.exists = True
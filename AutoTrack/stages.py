@@ -0,0 +1,275 @@
+"""
+The steps of the daily flow as separate commands, so each one can run on its own hosts, concurrency and schedule:
+
+    python main.py generate  suno generation and download. Every track is queued for upload
+    python main.py upload    uploads the queued tracks to every soundcloud account, then queues a sync of each account
+    python main.py sync      syncs the queued accounts with soundcloud, then queues their monetization
+    python main.py monetize  monetizes the new tracks of the queued accounts, or of every account with --all
+    python main.py report    prints the queue and the results of the stages
+
+Add --every <secs> to run a stage again on a schedule. The stages share the WorkQueue in Settings.STAGE_QUEUE_DB,
+kept between runs. SQLite locks the file, so the stages can lease from it at the same time.
+The queue is a local SQLite file and the upload items hold the local paths of the downloaded files: every stage must
+run on the same host, or on hosts sharing the working folder at the same path. An upload item whose audio file is
+not there is failed instead of being uploaded.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from pacing import pacer
+from records import TrackRecord, UploadResult
+from result_bus import ResultBus
+from settings import Settings
+from supervisor import Supervisor
+from utils import get_available_platform_accounts_v2
+from work_queue import WorkQueue
+
+# Stage -> kind of the work items it leases and kind of the items it queues for the next stage
+STAGE_KINDS = {
+    "generate": (None, "upload"),
+    "upload": ("upload", "sync"),
+    "sync": ("sync", "monetize"),
+    "monetize": ("monetize", None),
+}
+
+
+def lease_all(queue, kind, worker_id, limit=None) -> list:
+    """
+    :param queue: WorkQueue
+    :param kind: Kind of the items to lease
+    :param worker_id: Unique name of the stage process
+    :param limit: Max no of items. All the pending items if None
+    :return: List of leased items
+    """
+    all_items = []
+    while limit is None or len(all_items) < limit:
+        item = queue.lease(worker_id, kind)
+        if item is None:
+            break
+        all_items.append(item)
+    return all_items
+
+
+def _keep_leases(queue, all_items, worker_id, stop_event):
+    """ Send heartbeats for the leased items until the stage is done with them """
+    while not stop_event.wait(Settings.WORK_QUEUE_LEASE_SECS / 3):
+        for item in all_items:
+            if not queue.heartbeat(item["id"], worker_id):
+                print(f"Lost the lease of work item {item['id']}")
+
+
+def run_accounts(target, all_accounts, concurrency, name):
+    """
+    Run a bot for every account, with at most concurrency of them at the same time
+    :param target: Function called with the (username, password) of an account
+    :param all_accounts: List of (username, password)
+    :param concurrency: Max no of bots running at the same time
+    :param name: Prefix of the thread names
+    """
+    def run(account):
+        try:
+            target(*account)
+        except Exception as e:
+            print(f"{name} failed for {account[0]}: {e}")
+            traceback.print_exc()
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix=name) as executor:
+        list(executor.map(run, all_accounts))
+
+
+def run_generate(queue, worker_id, concurrency):
+    """ Generate and download tracks with every suno account that has credits, and queue them for upload """
+    from helpers import prepare_driver
+    from browser_contexts import BrowserPool
+    from sunodownloads.credit_planner import get_credit_balances, plan_prompts
+    from sunodownloads.suno_ai_spider import run_suno_bot
+    from utils import get_daily_genre_prompts
+
+    all_suno_accounts = get_available_platform_accounts_v2("suno")
+    _, all_daily_prompts = get_daily_genre_prompts()
+    prompts_plan = plan_prompts(get_credit_balances([account[0] for account in all_suno_accounts]), all_daily_prompts)
+    all_suno_accounts = [account for account in all_suno_accounts if account[0] in prompts_plan]
+    print(f"{len(all_suno_accounts)} Suno accounts have enough credits\n")
+
+    prepare_driver()
+    browsers = BrowserPool("suno")
+    result_bus = ResultBus()
+    tracks_queue = result_bus.subscribe(TrackRecord.KIND)
+
+    def generate(username, password):
+        run_suno_bot(browsers.driver_for(username), username, password, prompts_plan[username], result_bus)
+        # Les chansons sont mises en file dès que le compte a fini, sans attendre les autres
+        for track in ResultBus.drain(tracks_queue):
+            queue.publish("upload", track.to_dict())
+
+    run_accounts(generate, all_suno_accounts, concurrency, "generate")
+    print(f"Queued {result_bus.published.get(TrackRecord.KIND, 0)} tracks for upload\n")
+
+
+def run_soundcloud_stage(stage, queue, worker_id, concurrency, all_items, all_accounts, store=()) -> list:
+    """
+    Run one step of the soundcloud bot on accounts while keeping the lease of the items
+    :param stage: upload / sync / monetize
+    :param all_items: Leased items the accounts work for
+    :param all_accounts: List of (username, password)
+    :param store: TrackRecord to upload
+    :return: List of the UploadResult of the accounts that went through
+    """
+    from helpers import prepare_driver
+    from browser_contexts import BrowserPool
+    from soundcloud_uploads.soundcloud import run_soundcloud_bot
+
+    stop_event = threading.Event()
+    threading.Thread(target=_keep_leases, args=(queue, all_items, worker_id, stop_event), daemon=True).start()
+    try:
+        prepare_driver()
+        browsers = BrowserPool("soundcloud")
+        result_bus = ResultBus()
+        results_queue = result_bus.subscribe(UploadResult.KIND)
+
+        def run(username, password):
+            run_soundcloud_bot(browsers.driver_for(username), os.getenv("SOUNDCLOUD_LINK"), username, password,
+                               list(store), result_bus, stages=(stage,))
+
+        run_accounts(run, all_accounts, concurrency, stage)
+        return ResultBus.drain(results_queue)
+    finally:
+        stop_event.set()
+
+
+def run_upload(queue, worker_id, concurrency):
+    """ Upload the queued tracks to every soundcloud account """
+    from janitor import DiskJanitor, get_track_files
+
+    all_items = []
+    for item in lease_all(queue, "upload", worker_id, Settings.STAGE_UPLOAD_BATCH_SIZE):
+        audio_path = get_track_files(TrackRecord.from_dict(item["payload"]))[0]
+        if os.path.isfile(audio_path):
+            all_items.append(item)
+        else:
+            # Les fichiers sont sur l'hôte qui les a générés, pas de dossier partagé avec celui-ci
+            print(f"{audio_path} is not on {socket.gethostname()}, the stages must share the working folder")
+            queue.fail(item["id"], worker_id, f"{audio_path} missing on {socket.gethostname()}")
+    if not all_items:
+        print("No tracks to upload\n")
+        return
+    all_tracks = [TrackRecord.from_dict(item["payload"]) for item in all_items]
+    print(f"Uploading {len(all_tracks)} tracks\n")
+
+    all_accounts = get_available_platform_accounts_v2("soundcloud")
+    all_results = run_soundcloud_stage("upload", queue, worker_id, concurrency, all_items, all_accounts, all_tracks)
+    results_by_account = {result.account: result for result in all_results}
+    # Une chanson n'est terminée qu'une fois sur tous les comptes. Sinon elle est remise en file, les comptes qui
+    # l'ont déjà la sautent grâce à leur index de téléversement
+    all_uploaded_tracks = []
+    for item, track in zip(all_items, all_tracks):
+        all_missing_accounts = [username for username, _ in all_accounts
+                                if track.key() not in getattr(results_by_account.get(username), "track_keys", ())]
+        if all_missing_accounts:
+            queue.fail(item["id"], worker_id, f"Not uploaded to {', '.join(all_missing_accounts)}")
+        else:
+            queue.complete(item["id"], worker_id, sorted(results_by_account))
+            all_uploaded_tracks.append(track)
+    print(f"{len(all_uploaded_tracks)} of {len(all_tracks)} tracks are on every soundcloud account\n")
+    for result in all_results:
+        queue.publish("sync", {"username": result.account, "upload_count": result.upload_count})
+
+    if all_uploaded_tracks:
+        # Les fichiers des chansons encore en file ou en échec sont gardés pour leur téléversement
+        janitor = DiskJanitor()
+        for status in ("pending", "leased", "failed"):
+            for payload in queue.payloads("upload", status):
+                janitor.protect(TrackRecord.from_dict(payload))
+        janitor.confirm_uploaded(all_uploaded_tracks)
+        janitor.sweep()
+
+
+def run_account_stage(stage, queue, worker_id, concurrency, all_accounts_flag=False):
+    """
+    Sync or monetize the queued soundcloud accounts
+    :param stage: sync / monetize
+    :param all_accounts_flag: Run on every soundcloud account, queued or not
+    """
+    all_items = lease_all(queue, stage, worker_id)
+    all_usernames = {item["payload"]["username"] for item in all_items}
+    all_accounts = [account for account in get_available_platform_accounts_v2("soundcloud")
+                    if all_accounts_flag or account[0] in all_usernames]
+    if not all_accounts:
+        print(f"No accounts to {stage}\n")
+        return
+    print(f"Running {stage} on {len(all_accounts)} Soundcloud accounts\n")
+
+    all_results = {result.account: result for result in
+                   run_soundcloud_stage(stage, queue, worker_id, concurrency, all_items, all_accounts)}
+    completed_usernames = set()
+    for item in all_items:
+        username = item["payload"]["username"]
+        result = all_results.get(username)
+        if result:
+            # Un compte mis en file plusieurs fois n'a qu'un résultat, pour ne pas le compter deux fois
+            queue.complete(item["id"], worker_id, None if username in completed_usernames else result.to_dict())
+            completed_usernames.add(username)
+        else:
+            queue.fail(item["id"], worker_id, f"{stage} did not finish")
+    next_kind = STAGE_KINDS[stage][1]
+    if next_kind:
+        for username in all_results:
+            queue.publish(next_kind, {"username": username})
+
+
+def report(queue):
+    """ Print the items of every stage by status and the monetized tracks per account """
+    print("Stage queue:")
+    for kind, _ in STAGE_KINDS.values():
+        if kind:
+            print(f"  {kind}: {queue.counts(kind)}")
+    monetized_per_account = {}
+    for result in filter(None, queue.results("monetize")):
+        monetized_per_account[result["account"]] = monetized_per_account.get(result["account"], 0) \
+            + result["monetization_count"]
+    all_sync_payloads = [payload for status in ("pending", "leased", "done", "failed")
+                         for payload in queue.payloads("sync", status)]
+    print(f"Tracks uploaded to soundcloud: {sum(payload.get('upload_count', 0) for payload in all_sync_payloads)}")
+    print("Tracks monetized per account:")
+    for account, count in sorted(monetized_per_account.items()):
+        print(f"  {account}: {count}")
+
+
+def run_stage(stage, concurrency=None, every=None, all_accounts_flag=False, db_path=Settings.STAGE_QUEUE_DB):
+    """
+    Run a stage once, or every `every` secs until interrupted
+    :param stage: generate / upload / sync / monetize / report
+    :param concurrency: Max no of accounts at the same time. Settings.STAGE_CONCURRENCY of the stage if None
+    :param every: No of secs between two runs. Run once if None
+    :param all_accounts_flag: sync / monetize every soundcloud account, not only the queued ones
+    :param db_path: Stage queue file
+    """
+    queue = WorkQueue(db_path)
+    if stage == "report":
+        report(queue)
+        return
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{stage}"
+    concurrency = concurrency or Settings.STAGE_CONCURRENCY[stage]
+    while True:
+        started_at = time.time()
+        print(f"Running {stage} ({worker_id}, {concurrency} accounts at a time)\n")
+        supervisor = Supervisor().start()
+        if stage == "generate":
+            run_generate(queue, worker_id, concurrency)
+        elif stage == "upload":
+            run_upload(queue, worker_id, concurrency)
+        else:
+            run_account_stage(stage, queue, worker_id, concurrency, all_accounts_flag)
+        supervisor.stop()
+        print(supervisor.report())
+        print(pacer.report())
+        if not every:
+            break
+        wait_secs = max(every - (time.time() - started_at), 0)
+        print(f"Next {stage} in {wait_secs / 60:.0f} min\n")
+        time.sleep(wait_secs)
@@ -0,0 +1,61 @@
+"""
+Startup cost report. Works like `python -X importtime` on the heavy modules the automation loads.
+
+Run with: python main.py --startup-report
+"""
+import os
+import subprocess
+import sys
+
+# Modules that main.py loads lazily. They are measured one by one in a fresh interpreter
+HEAVY_MODULES = [
+    "requests",
+    "selenium.webdriver",
+    "seleniumbase",
+    "sunodownloads.suno_ai_spider",
+    "soundcloud_uploads.soundcloud",
+]
+
+
+def measure_import(module_name) -> list:
+    """
+    Import a module in a new interpreter with -X importtime and parse its report
+    :param module_name: Dotted module name to import
+    :return: List of (self_us, cumulative_us, imported_package) tuples. Empty if the import failed
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if output.returncode != 0:
+        print(f"Unable to import {module_name}: {output.stderr.strip().splitlines()[-1:]}")
+        return []
+
+    all_imports = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, package = line[len("import time:"):].split("|")
+        all_imports.append((int(self_us), int(cumulative_us), package.rstrip()))
+    return all_imports
+
+
+def report_import_times(modules=None, top=10):
+    """
+    Print the cumulative import time of each heavy module and the slowest imports they pull in
+    :param modules: List of module names to measure. Defaults to HEAVY_MODULES
+    :param top: Number of the slowest imports to show per module
+    :return: Dictionary of module name to its cumulative import time in secs
+    """
+    report = {}
+    for module_name in modules or HEAVY_MODULES:
+        all_imports = measure_import(module_name)
+        if not all_imports:
+            continue
+        # The top-level module is the last one to finish importing
+        report[module_name] = all_imports[-1][1] / 1_000_000
+
+        print(f"\n{module_name}: {report[module_name]:.3f}s")
+        for self_us, cumulative_us, package in sorted(all_imports, key=lambda x: x[0], reverse=True)[:top]:
+            print(f"    self {self_us / 1000:8.1f}ms | cumulative {cumulative_us / 1000:8.1f}ms | {package.strip()}")
+
+    print(f"\nTotal import time: {sum(report.values()):.3f}s\n")
+    return report
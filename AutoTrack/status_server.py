@@ -0,0 +1,205 @@
+"""
+Live status of a run over HTTP: python main.py --status (or Settings.STATUS_SERVER)
+
+  - /status.json: every bot thread with its account, stage, time in stage and tracks done, the result bus queue
+    depths, the CPU and memory of every browser, the time waited on each pacing bucket and the tracks per hour over
+    the last Settings.STATUS_WINDOW_SECS
+  - /: the same as a small HTML page refreshed every few secs. Threads in the same stage for more than
+    Settings.STATUS_STALL_SECS are flagged as stalled
+"""
+import html
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from helpers import logger
+from memory_watchdog import get_driver_pids, get_process_tree_cpu_secs, get_process_tree_rss, memory_watchdog
+from pacing import pacer
+from records import TrackRecord, UploadResult
+from result_bus import ResultBus
+from run_state import get_all_states
+from settings import Settings
+
+PAGE_REFRESH_SECS = 5
+# The tracks per hour are not extrapolated from less than this no of secs at the start of the run
+MIN_RATE_WINDOW_SECS = 5 * 60
+
+
+class RunStatus:
+    """ Collects the progress of the run from the result bus, run_state and the memory watchdog """
+
+    def __init__(self, result_bus, window_secs=Settings.STATUS_WINDOW_SECS):
+        """
+        :param result_bus: ResultBus of the run
+        :param window_secs: No of secs the track throughput is measured over
+        """
+        self.result_bus = result_bus
+        self.window_secs = window_secs
+        self.started_at = time.time()
+        self._tracks_queue = result_bus.subscribe(TrackRecord.KIND)
+        self._results_queue = result_bus.subscribe(UploadResult.KIND)
+        # Account -> counts of the run
+        self.tracks_done = {}
+        self.uploads_done = {}
+        self.monetized_done = {}
+        # Time every track was published, oldest first
+        self._track_times = deque()
+        # Browser name -> (time, cpu secs) of the previous measure
+        self._last_cpu = {}
+        self._lock = threading.Lock()
+
+    def _collect(self):
+        now = time.time()
+        for track in ResultBus.drain(self._tracks_queue):
+            self.tracks_done[track.account] = self.tracks_done.get(track.account, 0) + 1
+            self._track_times.append((now, track.account))
+        for result in ResultBus.drain(self._results_queue):
+            self.uploads_done[result.account] = self.uploads_done.get(result.account, 0) + result.upload_count
+            self.monetized_done[result.account] = self.monetized_done.get(result.account, 0) + result.monetization_count
+        while self._track_times and now - self._track_times[0][0] > self.window_secs:
+            self._track_times.popleft()
+
+    def get_tracks_per_hour(self, account=None) -> float:
+        """
+        :param account: Only count the tracks of this account. All if None
+        :return: Tracks per hour over the rolling window, or since the start if the run is shorter
+        """
+        window = max(min(self.window_secs, time.time() - self.started_at), MIN_RATE_WINDOW_SECS)
+        no_of_tracks = sum(1 for _, each in self._track_times if account is None or each == account)
+        return no_of_tracks * 3600 / window
+
+    def get_browsers(self) -> list:
+        """
+        :return: CPU % since the previous measure and memory of every browser registered with the memory watchdog
+        """
+        all_browsers = []
+        now = time.time()
+        for name, driver, accounts in memory_watchdog.get_browsers():
+            all_pids = get_driver_pids(driver)
+            if not all_pids:
+                continue
+            cpu_secs = get_process_tree_cpu_secs(all_pids)
+            last_time, last_cpu_secs = self._last_cpu.get(name, (None, None))
+            self._last_cpu[name] = (now, cpu_secs)
+            all_browsers.append({
+                "name": name,
+                "pid": all_pids[-1],
+                "cpu_percent": round((cpu_secs - last_cpu_secs) * 100 / (now - last_time), 1)
+                if last_time and now > last_time else None,
+                "memory_mb": round(get_process_tree_rss(all_pids) / 1024 ** 2, 1),
+                "accounts": accounts,
+                "flagged_for_restart": [account for account in accounts if memory_watchdog.needs_recycle(account)],
+            })
+        return all_browsers
+
+    def snapshot(self) -> dict:
+        """
+        :return: JSON serializable status of the run
+        """
+        with self._lock:
+            self._collect()
+            now = time.time()
+            thread_names = {thread.ident: thread.name.strip() for thread in threading.enumerate()}
+            all_workers = []
+            for thread_id, state in get_all_states().items():
+                account = state.get("account")
+                in_stage_secs = now - state["since"]
+                all_workers.append({
+                    "thread": thread_names.get(thread_id, str(thread_id)),
+                    "account": account,
+                    "stage": state["stage"],
+                    "in_stage_secs": round(in_stage_secs),
+                    "stalled": in_stage_secs > Settings.STATUS_STALL_SECS,
+                    "tracks_done": self.tracks_done.get(account, 0),
+                    "uploads_done": self.uploads_done.get(account, 0),
+                    "tracks_per_hour": round(self.get_tracks_per_hour(account), 1),
+                })
+            return {
+                "time": now,
+                "uptime_secs": round(now - self.started_at),
+                "workers": sorted(all_workers, key=lambda worker: worker["thread"]),
+                "queues": [{"kind": kind, "depth": depth, "maxsize": maxsize}
+                           for kind, depth, maxsize in self.result_bus.queue_depths()],
+                "browsers": self.get_browsers(),
+                "pacing": [{**stats, "wait_secs": round(stats["wait_secs"], 1),
+                            "max_wait_secs": round(stats["max_wait_secs"], 1)} for stats in pacer.get_stats()],
+                "totals": {
+                    "tracks_done": sum(self.tracks_done.values()),
+                    "uploads_done": sum(self.uploads_done.values()),
+                    "monetized": sum(self.monetized_done.values()),
+                    "tracks_per_hour": round(self.get_tracks_per_hour(), 1),
+                    "window_secs": self.window_secs,
+                },
+            }
+
+
+def render_html(status) -> str:
+    """
+    :param status: RunStatus.snapshot()
+    :return: HTML page of the status
+    """
+    def table(all_rows, all_columns):
+        head = "".join(f"<th>{html.escape(column)}</th>" for column in all_columns)
+        body = "".join(
+            f"<tr{' class=stalled' if row.get('stalled') else ''}>"
+            + "".join(f"<td>{html.escape(str(row.get(column, '')))}</td>" for column in all_columns) + "</tr>"
+            for row in all_rows)
+        return f"<table><tr>{head}</tr>{body}</table>"
+
+    totals = status["totals"]
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="{PAGE_REFRESH_SECS}"><title>AutoTrack run</title>
+<style>body{{font-family:sans-serif}} td,th{{padding:2px 10px;text-align:left}} .stalled{{background:#fcc}}</style>
+</head><body>
+<h3>Up {status["uptime_secs"] // 60} min. {totals["tracks_done"]} tracks, {totals["uploads_done"]} uploads,
+{totals["monetized"]} monetized. {totals["tracks_per_hour"]} tracks/h over the last {totals["window_secs"] // 60} min</h3>
+<h4>Workers</h4>
+{table(status["workers"], ["thread", "account", "stage", "in_stage_secs", "tracks_done", "uploads_done",
+                           "tracks_per_hour"])}
+<h4>Queues</h4>
+{table(status["queues"], ["kind", "depth", "maxsize"])}
+<h4>Browsers</h4>
+{table(status["browsers"], ["name", "accounts", "pid", "cpu_percent", "memory_mb", "flagged_for_restart"])}
+<h4>Pacing</h4>
+{table(status["pacing"], ["platform", "operation", "calls", "waits", "wait_secs", "max_wait_secs"])}
+</body></html>"""
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        status = self.server.run_status.snapshot()
+        if self.path.split("?")[0] == "/status.json":
+            body, content_type = json.dumps(status, indent=2).encode(), "application/json"
+        elif self.path.split("?")[0] == "/":
+            body, content_type = render_html(status).encode(), "text/html; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_status_server(result_bus, host=Settings.STATUS_SERVER_HOST, port=Settings.STATUS_SERVER_PORT):
+    """
+    Serve the status of the run in a background thread
+    :param result_bus: ResultBus of the run
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :return: The server. server.shutdown() stops it
+    """
+    server = ThreadingHTTPServer((host, port), StatusRequestHandler)
+    server.daemon_threads = True
+    server.run_status = RunStatus(result_bus)
+    threading.Thread(target=server.serve_forever, name="status_server", daemon=True).start()
+    print(f"Run status on http://{host}:{server.server_address[1]}/\n")
+    logger.info(f"Status server listening on {host}:{server.server_address[1]}")
+    return server
@@ -0,0 +1,188 @@
+"""
+Index of the suno clips built from the feed and clip JSON responses the create page receives.
+
+The suno drivers are started with the chrome performance log enabled (Settings.CAPTURE_NETWORK_PLATFORMS).
+ClipIndex.update reads the Network.responseReceived events of the suno API, fetches their bodies with
+Network.getResponseBody and keeps the clips they contain, keyed by clip id. The page polls the feed while clips
+are generated, so the index follows their status without scrolling or reading the DOM.
+"""
+import fnmatch
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from helpers import logger
+from run_state import heartbeat
+from settings import Settings
+
+# Chrome fills one performance log per session. With browser contexts it holds the events of every tab,
+# the clip API responses are kept here per tab until the index of that tab reads them. The tab of a closed
+# context is never read again, so each tab keeps at most Settings.SUNO_PENDING_EVENTS_LIMIT responses
+_pending_events = {}
+_pending_events_lock = threading.Lock()
+
+
+@dataclass(slots=True)
+class ClipInfo:
+    """ A clip as returned by the suno API """
+    clip_id: str
+    title: str = ""
+    tags: str = ""
+    status: str = ""
+    audio_url: str = ""
+    image_url: str = ""
+    created_at: str = ""
+
+    @property
+    def is_complete(self) -> bool:
+        return self.status == "complete"
+
+    @property
+    def has_failed(self) -> bool:
+        return self.status == "error"
+
+    @classmethod
+    def from_api(cls, data):
+        """
+        :param data: Clip object of a feed / generate response
+        """
+        metadata = data.get("metadata") or {}
+        return cls(clip_id=data["id"], title=(data.get("title") or "").strip(), tags=metadata.get("tags") or "",
+                   status=data.get("status") or "", audio_url=data.get("audio_url") or "",
+                   image_url=data.get("image_url") or "", created_at=data.get("created_at") or "")
+
+
+def get_clips_from_body(body) -> list:
+    """
+    :param body: Decoded JSON body of a suno API response
+    :return: List of the clip objects it contains. Feed responses are lists, generate responses have a clips key
+    """
+    if isinstance(body, dict):
+        body = body.get("clips", [body] if "id" in body and "status" in body else [])
+    if not isinstance(body, list):
+        return []
+    return [each for each in body if isinstance(each, dict) and each.get("id")]
+
+
+class ClipIndex:
+
+    def __init__(self, url_patterns=None):
+        """
+        :param url_patterns: URL wildcard patterns of the responses to read. Defaults to Settings.SUNO_CLIP_API_PATTERNS
+        """
+        self.url_patterns = url_patterns or Settings.SUNO_CLIP_API_PATTERNS
+        # Clip id -> ClipInfo
+        self.clips = {}
+        # Ids of the clips created by the prompts submitted from this page, in order
+        self.generated_clip_ids = []
+        self.last_update = time.time()
+
+    def _read_events(self, driver) -> list:
+        """ Read the performance log and return the clip API responses received by the current tab """
+        try:
+            all_entries = driver.get_log("performance")
+        except Exception as e:
+            logger.info(f"Unable to read the performance log: {e}")
+            return []
+
+        try:
+            current_tab = driver.current_window_handle
+        except Exception:
+            current_tab = None
+
+        with _pending_events_lock:
+            for entry in all_entries:
+                message = json.loads(entry["message"])
+                event = message.get("message", {})
+                if event.get("method") != "Network.responseReceived":
+                    continue
+                # The images, scripts and other calls of the page are not kept
+                url = event["params"].get("response", {}).get("url", "")
+                if not any(fnmatch.fnmatch(url, pattern) for pattern in self.url_patterns):
+                    continue
+                _pending_events.setdefault(
+                    message.get("webview"), deque(maxlen=Settings.SUNO_PENDING_EVENTS_LIMIT)).append(event["params"])
+            # Events without a tab id belong to whoever reads them
+            return list(_pending_events.pop(current_tab, [])) + list(_pending_events.pop(None, []))
+
+    def update(self, driver) -> list:
+        """
+        Add the clips of the suno API responses received since the last call
+        :param driver: Driver of the suno create page
+        :return: List of the ids of the clips added or updated
+        """
+        all_updated_clip_ids = []
+        for params in self._read_events(driver):
+            url = params.get("response", {}).get("url", "")
+            try:
+                response_body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": params["requestId"]})
+                body = json.loads(response_body["body"])
+            except Exception as e:
+                # The body is gone once the page navigated away
+                logger.info(f"Unable to read the body of {url}: {e}")
+                continue
+
+            is_generate_response = fnmatch.fnmatch(url, Settings.SUNO_GENERATE_API_PATTERN)
+            for data in get_clips_from_body(body):
+                clip = ClipInfo.from_api(data)
+                if is_generate_response and clip.clip_id not in self.generated_clip_ids:
+                    self.generated_clip_ids.append(clip.clip_id)
+                known_clip = self.clips.get(clip.clip_id)
+                # Keep the title / urls of a previous response if this one does not have them yet
+                if known_clip:
+                    for name in ("title", "tags", "audio_url", "image_url", "created_at"):
+                        setattr(clip, name, getattr(clip, name) or getattr(known_clip, name))
+                self.clips[clip.clip_id] = clip
+                all_updated_clip_ids.append(clip.clip_id)
+
+        if all_updated_clip_ids:
+            self.last_update = time.time()
+        return all_updated_clip_ids
+
+    def wait_for_generated_clips(self, driver, no_of_generated_before, no_of_clips, timeout=Settings.TIMEOUT) -> list:
+        """
+        Wait for the generate response of a prompt just submitted
+        :param driver: Driver of the suno create page
+        :param no_of_generated_before: len(generated_clip_ids) before the prompt was submitted
+        :param no_of_clips: No of clips a prompt generates
+        :param timeout: Max no of secs to wait
+        :return: List of the new clip ids. Fewer than no_of_clips if the timeout was reached
+        """
+        deadline = time.time() + timeout
+        while True:
+            heartbeat()
+            self.update(driver)
+            new_clip_ids = self.generated_clip_ids[no_of_generated_before:]
+            if len(new_clip_ids) >= no_of_clips or time.time() >= deadline:
+                return new_clip_ids
+            time.sleep(0.5)
+
+    def wait_until_done(self, driver, all_clip_ids, timeout=Settings.MAX_TIME_FOR_SUNO_GENERATION) -> list:
+        """
+        Wait for clips to be complete or failed. The page polls the feed on its own while clips are generated,
+        it is refreshed if no response came for a while
+        :param driver: Driver of the suno create page
+        :param all_clip_ids: Ids of the clips to wait for
+        :param timeout: Max no of secs to wait
+        :return: List of the ids of the complete clips
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            heartbeat()
+            self.update(driver)
+            if all(self.clips[clip_id].is_complete or self.clips[clip_id].has_failed for clip_id in all_clip_ids):
+                break
+            if time.time() - self.last_update > Settings.SUNO_FEED_STALE_SECS:
+                driver.refresh()
+                self.last_update = time.time()
+            time.sleep(1)
+        return [clip_id for clip_id in all_clip_ids if self.clips[clip_id].is_complete]
+
+    def get_complete_clips(self, all_clip_ids) -> list:
+        """
+        :param all_clip_ids: Ids of the clips to check
+        :return: List of the ids of the clips ready for download
+        """
+        return [clip_id for clip_id in all_clip_ids if clip_id in self.clips and self.clips[clip_id].is_complete]
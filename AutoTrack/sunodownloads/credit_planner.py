@@ -0,0 +1,99 @@
+"""
+Spreads the daily prompts over the suno accounts according to the credits each account has left.
+
+The balance of an account is read once per run by the bot and saved to Settings.SUNO_CREDITS_FILE.
+Balances not read today are assumed to be refilled to Settings.SUNO_DAILY_CREDITS.
+In coordinator mode the bots run on the workers: the suno jobs return the balances they read and the coordinator
+saves them to its own file, the one it plans from.
+"""
+import json
+import random
+import threading
+from datetime import date
+
+from settings import Settings
+
+ledger_lock = threading.Lock()
+
+
+def _load_ledger() -> dict:
+    try:
+        with open(Settings.SUNO_CREDITS_FILE, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def record_credits(username, credits):
+    """
+    Save the credits balance read on a suno account
+    :param username: Suno account username
+    :param credits: Number of credits left on the account
+    """
+    with ledger_lock:
+        ledger = _load_ledger()
+        ledger[username] = {"credits": credits, "date": date.today().isoformat()}
+        with open(Settings.SUNO_CREDITS_FILE, "w") as file:
+            json.dump(ledger, file, indent=2)
+
+
+def get_recorded_credits(username):
+    """
+    :param username: Suno account username
+    :return: Credits saved today for the account, None if its balance was not read today
+    """
+    entry = _load_ledger().get(username)
+    return entry["credits"] if entry and entry["date"] == date.today().isoformat() else None
+
+
+def get_credit_balances(usernames) -> dict:
+    """
+    Get the expected credits balance of each account without opening a browser
+    :param usernames: List of suno accounts username
+    :return: Dictionary of username to credits
+    """
+    ledger = _load_ledger()
+    today = date.today().isoformat()
+    balances = {}
+    for username in usernames:
+        entry = ledger.get(username)
+        balances[username] = entry["credits"] if entry and entry["date"] == today else Settings.SUNO_DAILY_CREDITS
+    return balances
+
+
+def plan_prompts(balances, all_prompts) -> dict:
+    """
+    Share the prompts between the accounts in proportion to the number of prompts each one can generate.
+    Every account gets distinct prompts first. Accounts with spare credits left once all the prompts are
+    given out get random prompts they do not have yet. Accounts without enough credits are left out.
+    :param balances: Dictionary of username to credits
+    :param all_prompts: List of prompts of the day
+    :return: Dictionary of username to its list of prompts
+    """
+    capacities = {username: min(credits // Settings.SUNO_CREDITS_PER_PROMPT, Settings.SUNO_MAX_PROMPTS_PER_ACCOUNT)
+                  for username, credits in balances.items()}
+    capacities = {username: capacity for username, capacity in capacities.items() if capacity > 0}
+    total_capacity = sum(capacities.values())
+    if not total_capacity or not all_prompts:
+        return {}
+
+    shuffled_prompts = random.sample(all_prompts, len(all_prompts))
+    no_of_prompts = min(len(shuffled_prompts), total_capacity)
+
+    # Proportional share with the largest remainders rounded up
+    shares = {username: no_of_prompts * capacity / total_capacity for username, capacity in capacities.items()}
+    plan_sizes = {username: int(share) for username, share in shares.items()}
+    by_remainder = sorted(shares, key=lambda username: shares[username] - plan_sizes[username], reverse=True)
+    for username in by_remainder[:no_of_prompts - sum(plan_sizes.values())]:
+        plan_sizes[username] += 1
+
+    plan = {}
+    for username, size in plan_sizes.items():
+        plan[username], shuffled_prompts = shuffled_prompts[:size], shuffled_prompts[size:]
+
+    # Give the leftover credits some more prompts
+    for username, capacity in capacities.items():
+        other_prompts = [prompt for prompt in all_prompts if prompt not in plan[username]]
+        plan[username] += random.sample(other_prompts, min(capacity - len(plan[username]), len(other_prompts)))
+
+    return plan
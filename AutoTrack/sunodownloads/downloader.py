@@ -0,0 +1,172 @@
+"""
+Resumable downloads of the suno audio and image files.
+
+Files are written to <path>.part and only renamed once their size matches the Content-Length (and the checksum
+when one is given), so a dropped connection never leaves a truncated track behind. An interrupted download resumes
+from the end of the .part file with a Range request. Large files are fetched as parallel range chunks when the
+server accepts ranges.
+
+    python sunodownloads/flaky_server.py --directory test_files --drop-after 65536
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+import requests
+
+from helpers import logger
+from pacing import pace
+from settings import Settings
+
+# Size of the blocks written to disk. A dropped connection loses at most one block
+CHUNK_SIZE = 16 * 1024
+
+
+class DownloadError(Exception):
+    """ The downloaded file is incomplete or does not match its checksum """
+
+
+def get_total_size(response, offset=0):
+    """
+    :param response: Response of a GET, with or without a Range header
+    :param offset: Start byte of the request
+    :return: Size of the whole file, or None if the server did not send it
+    """
+    content_range = response.headers.get("Content-Range", "")
+    match = re.match(r"bytes (?:\d+-\d+|\*)/(\d+)", content_range)
+    if match:
+        return int(match.group(1))
+    if "Content-Length" in response.headers:
+        return offset + int(response.headers["Content-Length"])
+    return None
+
+
+def file_sha256(path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _download_range(session, url, part_path, start, end):
+    """
+    Write the bytes start-end of a file at the same position in the .part file.
+    Resumes from the last written byte after a dropped connection
+    """
+    position = start
+    for attempt in range(Settings.DOWNLOAD_MAX_RETRY):
+        try:
+            with session.get(url, headers={"Range": f"bytes={position}-{end}"}, stream=True,
+                             timeout=Settings.TIMEOUT) as response:
+                if response.status_code != 206:
+                    raise DownloadError(f"Range request answered with status {response.status_code}")
+                with open(part_path, "r+b") as file:
+                    file.seek(position)
+                    for block in response.iter_content(CHUNK_SIZE):
+                        file.write(block)
+                        position += len(block)
+            if position > end:
+                return
+        except (requests.RequestException, DownloadError) as e:
+            logger.info(f"Range {position}-{end} of {url} interrupted: {e}")
+        time.sleep(min(2 ** attempt, 10))
+    raise DownloadError(f"Unable to download bytes {position}-{end} of {url}")
+
+
+def _download_in_ranges(session, url, part_path, total_size, no_of_chunks):
+    """ Fetch a file as parallel range chunks into a pre-allocated .part file """
+    with open(part_path, "wb") as file:
+        file.truncate(total_size)
+
+    chunk_size = -(-total_size // no_of_chunks)
+    all_errors = []
+
+    def download(start):
+        try:
+            _download_range(session, url, part_path, start, min(start + chunk_size, total_size) - 1)
+        except DownloadError as e:
+            all_errors.append(e)
+
+    all_threads = [threading.Thread(target=download, args=(start,)) for start in range(0, total_size, chunk_size)]
+    for thread in all_threads:
+        thread.start()
+    for thread in all_threads:
+        thread.join()
+    if all_errors:
+        # The chunks do not say which bytes are missing, start over on the next attempt
+        os.remove(part_path)
+        raise all_errors[0]
+
+
+def _download_once(session, url, part_path, parallel_chunks):
+    """
+    Download a file into its .part file, resuming a previous attempt when the file exists
+    :return: Size of the whole file, or None if the server did not send it
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    if offset == 0 and parallel_chunks > 1:
+        head = session.head(url, timeout=Settings.TIMEOUT, allow_redirects=True)
+        total_size = int(head.headers.get("Content-Length", 0))
+        if head.ok and head.headers.get("Accept-Ranges") == "bytes" and total_size >= Settings.DOWNLOAD_PARALLEL_MIN_BYTES:
+            _download_in_ranges(session, url, part_path, total_size, parallel_chunks)
+            return total_size
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=Settings.TIMEOUT) as response:
+        if response.status_code == 416:
+            # The .part file already holds the whole file
+            return offset if "Content-Range" not in response.headers else get_total_size(response)
+        response.raise_for_status()
+        if response.status_code != 206:
+            # The server ignored the Range header and sends the whole file again
+            offset = 0
+        total_size = get_total_size(response, offset)
+        with open(part_path, "ab" if offset else "wb") as file:
+            for block in response.iter_content(CHUNK_SIZE):
+                file.write(block)
+    return total_size
+
+
+def download_file(url, path, sha256=None, session=None, parallel_chunks=Settings.DOWNLOAD_PARALLEL_CHUNKS,
+                  max_retry=Settings.DOWNLOAD_MAX_RETRY) -> str:
+    """
+    Download a file, resuming it after dropped connections, and check it is complete
+    :param url: File url
+    :param path: Where to save the file
+    :param sha256: Expected sha256 hex digest of the file. Not checked if None
+    :param session: requests session to use
+    :param parallel_chunks: Max no of range chunks fetched at the same time for large files
+    :param max_retry: No of attempts before giving up. The .part file is kept to resume from later
+    :return: path
+    """
+    session = session or requests.Session()
+    part_path = path + ".part"
+    for attempt in range(max_retry):
+        pace("suno", "download")
+        try:
+            total_size = _download_once(session, url, part_path, parallel_chunks)
+            size = os.path.getsize(part_path)
+            if total_size is not None and size != total_size:
+                if size > total_size:
+                    # The file changed on the server since the .part file was started
+                    os.remove(part_path)
+                raise DownloadError(f"Got {size} of {total_size} bytes")
+            if sha256 and file_sha256(part_path) != sha256:
+                os.remove(part_path)
+                raise DownloadError("Checksum mismatch")
+            os.replace(part_path, path)
+            return path
+        except requests.HTTPError as e:
+            # The file is not there. Retrying will not help
+            if e.response is not None and e.response.status_code < 500:
+                raise
+            logger.info(f"Download of {url} failed: {e}")
+        except (requests.RequestException, DownloadError) as e:
+            logger.info(f"Download of {url} interrupted (attempt {attempt + 1}/{max_retry}): {e}")
+        if attempt + 1 < max_retry:
+            time.sleep(min(2 ** attempt, 10))
+    raise DownloadError(f"Unable to download {url} after {max_retry} attempts")
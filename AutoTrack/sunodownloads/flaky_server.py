@@ -0,0 +1,106 @@
+"""
+Local file server that drops connections, to exercise the resumable downloader without the suno cdn.
+
+    python sunodownloads/flaky_server.py --directory test_files --drop-after 65536
+
+Every response is cut after --drop-after bytes, so a file larger than that needs several resumed requests.
+Range requests are supported the same way the cdn supports them.
+"""
+import argparse
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FlakyFileHandler(BaseHTTPRequestHandler):
+
+    def _get_file(self):
+        path = os.path.join(self.server.directory, os.path.basename(self.path.split("?")[0]))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        return path
+
+    def do_HEAD(self):
+        path = self._get_file()
+        if path:
+            self.send_response(200)
+            self.send_header("Content-Length", str(os.path.getsize(path)))
+            self.send_header("Accept-Ranges", "bytes" if self.server.accept_ranges else "none")
+            self.end_headers()
+
+    def do_GET(self):
+        path = self._get_file()
+        if not path:
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and self.server.accept_ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes" if self.server.accept_ranges else "none")
+        self.end_headers()
+
+        with self.server.lock:
+            self.server.no_of_requests += 1
+        with open(path, "rb") as file:
+            file.seek(start)
+            data = file.read(end - start + 1)
+        if self.server.drop_after and len(data) > self.server.drop_after:
+            # Send part of the body then close the connection
+            self.wfile.write(data[:self.server.drop_after])
+            self.close_connection = True
+            with self.server.lock:
+                self.server.no_of_drops += 1
+            return
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_flaky_server(directory, drop_after=0, accept_ranges=True, port=0) -> ThreadingHTTPServer:
+    """
+    Start the file server in a background thread
+    :param directory: Folder of the files to serve
+    :param drop_after: No of body bytes sent before the connection is dropped. 0 never drops
+    :param accept_ranges: flag, honour Range requests
+    :param port: Port to listen on. 0 picks a free port
+    :return: The server. no_of_requests and no_of_drops count the GET requests and the dropped ones
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FlakyFileHandler)
+    server.directory = directory
+    server.drop_after = drop_after
+    server.accept_ranges = accept_ranges
+    server.no_of_requests = 0
+    server.no_of_drops = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File server that drops connections")
+    parser.add_argument("--directory", required=True)
+    parser.add_argument("--drop-after", type=int, default=64 * 1024)
+    parser.add_argument("--no-ranges", action="store_true")
+    parser.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+    server = start_flaky_server(args.directory, args.drop_after, not args.no_ranges, args.port)
+    print(f"Flaky file server listening on http://127.0.0.1:{server.server_address[1]}/")
+    threading.Event().wait()
@@ -1,20 +1,27 @@
 import re
 import os
-from selenium.common import JavascriptException
+import time
 from seleniumbase.common.exceptions import TimeoutException
 import traceback 
-from WebAutomations.AutoTrack.utils import sign_in_with_microsoft, scroll_down, save_cookies, load_cookies
-from WebAutomations.AutoTrack.settings import Settings
-from WebAutomations.AutoTrack.helpers import wait_for_elements_presence, handle_exception, wait_for_elements_to_be_clickable
-import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import sign_in_with_microsoft, save_cookies, load_cookies
+from settings import Settings
+from helpers import wait_for_elements_to_be_clickable
+from sunodownloads.credit_planner import record_credits
+from memory_watchdog import memory_watchdog, recycle_if_needed
+from session_recorder import annotate_session
+from records import TrackRecord
+from run_state import RunCancelled, clear_stage, heartbeat, set_stage, stage
+from profiles import record_first_load
+from pacing import pace
+from sunodownloads.clip_index import ClipIndex
+from sunodownloads.downloader import DownloadError, download_file
 
 import requests
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-lock = threading.Lock()
-
 class SunoAI:
     def __init__(self, driver):
         """
@@ -22,23 +29,39 @@ class SunoAI:
         """
         self.driver = driver
         self.driver.set_window_size(1920, 1080)
-
-    def sign_in(self, username, password, max_retry=Settings.MAX_RETRY):
+        # Clips read from the suno API responses of the create page
+        self.clip_index = ClipIndex()
+        # Tracks are downloaded in the background while the browser goes on
+        self.download_session = requests.Session()
+        self.download_executor = ThreadPoolExecutor(max_workers=Settings.DOWNLOAD_WORKERS)
+        self.pending_downloads = []
+        self.reserved_song_files = set()
+        # (username, password) of the last sign in
+        self.login_args = None
+
+    def sign_in(self, username, password, max_retry=Settings.MAX_RETRY, use_cookies=True):
         """
             Opens the sign-in page on suno and signs in to an account using a Microsoft account credential.
                 :param username: Account username
                 :param password: Account password
                 :param max_retry: Number of attempts to retry login in case of failure
+                :param use_cookies: Try the saved cookies before the Microsoft login
+                :return: "cookies" if the saved session was still valid, "credentials" after a Microsoft login,
+                    None if the login failed
         """
         if max_retry > 0:
+            # Pour se reconnecter après un redémarrage du navigateur
+            self.login_args = (username, password)
             try:
                 print(f"Starting Suno process for {username}\n")
+                pace("suno", "login")
 
                 # Check if a cookie file exists for the account username
                 account_cookie_file_path = f"cookies/suno/{username}.pkl"
-                if os.path.exists(account_cookie_file_path):
+                if use_cookies and os.path.exists(account_cookie_file_path):
                     # Open the create page
                     self.driver.get("https://app.suno.ai")
+                    record_first_load(self.driver, "suno", username)
                     # Load the cookies
                     load_cookies(self.driver, "suno", username)
                     # Wait a bit for the cookies to become active
@@ -46,13 +69,15 @@ class SunoAI:
                     # Check login with cookies is successful by checking the page is not redirected to log in
                     if self.driver.current_url == Settings.SUNO_BASE_URL + "create":
                         print("Login Success with cookies")
-                        return
+                        return "cookies"
                     else:
+                        # Les cookies expirés sont supprimés et la connexion se fait avec les identifiants
                         print("Expired cookies on suno login")
-                        input()
+                        os.remove(account_cookie_file_path)
 
                 # Ouvrir la page de connexion de Suno
                 self.driver.get(Settings.SUNO_BASE_URL)
+                record_first_load(self.driver, "suno", username)
 
                 sign_up_btn = wait_for_elements_to_be_clickable(self.driver, "nav > div.css-7a2ne0 > div:nth-child(3) > button")[0]
                 sign_up_btn.click()
@@ -67,15 +92,29 @@ class SunoAI:
                 print("Login Success !\n")
 
                 save_cookies(self.driver, "suno", username)
+                return "credentials"
 
             except Exception as e:
                 print(f"Unable to login {username}. Error: {e}. Retrying...\n")
-                return self.sign_in(username, password, max_retry - 1)
+                return self.sign_in(username, password, max_retry - 1, use_cookies)
         else:
             print(f"Failed to login {username} after {Settings.MAX_RETRY} attempts.\n")
             self.driver.quit()
 
 
+    def get_credits(self) -> int:
+        """
+        Read the number of credits left on the logged in account. Refresh the page once if it cannot be found
+        """
+        try:
+            no_of_credit = self.driver.get_text(
+                ".chakra-text.css-itvw0n", timeout=Settings.TIMEOUT).split(" ")[0]
+        except Exception:
+            self.driver.refresh()
+            no_of_credit = self.driver.get_text(
+                ".chakra-text.css-itvw0n", timeout=Settings.TIMEOUT).split(" ")[0]
+        return int(no_of_credit)
+
     def sign_out(self):
         """
         Sign out from a logged in suno account
@@ -94,6 +133,7 @@ class SunoAI:
         :param prompt: Prompt to use to generate track lyrics
         """
         print("Creating tracks...\n")
+        pace("suno", "create")
 
         prompt_input_ele = "div.chakra-stack.css-131jemj > div.chakra-stack.css-10k728o > textarea"
         wait_for_elements_to_be_clickable(
@@ -102,67 +142,32 @@ class SunoAI:
         self.driver.click(
             "div.chakra-stack.css-10k728o > div > button.chakra-button")
 
-    @handle_exception(retry=True)
-    def get_generated_tracks_selection(self) -> list:
-        """
-        Get the option btns of the newly created tracks.
-       """
-        select_btns = wait_for_elements_presence(
-            self.driver,
-            "button.chakra-button.chakra-menu__menu-button.css-o244em")[-Settings.NO_OF_TRACKS_SUNO_ACCOUNT_GENERATES::]
-        return select_btns
-
-    def wait_for_new_track(self):
+    def open_create_page(self, account_username):
         """
-        Wait for new generated tracks to be ready.
-        When the tracks are ready, the images and the tags string will be ready
-        """
-        self.driver.sleep(2)
-        secs_waited_for = 0
-        while self.driver.execute_script(
-                "return (document.querySelector('.chakra-spinner.css-12wh8ho'))") and secs_waited_for <= Settings.TIMEOUT:
-            self.driver.sleep(1)
-            secs_waited_for += 1
-        self.driver.sleep(2)
-
-    def wait_for_new_track_to_be_ready(self):
-        """
-        Wait for a set number of minutes until the track is ready for download
+        Open the create track page and save the account cookies
+        :param account_username: Logged in suno account username
         """
-        print(
-            f"\nWaiting for track to be ready for download within {Settings.MAX_TIME_FOR_SUNO_GENERATION / 60} minutes ....\n")
-        scroll_down(self.driver)
-        max_wait_limit_in_secs = 0
-        while max_wait_limit_in_secs < Settings.MAX_TIME_FOR_SUNO_GENERATION:
-            if self.driver.execute_script(
-                    "return (document.querySelector('div.css-yle5y0 > div > div > div > div > div > div > div > button.chakra-menu__menuitem > div.chakra-spinner'))"):
-                self.driver.sleep(1)
-                max_wait_limit_in_secs += 1
-            else:
-                break
-        else:
-            return False
+        print("Opening the create track page...\n")
 
+        # Tentative de chargement de la page avec gestion du délai d'expiration
         try:
-            download_btns = wait_for_elements_to_be_clickable(self.driver,
-                                                              "div.css-yle5y0 > div > div > div > div > div > div > div > button.chakra-menu__menuitem")
-            # Check if the list is not empty
-            if download_btns and download_btns[3].is_enabled():
-                self.driver.execute_script(
-                    "arguments[0].scrollIntoView();", download_btns[3])
-            return True
+            self.driver.set_page_load_timeout(Settings.TIMEOUT/2)
+            self.driver.get(Settings.SUNO_BASE_URL + "create")
         except TimeoutException:
             print(
-                f"Track was not ready for download after {Settings.MAX_TIME_FOR_SUNO_GENERATION / 60} minutes")
-            return False
-        
-    def run(self, account_username, all_prompt_info, store_into):
+                "Le chargement de la page a pris trop de temps. Rafraîchissement de la page...")
+            self.driver.refresh()
+
+        # Extract and save the cookies
+        save_cookies(self.driver, "suno", account_username)
+
+    def run(self, account_username, all_prompt_info, result_bus):
         """
-        Use a list of prompts to generate track and suno and store the details (title, genre, tag_list) of the downloaded track
-        to the store_into list variable.
+        Use a list of prompts to generate track and suno and publish the details (title, genre, tag_list) of the downloaded track
+        to the result bus.
         :param account_username: Logged in suno account username
         :param all_prompt_info: list of prompts to use to generate track on suno
-        :param store_into: List to store the details of the downloaded track
+        :param result_bus: ResultBus to publish the downloaded tracks TrackRecord to
         """
         # Définit le chemin vers le dossier des fichiers téléchargés
         # Utilise le chemin du script comme racine
@@ -174,192 +179,250 @@ class SunoAI:
         # # Vérifie si le sous-dossier existe, sinon le crée
         # os.makedirs(images_path, exist_ok=True)
 
-        print("Opening the create track page...\n")
-
-        # Tentative de chargement de la page avec gestion du délai d'expiration
-        try:
-            self.driver.set_page_load_timeout(Settings.TIMEOUT/2)
-            self.driver.get(Settings.SUNO_BASE_URL + "create")
-        except TimeoutException:
-            print(
-                "Le chargement de la page a pris trop de temps. Rafraîchissement de la page...")
-            self.driver.refresh()
+        self.open_create_page(account_username)
 
-        # Extract and save the cookies
-        save_cookies(self.driver, "suno", account_username)
-        return
+        # Read the credits once. Each prompt then spends a known amount of credits
+        no_of_credit = self.get_credits()
+        record_credits(account_username, no_of_credit)
 
         for prompt in all_prompt_info:
-            try:
-                no_of_credit = self.driver.get_text(
-                    ".chakra-text.css-itvw0n", timeout=Settings.TIMEOUT).split(" ")[0]
-            except:
-                self.driver.refresh()
-                no_of_credit = self.driver.get_text(
-                    ".chakra-text.css-itvw0n", timeout=Settings.TIMEOUT).split(" ")[0]
-
-            if int(no_of_credit) < 10:
+            heartbeat()
+            # Restart the browser between two prompts if it uses too much memory
+            recycle_if_needed(self, "suno", account_username)
+
+            if no_of_credit < Settings.SUNO_CREDITS_PER_PROMPT:
                 print("\nNot enough credits.\n")
                 self.driver.quit()
                 return
 
             # Create tracks with a given prompt
+            no_of_generated_before = len(self.clip_index.generated_clip_ids)
             self.create_song(prompt["prompt"])
-            self.wait_for_new_track()
-            generated_tracks_sel_btn = self.get_generated_tracks_selection()
-            # Check if the list is not empty
-            if generated_tracks_sel_btn:
-                index = 0
-                for btn_ele in generated_tracks_sel_btn:
-                    self.driver.execute_script(
-                        "arguments[0].click();", btn_ele)
-
-                    if not self.wait_for_new_track_to_be_ready():
-                        # If the track is not ready for download. skip to the next track if available
-                        try:
-                            self.driver.execute_script(
-                                "arguments[0].click()", btn_ele)
-                        except JavascriptException:
-                            pass
-                        continue
-                    scraped_details = self.scrap_details()
-
-                    track_title: str = scraped_details[0][index].text
-
-                    track_tags = scraped_details[1][index]
-                    genre = prompt["genre"]
-                    # Exécute le script JS pour obtenir l'attribut data-clip-id
-                    data_clip_id = self.driver.execute_script(
-                        """
-                        // On récupère l'élément cliqué
-                        let element = arguments[0];
-                        // On initialise une variable pour stocker l'attribut data-clip-id
-                        let dataClipId = null;
-                        // On parcourt la chaîne hiérarchique ascendante jusqu'à la racine du document
-                        while (element && element !== document) {
-                        // On vérifie si l'élément courant a un attribut data-clip-id
-                        if (element.hasAttribute("data-clip-id")) {
-                            // On récupère la valeur de l'attribut data-clip-id
-                            dataClipId = element.getAttribute("data-clip-id");
-                            // On arrête la boucle
-                            break;
-                        }
-                        // On passe à l'élément parent
-                        element = element.parentNode;
-                        }
-                        // On retourne l'attribut data-clip-id
-                        return dataClipId;
-                        """, self.driver.find_element(By.CSS_SELECTOR,
-                            "div.css-yle5y0 > div > div > div > div > div > div > div > button.chakra-menu__menuitem"))
-                    # Construit l'URL du morceau à partir de l'attribut data-clip-id
-                    song_url = f"https://cdn1.suno.ai/{data_clip_id}.mp3"
-                    # Envoie une requête GET à l'URL du morceau et récupère la réponse
-                    response = requests.get(song_url)
-                    # Vérifie si le code de statut de la réponse est 200, ce qui signifie que la requête a réussi
-                    if response.status_code == 200:
-                        # Définit le nom du fichier du morceau avec l'extension mp3
-                        song_file = f"{track_title}.mp3"
-                        # Vérifie si le nom du fichier existe déjà dans le dossier
-                        if os.path.exists(os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", song_file)):
-                            # Si oui, ajoute un suffixe ordinal au titre jusqu'à ce qu'il soit unique
-                            i = 2
-                            while os.path.exists(os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", song_file)):
-                                # Détermine le suffixe ordinal en fonction du nombre
-                                if i % 10 == 1 and i != 11:
-                                    ordinal = "st"
-                                elif i % 10 == 2 and i != 12:
-                                    ordinal = "nd"
-                                elif i % 10 == 3 and i != 13:
-                                    ordinal = "rd"
-                                else:
-                                    ordinal = "th"
-                                # Génère le nouveau titre avec le suffixe ordinal
-                                song_file = "{0} - {1}{2} version.mp3".format(
-                                    track_title, i, ordinal)
-                                i += 1
-                        # Écrit le contenu de la réponse dans le fichier
-                        with open(os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", song_file), "wb") as f:
-                            f.write(response.content)
-                    else:
-                        # Affiche un message d'erreur avec le code de statut de la réponse
-                        print(f"Unable to download song. Status code: {response.status_code}")
-                        return None
-                    # Construit l'URL de l'image à partir de l'attribut data-clip-id
-                    img_url = f"https://cdn1.suno.ai/image_{data_clip_id}.png"
-                    # Envoie une requête GET à l'URL de l'image et récupère la réponse
-                    res = requests.get(img_url)
-                    # Vérifie si le code de statut de la réponse est 200, ce qui signifie que la requête a réussi
-                    if res.status_code == 200:
-                        # Définit le nom du fichier de l'image avec le même titre que le fichier audio
-                        img_file = song_file.replace(".mp3", ".png")
-                        # Écrit le contenu de la réponse dans le fichier
-                        with open(os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", "images", img_file), "wb") as handle:
-                           
-                            for block in res.iter_content(1024):
-                                if not block:
-                                    break
-                                handle.write(block)
-                        # Récupère le chemin complet du fichier image
-                        img_path =os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", "images")
-                        
-                    else:
-                        # Affiche un message d'erreur avec le code de statut de la réponse
-                        print(f"Unable to download image. Status code: {res.status_code}")
-                        img_path = ""
-
-                    # Formate la liste des tags
-                    tag_list = track_tags.text.split(" ")
-                    # Stocke les informations du morceau dans un dictionnaire
-                    track_details = {
-                        "account": account_username,
-                        "title": song_file.split(".")[0],
-                        "genre": genre,
-                        "tag_list": tag_list,
-                        "img_path": img_path
-                    }
-                    print(track_details)
-                    # Stocke les détails du morceau téléchargé
-                    store_into.append(track_details)
-                    index += 1
-                    self.driver.sleep(5)
-                self.driver.refresh()
-                    
-            else:
+            no_of_credit -= Settings.SUNO_CREDITS_PER_PROMPT
+            record_credits(account_username, no_of_credit)
+
+            # Les identifiants des morceaux viennent de la réponse de l'API generate
+            new_clip_ids = self.clip_index.wait_for_generated_clips(
+                self.driver, no_of_generated_before, Settings.NO_OF_TRACKS_SUNO_ACCOUNT_GENERATES)
+            if not new_clip_ids:
                 print("No tracks generated")
                 self.driver.quit()
                 return
 
+            print(f"\nWaiting for track to be ready for download within {Settings.MAX_TIME_FOR_SUNO_GENERATION / 60} minutes ....\n")
+            with stage("wait_generation"):
+                all_ready_clip_ids = self.clip_index.wait_until_done(self.driver, new_clip_ids)
+            for clip_id in new_clip_ids:
+                if clip_id not in all_ready_clip_ids:
+                    # If the track is not ready for download. skip to the next track if available
+                    print(f"Track {clip_id} was not ready for download after {Settings.MAX_TIME_FOR_SUNO_GENERATION / 60} minutes")
+                    continue
+                # Le téléchargement se fait en arrière-plan pendant que le navigateur passe à l'invite suivante
+                self.queue_track_download(account_username, self.clip_index.clips[clip_id], prompt["genre"], result_bus)
+
+    def run_pipelined(self, account_username, all_prompt_info, result_bus):
+        """
+        Submit all the prompts first, within the account credits, then download every generated clip as soon
+        as it is ready, in any order. Suno generates the clips of all the prompts at the same time.
+        :param account_username: Logged in suno account username
+        :param all_prompt_info: list of prompts to use to generate track on suno
+        :param result_bus: ResultBus to publish the downloaded tracks TrackRecord to
+        """
+        self.open_create_page(account_username)
+
+        no_of_credit = self.get_credits()
+        record_credits(account_username, no_of_credit)
 
-    @handle_exception()
-    def scrap_details(self) -> tuple:
+        # Clip id -> prompt used to generate it
+        pending_clips = {}
+        for prompt in all_prompt_info:
+            if no_of_credit < Settings.SUNO_CREDITS_PER_PROMPT:
+                print("\nNot enough credits for the remaining prompts.\n")
+                break
+
+            no_of_generated_before = len(self.clip_index.generated_clip_ids)
+            self.create_song(prompt["prompt"])
+            no_of_credit -= Settings.SUNO_CREDITS_PER_PROMPT
+            record_credits(account_username, no_of_credit)
+
+            new_clip_ids = self.clip_index.wait_for_generated_clips(
+                self.driver, no_of_generated_before, Settings.NO_OF_TRACKS_SUNO_ACCOUNT_GENERATES)
+            pending_clips.update({clip_id: prompt for clip_id in new_clip_ids})
+
+        print(f"Submitted prompts. Waiting for {len(pending_clips)} clips ...\n")
+        set_stage("wait_generation")
+        # The clips of the last prompt get the usual generation time
+        deadline = time.time() + Settings.MAX_TIME_FOR_SUNO_GENERATION
+        while pending_clips and time.time() < deadline:
+            heartbeat()
+            recycle_if_needed(self, "suno", account_username)
+            self.clip_index.update(self.driver)
+            for clip_id in [clip_id for clip_id in pending_clips if self.clip_index.clips[clip_id].has_failed]:
+                print(f"Suno failed to generate clip {clip_id}")
+                pending_clips.pop(clip_id)
+            all_ready_clip_ids = self.clip_index.get_complete_clips(pending_clips)
+            if not all_ready_clip_ids:
+                if time.time() - self.clip_index.last_update > Settings.SUNO_FEED_STALE_SECS:
+                    # Reload the feed to get the clips status
+                    self.driver.refresh()
+                    self.clip_index.last_update = time.time()
+                self.driver.sleep(2)
+                continue
+
+            for clip_id in all_ready_clip_ids:
+                prompt = pending_clips.pop(clip_id)
+                self.queue_track_download(account_username, self.clip_index.clips[clip_id], prompt["genre"], result_bus)
+
+        if pending_clips:
+            print(f"{len(pending_clips)} clips were not ready for download after "
+                  f"{Settings.MAX_TIME_FOR_SUNO_GENERATION / 60} minutes")
+
+    def get_song_file_name(self, track_title) -> str:
         """
-        Scraps the webpage for track titles and genre names
+        :param track_title: Title of the track
+        :return: Audio file name for the track. A version suffix is added if a file already has this title
         """
-        all_titles = wait_for_elements_presence(self.driver, "p.chakra-text.css-1fq6tx5")[
-            -Settings.NO_OF_TRACKS_SUNO_ACCOUNT_GENERATES::]
-        all_genre_list = wait_for_elements_presence(self.driver, "p.chakra-text.css-1icp0bk")[
-            -Settings.NO_OF_TRACKS_SUNO_ACCOUNT_GENERATES::]
-        return all_titles, all_genre_list
+        def is_taken(song_file):
+            song_path = os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", song_file)
+            return song_file in self.reserved_song_files or os.path.exists(song_path) or os.path.exists(song_path + ".part")
+
+        # Définit le nom du fichier du morceau avec l'extension mp3
+        song_file = f"{track_title}.mp3"
+        # Si le nom existe déjà, ajoute un suffixe ordinal au titre jusqu'à ce qu'il soit unique
+        i = 2
+        while is_taken(song_file):
+            # Détermine le suffixe ordinal en fonction du nombre
+            if i % 10 == 1 and i != 11:
+                ordinal = "st"
+            elif i % 10 == 2 and i != 12:
+                ordinal = "nd"
+            elif i % 10 == 3 and i != 13:
+                ordinal = "rd"
+            else:
+                ordinal = "th"
+            # Génère le nouveau titre avec le suffixe ordinal
+            song_file = "{0} - {1}{2} version.mp3".format(
+                track_title, i, ordinal)
+            i += 1
+        # Les téléchargements en cours n'ont pas encore de fichier, le nom est réservé
+        self.reserved_song_files.add(song_file)
+        return song_file
+
+    def download_track(self, data_clip_id, song_file, song_url="", img_url=""):
+        """
+        Download the audio and the image of a generated clip into the downloaded_files folder.
+        Interrupted downloads are resumed and the files are checked against their Content-Length
+        :param data_clip_id: Suno clip id
+        :param song_file: Audio file name from get_song_file_name
+        :param song_url: Audio url from the suno API. Defaults to the cdn url of the clip
+        :param img_url: Image url from the suno API. Defaults to the cdn url of the clip
+        :return: (audio file name, images folder path) or None if the audio could not be downloaded
+        """
+        # Construit l'URL du morceau à partir de l'identifiant du clip si l'API ne l'a pas donnée
+        song_url = song_url or f"https://cdn1.suno.ai/{data_clip_id}.mp3"
+        try:
+            download_file(song_url, os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", song_file),
+                          session=self.download_session)
+        except (requests.RequestException, DownloadError) as e:
+            # Affiche un message d'erreur
+            print(f"Unable to download song {song_file}: {e}")
+            return None
+
+        # Construit l'URL de l'image à partir de l'identifiant du clip si l'API ne l'a pas donnée
+        img_url = img_url or f"https://cdn1.suno.ai/image_{data_clip_id}.png"
+        # Définit le nom du fichier de l'image avec le même titre que le fichier audio
+        img_file = song_file.replace(".mp3", ".png")
+        try:
+            download_file(img_url, os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", "images", img_file),
+                          session=self.download_session, parallel_chunks=1)
+            # Récupère le chemin complet du fichier image
+            img_path = os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", "images")
+        except (requests.RequestException, DownloadError) as e:
+            print(f"Unable to download image {img_file}: {e}")
+            img_path = ""
 
-    
+        return song_file, img_path
 
-def run_suno_bot(driver, username, password, prompt, store):
+    def queue_track_download(self, account_username, clip, genre, result_bus):
+        """
+        Download a complete clip in the background and publish its TrackRecord once the files are saved,
+        so the browser can go on with the next clips
+        :param account_username: Logged in suno account username
+        :param clip: ClipInfo of the clip
+        :param genre: Genre of the prompt used to generate the clip
+        :param result_bus: ResultBus to publish the TrackRecord to
+        """
+        song_file = self.get_song_file_name(clip.title or clip.clip_id)
+
+        def download_and_publish():
+            with stage("download", account_username):
+                downloaded_files = self.download_track(clip.clip_id, song_file, clip.audio_url, clip.image_url)
+            if downloaded_files is None:
+                return
+            song_file_name, img_path = downloaded_files
+
+            # Stocke les informations du morceau
+            track_details = TrackRecord(
+                account=account_username,
+                title=song_file_name.split(".")[0],
+                genre=genre,
+                tag_list=clip.tags.split(" "),
+                img_path=img_path,
+                audio_path=os.path.join(os.getenv('CURRENT_DIR'), "downloaded_files", song_file_name),
+                clip_id=clip.clip_id
+            )
+            print(track_details)
+            # Publie les détails du morceau téléchargé
+            result_bus.publish(track_details)
+
+        self.pending_downloads.append(self.download_executor.submit(download_and_publish))
+
+    def wait_for_downloads(self):
+        """ Wait for the background downloads of the account to be done """
+        if self.pending_downloads:
+            print(f"Waiting for {len(self.pending_downloads)} downloads ...\n")
+        self.download_executor.shutdown(wait=True)
+        for future in self.pending_downloads:
+            if future.exception():
+                print(f"Download failed: {future.exception()}")
+        self.pending_downloads = []
+
+def run_suno_bot(driver, username, password, prompt, result_bus):
     """
     Runs the Suno Ai bot
     :param driver: Seleniumbase webdriver
     :param username: Microsoft username
     :param password: Microsoft password
     :param prompt: List of prompts to use to create tracks on Suno AI
-    :param store: List to store all downloaded tracks info
+    :param result_bus: ResultBus to publish all downloaded tracks info to
     """
+    annotate_session(driver, bot="suno", username=username, prompts=prompt)
+    memory_watchdog.register(username, driver)
+    suno_bot = None
     try:
         suno_bot = SunoAI(driver)
 
+        set_stage("sign_in", username)
         suno_bot.sign_in(username, password)
-        suno_bot.run(username, prompt, store)
+        set_stage("generate")
+        if Settings.SUNO_PIPELINED_GENERATION:
+            suno_bot.run_pipelined(username, prompt, result_bus)
+        else:
+            suno_bot.run(username, prompt, result_bus)
         suno_bot.driver.quit()
 
+    except RunCancelled as e:
+        # Le superviseur a déjà tué le navigateur
+        print(f"Suno bot of {username} cancelled: {e}")
     except Exception as e:
         print("Error on suno_ai_spider.py : ", e)
         traceback.print_exc()  # print the full traceback
-        driver.close()
+        # The watchdog may have replaced the driver
+        memory_watchdog.drivers.get(username, driver).close()
+    finally:
+        # Les morceaux déjà générés finissent de se télécharger même si le navigateur a planté
+        if suno_bot:
+            set_stage("wait_downloads")
+            suno_bot.wait_for_downloads()
+        memory_watchdog.unregister(username)
+        clear_stage()
@@ -0,0 +1,128 @@
+"""
+Supervisor of the bot threads, so a run finishes in bounded time even when a site or a chrome hangs.
+
+Every Settings.SUPERVISOR_INTERVAL secs it checks each thread known to run_state against:
+  - the run deadline, Settings.RUN_DEADLINE_SECS after the start
+  - the time budget of its account (ACCOUNT_BUDGET_SECS) and of its current stage (STAGE_BUDGET_SECS)
+  - its last heartbeat, older than STALL_SECS means the thread is stuck, e.g. in a chrome call that never returns
+A thread over a limit is cancelled: its next heartbeat raises RunCancelled and the chrome of its account is killed,
+which makes a blocked selenium call fail right away. A chrome shared with other accounts is left running, only the
+thread is cancelled. What was cancelled is kept for the end of run report.
+"""
+import threading
+import time
+
+from browser_contexts import ContextDriver
+from helpers import logger
+from memory_watchdog import get_driver_pids, kill_process_tree, memory_watchdog
+from run_state import cancel, get_all_states
+from settings import Settings
+
+
+class Supervisor:
+
+    def __init__(self, deadline_secs=Settings.RUN_DEADLINE_SECS, interval=Settings.SUPERVISOR_INTERVAL):
+        """
+        :param deadline_secs: No of secs the run may last. No deadline if None
+        :param interval: No of secs between two checks
+        """
+        self.started_at = time.time()
+        self.deadline = self.started_at + deadline_secs if deadline_secs else None
+        self.interval = interval
+        # Cancelled threads: {"thread", "account", "stage", "reason", "time", "in_stage_secs"}
+        self.lost = []
+        # (thread id, account_since) of the cancelled bots. A pool thread is supervised again for its next account
+        self._cancelled_ids = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def get_violation(self, state, now):
+        """
+        :param state: run_state of a thread
+        :param now: Current time
+        :return: The limit the thread is over, or None
+        """
+        if self.deadline and now > self.deadline:
+            return "run deadline"
+        if Settings.ACCOUNT_BUDGET_SECS and now - state["account_since"] > Settings.ACCOUNT_BUDGET_SECS:
+            return "account budget"
+        stage_budget = Settings.STAGE_BUDGET_SECS.get(state["stage"])
+        if stage_budget and now - state["since"] > stage_budget:
+            return f"{state['stage']} budget"
+        if Settings.STALL_SECS and now - state["beat"] > Settings.STALL_SECS:
+            return "stalled"
+        return None
+
+    def check(self):
+        """ Cancel the threads over one of their limits """
+        now = time.time()
+        thread_names = {thread.ident: thread.name.strip() for thread in threading.enumerate()}
+        for thread_id, state in get_all_states().items():
+            if (thread_id, state["account_since"]) in self._cancelled_ids:
+                continue
+            reason = self.get_violation(state, now)
+            if reason:
+                self._cancelled_ids.add((thread_id, state["account_since"]))
+                self.cancel(thread_id, thread_names.get(thread_id, str(thread_id)), state, reason)
+
+    def cancel(self, thread_id, thread_name, state, reason):
+        account = state.get("account")
+        cancel(thread_id, reason)
+        # Une commande selenium bloquée ne rend la main qu'une fois le navigateur tué
+        driver = memory_watchdog.drivers.get(account)
+        # Le chrome partagé fait tourner les autres comptes, il n'est pas tué
+        is_shared = isinstance(driver, ContextDriver)
+        all_pids = get_driver_pids(driver) if driver and not is_shared else []
+        no_of_killed = kill_process_tree(all_pids) if all_pids else 0
+        self.lost.append({"thread": thread_name, "account": account, "stage": state["stage"], "reason": reason,
+                          "time": time.time(), "in_stage_secs": round(time.time() - state["since"])})
+        print(f"\nCancelled {thread_name} ({account}) in stage {state['stage']}: {reason}. "
+              f"{'Shared browser left running' if is_shared else f'Killed {no_of_killed} browser processes'}\n")
+        logger.warning(f"Supervisor cancelled {thread_name} ({account}) in stage {state['stage']}: {reason}")
+
+    def remaining_secs(self):
+        """
+        :return: No of secs left before the run deadline, None without a deadline
+        """
+        return max(self.deadline - time.time(), 0) if self.deadline else None
+
+    def join(self, thread):
+        """
+        Wait for a bot thread, at most until the run deadline and the grace period given to the cancelled threads
+        :return: False if the thread is still running
+        """
+        remaining_secs = self.remaining_secs()
+        thread.join(None if remaining_secs is None else remaining_secs + Settings.CANCEL_GRACE_SECS)
+        if thread.is_alive():
+            print(f"Giving up on {thread.name.strip()}, still running after the run deadline\n")
+            logger.warning(f"Supervisor gave up on {thread.name.strip()}")
+            self.lost.append({"thread": thread.name.strip(), "account": None, "stage": None,
+                              "reason": "not stopped after cancel", "time": time.time(), "in_stage_secs": None})
+            return False
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="supervisor", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.info(f"Supervisor check failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def report(self) -> str:
+        """
+        :return: The threads cancelled during the run and why
+        """
+        if not self.lost:
+            return f"Supervisor: no thread cancelled in {(time.time() - self.started_at) / 60:.0f} min"
+        lines = [f"Supervisor: {len(self.lost)} threads cancelled"]
+        for each in self.lost:
+            lines.append(f"  {each['thread']} ({each['account']}) in stage {each['stage']}: {each['reason']}")
+        return "\n".join(lines)
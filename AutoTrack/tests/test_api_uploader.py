@@ -0,0 +1,42 @@
+"""
+API uploads against the local stand-in of the SoundCloud API
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("requests")
+
+from records import TrackRecord  # noqa: E402
+from settings import Settings  # noqa: E402
+from soundcloud_uploads.api_stub_server import start_stub_server  # noqa: E402
+from soundcloud_uploads.api_uploader import SoundCloudAPIUploader  # noqa: E402
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    monkeypatch.setattr(Settings, "PACING", False)
+    server = start_stub_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("title", ['Rêve "live"', 'Çà et là, 夜の"歌"', "plain title"])
+def test_title_is_kept_in_the_file_name(stub_server, tmp_path, title):
+    audio_path = tmp_path / f"{title}.mp3"
+    audio_path.write_bytes(os.urandom(1000))
+    track = TrackRecord(account="user", title=title, genre="Pop", tag_list=["lo fi", "chill"],
+                        audio_path=str(audio_path), img_path=str(tmp_path / "missing.png"))
+    uploader = SoundCloudAPIUploader("token", base_url=f"http://127.0.0.1:{stub_server.server_address[1]}/")
+
+    created = uploader.upload_track(track)
+
+    assert created["title"] == title
+    assert created["original_filename"] == f"{title}.mp3"
+    assert created["original_content_size"] == 1000
+    assert created["tag_list"] == '"lo fi" chill'
+    assert uploader.get_track_titles() == [title]
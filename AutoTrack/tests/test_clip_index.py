@@ -0,0 +1,67 @@
+"""
+Clip index reading the chrome performance log shared by the tabs of a browser
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings import Settings  # noqa: E402
+from sunodownloads import clip_index  # noqa: E402
+from sunodownloads.clip_index import ClipIndex  # noqa: E402
+
+FEED_URL = "https://studio-api.suno.ai/api/feed/?page=0"
+
+
+def log_entry(webview, request_id, url):
+    return {"message": json.dumps({"webview": webview, "message": {
+        "method": "Network.responseReceived", "params": {"requestId": request_id, "response": {"url": url}}}})}
+
+
+class FakeDriver:
+
+    def __init__(self, current_window_handle, all_entries):
+        self.current_window_handle = current_window_handle
+        self.all_entries = all_entries
+        self.all_bodies = {}
+
+    def get_log(self, log_type):
+        all_entries, self.all_entries = self.all_entries, []
+        return all_entries
+
+    def execute_cdp_cmd(self, command, params):
+        return {"body": json.dumps(self.all_bodies[params["requestId"]])}
+
+
+@pytest.fixture(autouse=True)
+def pending_events(monkeypatch):
+    monkeypatch.setattr(clip_index, "_pending_events", {})
+    monkeypatch.setattr(Settings, "SUNO_PENDING_EVENTS_LIMIT", 5)
+    return clip_index._pending_events
+
+
+def test_only_the_clip_responses_of_the_other_tabs_are_buffered(pending_events):
+    all_entries = [log_entry("other tab", f"asset {i}", f"https://cdn1.suno.ai/image_{i}.png") for i in range(50)]
+    all_entries += [log_entry("closed tab", f"feed {i}", FEED_URL) for i in range(50)]
+    all_entries.append(log_entry("tab", "feed", FEED_URL))
+    driver = FakeDriver("tab", all_entries)
+    driver.all_bodies["feed"] = [{"id": "clip 1", "status": "complete", "title": "Song"}]
+
+    assert ClipIndex().update(driver) == ["clip 1"]
+    assert list(pending_events) == ["closed tab"]
+    # Only the latest responses of a tab that is never read again are kept
+    assert [params["requestId"] for params in pending_events["closed tab"]] == [f"feed {i}" for i in range(45, 50)]
+
+
+def test_buffered_responses_are_read_by_the_index_of_their_tab(pending_events):
+    ClipIndex().update(FakeDriver("other tab", [log_entry("tab", "feed", FEED_URL)]))
+    driver = FakeDriver("tab", [])
+    driver.all_bodies["feed"] = {"clips": [{"id": "clip 2", "status": "streaming"}]}
+
+    index = ClipIndex()
+    assert index.update(driver) == ["clip 2"]
+    assert index.clips["clip 2"].status == "streaming"
+    assert pending_events == {}
@@ -0,0 +1,75 @@
+"""
+Resumable suno downloads against the local flaky file server, which drops every connection after a few bytes
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("requests")
+
+from settings import Settings  # noqa: E402
+from sunodownloads import downloader  # noqa: E402
+from sunodownloads.downloader import download_file  # noqa: E402
+from sunodownloads.flaky_server import start_flaky_server  # noqa: E402
+
+DROP_AFTER = 64 * 1024
+
+
+@pytest.fixture
+def flaky_server(tmp_path, monkeypatch):
+    # Les reprises se font sans attendre ni être limitées
+    monkeypatch.setattr(downloader.time, "sleep", lambda secs: None)
+    monkeypatch.setattr(Settings, "PACING", False)
+    directory = tmp_path / "served"
+    directory.mkdir()
+    server = start_flaky_server(str(directory), drop_after=DROP_AFTER)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.served_dir = directory
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def serve_file(server, name, size) -> bytes:
+    content = os.urandom(size)
+    (server.served_dir / name).write_bytes(content)
+    return content
+
+
+def test_single_stream_resumes_after_dropped_connections(flaky_server, tmp_path):
+    content = serve_file(flaky_server, "song.mp3", 5 * DROP_AFTER + 123)
+    path = str(tmp_path / "song.mp3")
+
+    download_file(f"{flaky_server.url}/song.mp3", path, parallel_chunks=1, max_retry=10)
+
+    assert open(path, "rb").read() == content
+    assert not os.path.exists(path + ".part")
+    assert flaky_server.no_of_drops == 5
+
+
+def test_single_stream_resumes_a_previous_part_file(flaky_server, tmp_path):
+    content = serve_file(flaky_server, "song.mp3", 3 * DROP_AFTER)
+    path = str(tmp_path / "song.mp3")
+    with open(path + ".part", "wb") as file:
+        file.write(content[:DROP_AFTER + 7])
+
+    download_file(f"{flaky_server.url}/song.mp3", path, parallel_chunks=1, max_retry=10)
+
+    assert open(path, "rb").read() == content
+    assert flaky_server.no_of_requests == 2
+
+
+def test_parallel_ranges_resume_after_dropped_connections(flaky_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(Settings, "DOWNLOAD_PARALLEL_MIN_BYTES", 1)
+    content = serve_file(flaky_server, "song.mp3", 4 * 3 * DROP_AFTER + 5)
+    path = str(tmp_path / "song.mp3")
+
+    download_file(f"{flaky_server.url}/song.mp3", path, parallel_chunks=4, max_retry=2)
+
+    assert open(path, "rb").read() == content
+    assert not os.path.exists(path + ".part")
+    # Every chunk is larger than DROP_AFTER, so every chunk had to be resumed
+    assert flaky_server.no_of_drops >= 4
@@ -0,0 +1,125 @@
+"""
+Memory watchdog and supervisor with accounts sharing one chrome through browser contexts
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import memory_watchdog as watchdog_module  # noqa: E402
+import supervisor as supervisor_module  # noqa: E402
+from browser_contexts import ContextDriver, SharedBrowser  # noqa: E402
+from memory_watchdog import MemoryWatchdog  # noqa: E402
+from supervisor import Supervisor  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class FakeChrome:
+    """ Stands in for the webdriver of a SharedBrowser """
+
+    def __init__(self, pid):
+        self.service = SimpleNamespace(process=SimpleNamespace(pid=pid))
+        self.browser_pid = pid + 1
+        self.window_handles = ["blank"]
+        self.current_handle = "blank"
+        self.disposed = []
+        self.switch_to = SimpleNamespace(window=lambda handle: setattr(self, "current_handle", handle))
+        self._no_of_targets = 0
+
+    def execute_cdp_cmd(self, command, params):
+        if command == "Target.createBrowserContext":
+            return {"browserContextId": f"context {self._no_of_targets}"}
+        if command == "Target.createTarget":
+            self._no_of_targets += 1
+            self.window_handles.append(f"tab {self._no_of_targets}")
+        elif command == "Target.disposeBrowserContext":
+            self.disposed.append(params["browserContextId"])
+        return {}
+
+    def close(self):
+        self.window_handles.remove(self.current_handle)
+
+
+def new_shared_browser(monkeypatch, pid):
+    monkeypatch.setattr("browser_contexts.create_driver", lambda platform: FakeChrome(pid))
+    monkeypatch.setattr("browser_contexts.apply_resource_policy", lambda driver, platform: None)
+    return SharedBrowser("suno")
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """ RSS reported for each chrome, by the pid of its chromedriver """
+    all_rss = {}
+    monkeypatch.setattr(watchdog_module, "get_process_tree_rss", lambda all_pids: all_rss[all_pids[0]])
+    return all_rss
+
+
+def test_shared_browser_is_measured_once_against_the_limits_of_its_accounts(monkeypatch, rss):
+    browser = new_shared_browser(monkeypatch, 100)
+    watchdog = MemoryWatchdog(limit_mb=500)
+    monkeypatch.setattr(watchdog, "start", lambda: None)
+    for name in ("alice", "bob"):
+        watchdog.register(name, browser.new_context(name))
+
+    assert [(name, accounts) for name, _, accounts in watchdog.get_browsers()] == [(browser.name, ["alice", "bob"])]
+    rss[100] = 900 * MB
+    watchdog.check()
+    assert not watchdog.needs_recycle("alice") and not watchdog.needs_recycle("bob")
+
+    rss[100] = 1200 * MB
+    watchdog.check()
+    watchdog.check()
+    assert [watchdog.needs_recycle(name) for name in ("alice", "bob")].count(True) == 1
+    assert watchdog.peaks == {browser.name: 1200 * MB}
+
+
+def test_recycle_renews_only_the_context_of_the_flagged_account(monkeypatch, rss):
+    browser = new_shared_browser(monkeypatch, 100)
+    watchdog = MemoryWatchdog(limit_mb=500)
+    monkeypatch.setattr(watchdog, "start", lambda: None)
+    monkeypatch.setattr(watchdog_module, "memory_watchdog", watchdog)
+    monkeypatch.setattr("utils.save_cookies", lambda driver, platform, account: None)
+    monkeypatch.setattr("utils.load_cookies", lambda driver, platform, account: True)
+    monkeypatch.setattr(FakeChrome, "current_url", "https://suno.com/create", raising=False)
+    monkeypatch.setattr(FakeChrome, "get", lambda self, url: None, raising=False)
+    bots = {}
+    for name in ("alice", "bob"):
+        bots[name] = SimpleNamespace(driver=browser.new_context(name), login_args=("user", "password"))
+        watchdog.register(name, bots[name].driver)
+
+    rss[100] = 1200 * MB
+    watchdog.check()
+    name, other_name = ("alice", "bob") if watchdog.needs_recycle("alice") else ("bob", "alice")
+    old_tab, other_tab = browser.handles[name], browser.handles[other_name]
+
+    assert watchdog_module.recycle_if_needed(bots[name], "suno", name)
+    assert isinstance(bots[name].driver, ContextDriver)
+    assert browser.handles[name] != old_tab and old_tab not in browser.driver.window_handles
+    assert browser.driver.disposed == ["context 0" if name == "alice" else "context 1"]
+    assert browser.handles[other_name] == other_tab and other_tab in browser.driver.window_handles
+    assert not watchdog.needs_recycle(name)
+    assert watchdog.recycles == {name: 1}
+
+
+def test_stalled_thread_in_a_shared_browser_is_cancelled_without_killing_chrome(monkeypatch):
+    browser = new_shared_browser(monkeypatch, 100)
+    watchdog = MemoryWatchdog()
+    monkeypatch.setattr(watchdog, "start", lambda: None)
+    watchdog.register("alice", browser.new_context("alice"))
+    watchdog.register("carol", FakeChrome(200))
+    monkeypatch.setattr(supervisor_module, "memory_watchdog", watchdog)
+    monkeypatch.setattr(supervisor_module, "cancel", lambda thread_id, reason: None)
+    all_killed = []
+    monkeypatch.setattr(supervisor_module, "kill_process_tree", lambda all_pids: all_killed.append(all_pids) or 2)
+    supervisor = Supervisor(deadline_secs=None)
+
+    for thread_id, account in ((1, "alice"), (2, "carol")):
+        supervisor.cancel(thread_id, f"thread {thread_id}", {"account": account, "stage": "create", "since": 0},
+                          "stalled")
+
+    assert all_killed == [[200, 201]]
+    assert [each["account"] for each in supervisor.lost] == ["alice", "carol"]
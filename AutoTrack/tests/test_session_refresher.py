@@ -0,0 +1,63 @@
+"""
+Saved sessions: the cookies saved by a bot are loaded back by the next one and read by the session refresher
+"""
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_refresher import get_session_expiry  # noqa: E402
+from utils import load_cookies, save_cookies  # noqa: E402
+
+PLATFORM_URLS = {"soundcloud": "https://soundcloud.com/upload", "suno": "https://app.suno.ai/create"}
+
+
+class InvalidCookieDomain(Exception):
+    """ Raised like selenium's InvalidCookieDomainException """
+
+
+class FakeBrowser:
+    """ Keeps cookies like chrome: a cookie is only accepted on a page of its domain """
+
+    def __init__(self, url, all_cookies=()):
+        self.current_url = url
+        self.cookies = {}
+        for cookie in all_cookies:
+            self.add_cookie(cookie)
+
+    def add_cookie(self, cookie):
+        host = urlsplit(self.current_url).hostname
+        domain = cookie.get("domain", host).lstrip(".")
+        if host != domain and not host.endswith("." + domain):
+            raise InvalidCookieDomain(f"{cookie['name']} of {domain} on {host}")
+        self.cookies[cookie["name"]] = dict(cookie)
+
+    def get_cookies(self):
+        return [dict(cookie) for cookie in self.cookies.values()]
+
+    def refresh(self):
+        pass
+
+
+@pytest.mark.parametrize("platform", ["soundcloud", "suno"])
+def test_saved_session_round_trips(platform, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    url = PLATFORM_URLS[platform]
+    session_cookie = "oauth_token" if platform == "soundcloud" else "__client"
+    expiry = int(time.time()) + 3600
+    browser = FakeBrowser(url, [{"name": session_cookie, "value": "token", "domain": urlsplit(url).hostname,
+                                 "expiry": expiry},
+                                {"name": "other", "value": "1", "domain": urlsplit(url).hostname}])
+
+    save_cookies(browser, platform, "account")
+    new_browser = FakeBrowser(url)
+    assert load_cookies(new_browser, platform, "account")
+
+    assert new_browser.cookies[session_cookie]["value"] == "token"
+    assert set(new_browser.cookies) == {session_cookie, "other"}
+    assert get_session_expiry(platform, "account", cookies_only=True) == expiry
+    assert get_session_expiry(platform, "account") == expiry
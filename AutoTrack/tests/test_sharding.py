@@ -0,0 +1,168 @@
+"""
+Coordinator / worker mode with several worker processes on one machine. The bots are replaced by stub handlers
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sharding  # noqa: E402
+from settings import Settings  # noqa: E402
+from work_queue import QueueClient, QueueServer, WorkQueue  # noqa: E402
+
+# No of secs a worker owns an item without a heartbeat, short so the expired leases are seen quickly
+LEASE_SECS = 1
+# Max no of secs a test waits for the workers
+TEST_TIMEOUT = 60
+
+
+class ShortLeaseQueue(WorkQueue):
+
+    def lease(self, worker_id, kind=None, lease_secs=LEASE_SECS):
+        return super().lease(worker_id, kind, lease_secs)
+
+    def heartbeat(self, item_id, worker_id, lease_secs=LEASE_SECS) -> bool:
+        return super().heartbeat(item_id, worker_id, lease_secs)
+
+
+def echo_job(payload) -> dict:
+    time.sleep(payload.get("secs", 0.1))
+    return {"value": payload["value"], "pid": os.getpid()}
+
+
+def crash_job(payload) -> dict:
+    """ The first worker running the item dies without giving it back """
+    if not os.path.exists(payload["marker"]):
+        open(payload["marker"], "w").close()
+        os._exit(1)
+    return echo_job(payload)
+
+
+def flaky_job(payload) -> dict:
+    """ Fails on the first attempt """
+    if not os.path.exists(payload["marker"]):
+        open(payload["marker"], "w").close()
+        raise RuntimeError("first attempt fails")
+    return echo_job(payload)
+
+
+def broken_job(payload):
+    raise RuntimeError("always fails")
+
+
+STUB_HANDLERS = {"echo": echo_job, "crash": crash_job, "flaky": flaky_job, "broken": broken_job}
+
+
+def _worker_process(port, worker_id):
+    sharding.POLL_INTERVAL = 0.1
+    Settings.WORK_QUEUE_LEASE_SECS = LEASE_SECS
+    sharding.run_worker(QueueClient("127.0.0.1", port), worker_id, STUB_HANDLERS)
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    queue = ShortLeaseQueue(str(tmp_path / "work_queue.sqlite3"))
+    server = QueueServer(queue, "127.0.0.1", 0).start()
+    yield queue, server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def run_workers(queue, port, no_of_workers=3) -> list:
+    """
+    Close the queue and run worker processes until they have nothing left
+    :return: Exit codes of the workers
+    """
+    queue.close_queue()
+    context = multiprocessing.get_context("spawn")
+    all_processes = [context.Process(target=_worker_process, args=(port, f"worker-{i}"))
+                     for i in range(no_of_workers)]
+    for process in all_processes:
+        process.start()
+    for process in all_processes:
+        process.join(TEST_TIMEOUT)
+    for process in all_processes:
+        if process.is_alive():
+            process.kill()
+            pytest.fail(f"{process.name} still running after {TEST_TIMEOUT}s: {queue.counts()}")
+    return [process.exitcode for process in all_processes]
+
+
+def get_attempts(queue, item_id) -> int:
+    return queue._conn.execute("SELECT attempts FROM work_items WHERE id = ?", (item_id,)).fetchone()[0]
+
+
+def test_workers_share_the_items(coordinator):
+    queue, port = coordinator
+    for value in range(12):
+        queue.publish("echo", {"value": value, "secs": 0.3})
+
+    assert run_workers(queue, port) == [0, 0, 0]
+    all_results = queue.results("echo")
+    assert sorted(result["value"] for result in all_results) == list(range(12))
+    assert len({result["pid"] for result in all_results}) > 1
+
+
+def test_item_of_a_dead_worker_is_requeued(coordinator, tmp_path):
+    queue, port = coordinator
+    item_id = queue.publish("crash", {"value": "crash", "marker": str(tmp_path / "crashed")})
+    for value in range(4):
+        queue.publish("echo", {"value": value})
+
+    all_exit_codes = run_workers(queue, port)
+    assert sorted(all_exit_codes) == [0, 0, 1]
+    assert queue.counts() == {"done": 5}
+    assert "crash" in [result["value"] for result in queue.results("crash")]
+    # Leased by the dead worker, then by another one once its lease expired
+    assert get_attempts(queue, item_id) == 2
+
+
+def test_failed_items_are_retried_until_max_attempts(coordinator, tmp_path):
+    queue, port = coordinator
+    flaky_id = queue.publish("flaky", {"value": "flaky", "marker": str(tmp_path / "failed")})
+    broken_id = queue.publish("broken", {})
+
+    assert run_workers(queue, port) == [0, 0, 0]
+    assert queue.counts("flaky") == {"done": 1}
+    assert get_attempts(queue, flaky_id) == 2
+    assert queue.counts("broken") == {"failed": 1}
+    assert get_attempts(queue, broken_id) == Settings.WORK_QUEUE_MAX_ATTEMPTS
+
+
+def test_missing_files_are_downloaded_again(tmp_path, monkeypatch):
+    pytest.importorskip("requests")
+    from sunodownloads.flaky_server import start_flaky_server
+
+    cdn_dir = tmp_path / "cdn"
+    cdn_dir.mkdir()
+    (cdn_dir / "clip-1.mp3").write_bytes(os.urandom(200 * 1024))
+    (cdn_dir / "image_clip-1.png").write_bytes(b"png")
+    server = start_flaky_server(str(cdn_dir))
+    cdn_url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(sharding, "SUNO_AUDIO_URL", cdn_url + "/{clip_id}.mp3")
+    monkeypatch.setattr(sharding, "SUNO_IMAGE_URL", cdn_url + "/image_{clip_id}.png")
+    monkeypatch.setenv("CURRENT_DIR", str(tmp_path / "worker"))
+    local_audio = tmp_path / "local.mp3"
+    local_audio.write_bytes(b"here")
+
+    try:
+        all_tracks = sharding.get_local_tracks([
+            {"account": "a", "title": "Local", "genre": "pop", "audio_path": str(local_audio)},
+            {"account": "a", "title": "Remote", "genre": "pop", "audio_path": "/other/host/Remote.mp3",
+             "clip_id": "clip-1"},
+        ])
+        assert all_tracks[0].audio_path == str(local_audio)
+        assert all_tracks[1].audio_path == str(tmp_path / "worker" / "downloaded_files" / "Remote.mp3")
+        assert open(all_tracks[1].audio_path, "rb").read() == (cdn_dir / "clip-1.mp3").read_bytes()
+        assert (tmp_path / "worker" / "downloaded_files" / "images" / "Remote.png").read_bytes() == b"png"
+
+        with pytest.raises(FileNotFoundError):
+            sharding.get_local_tracks([{"account": "a", "title": "Lost", "genre": "pop",
+                                        "audio_path": "/other/host/Lost.mp3"}])
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,8 +1,7 @@
 import os
 import pickle
 import time
-from datetime import datetime
-import requests
+from datetime import date, datetime
 from settings import Settings
 import re  # import the regular expression module
 
@@ -28,6 +27,24 @@ def parse_prompts() -> list:
     return prompts  # return the list of prompts
 
 
+def get_daily_genre_prompts() -> tuple:
+    """
+    Select the genre of the day and its prompts. Genres are used in turns, one per day of the month.
+    :return: (genre_name, list of prompts for the genre)
+    """
+    # Obtenir la liste des invites quotidiens à utiliser pour chaque genre
+    all_daily_prompts = parse_prompts()
+
+    # Obtenir le nom du genre à utiliser en fonction du jour et du nombre de genres
+    # Utiliser le modulo pour boucler si le jour est supérieur au nombre de genres
+    genre_names = sorted(set(prompt["genre"] for prompt in all_daily_prompts))
+    genre_index = (date.today().day - 1) % len(genre_names)
+    genre_used = genre_names[genre_index]
+
+    # Filtrer la liste des invites par le nom du genre
+    return genre_used, [prompt for prompt in all_daily_prompts if prompt["genre"] == genre_used]
+
+
 def get_available_platform_accounts_v2(account_type) -> list:
     """
     Get all platform credential that are stored on the virtual environment
@@ -57,6 +74,22 @@ def get_available_platform_accounts_v2(account_type) -> list:
     return all_accounts
 
 
+def get_platform_account_token(account_type, username):
+    """
+    Get the API token stored on the virtual environment for an account.
+    The token of the account in <PLATFORM>_USERNAME_<n> is stored in <PLATFORM>_TOKEN_<n>
+
+    :param account_type: (suno, soundcloud)
+    :param username: Account username
+    :return: The token or None if the account has no token
+    """
+    username_key_prefix = account_type.upper() + "_USERNAME_"
+    for key, value in os.environ.items():
+        if key.startswith(username_key_prefix) and value == username:
+            return os.environ.get(account_type.upper() + "_TOKEN_" + key[len(username_key_prefix):])
+    return None
+
+
 def sign_in_with_microsoft(driver, username, password):
     """
         Sign in to Microsoft account using the username and password.
@@ -124,6 +157,8 @@ def download_image(link, image_name):
     if not os.path.exists(images_path):
         os.makedirs(images_path)
 
+    import requests
+
     # Open the image file in write binary mode
     with open(images_path + image_name + ".png", mode="wb") as handle:
         res = requests.get(link, stream=True)
@@ -170,14 +205,14 @@ def delete_downloaded_files():
 def delete_uploaded_files(all_uploads_file_info):
     """
     Deletes all uploaded audios and images
-    @param all_uploads_file_info: List of the suno downloads results
+    @param all_uploads_file_info: List of the suno downloads TrackRecord
     """
     track_dir = "downloaded_files/"
     images_dir = "downloaded_files/images/"
 
     for each in all_uploads_file_info:
-        file_path = track_dir + each['title'] + ".mp3"
-        img_path = images_dir + each['title'] + ".png"
+        file_path = track_dir + each.title + ".mp3"
+        img_path = images_dir + each.title + ".png"
         if os.path.exists(file_path):
             os.remove(os.path.join(os.getcwd(), file_path))
         if os.path.exists(img_path):
@@ -189,6 +224,8 @@ def send_telegram_message(message: str):
     Sends a message to a telegram account
     :param message: Message to send
     """
+    import requests
+
     token = os.getenv('TELEGRAM_TOKEN')
     chat_id = os.getenv('TELEGRAM_CHAT_ID')
     try:
@@ -206,7 +243,7 @@ def send_daily_statistics(no_of_tracks_downloaded: int, no_of_all_suno_accounts:
     :param no_of_tracks_downloaded: Number of all downloaded tracks  info
     :param no_of_all_suno_accounts: Number of all available suno accounts
     :param genre: Genre name used
-    :param result_from_soundcloud: List of all result the soundcloud bot returns
+    :param result_from_soundcloud: List of all UploadResult the soundcloud bot returns
     :return:
     """
     date = datetime.now().date().strftime("%d/%m/%Y")
@@ -221,7 +258,7 @@ def send_daily_statistics(no_of_tracks_downloaded: int, no_of_all_suno_accounts:
     # Créer un dictionnaire qui stocke les résultats par compte SoundCloud
     results_by_account = {}
     for upload_details in result_from_soundcloud:
-        account = upload_details['account']
+        account = upload_details.account
         if account not in results_by_account:
             # Initialiser le dictionnaire pour ce compte
             results_by_account[account] = {
@@ -229,8 +266,8 @@ def send_daily_statistics(no_of_tracks_downloaded: int, no_of_all_suno_accounts:
                 'monetization_count': 0
             }
         # Ajouter les résultats de cette session au dictionnaire
-        results_by_account[account]['upload_count'] += upload_details['upload_count']
-        results_by_account[account]['monetization_count'] += upload_details['monetization_count']
+        results_by_account[account]['upload_count'] += upload_details.upload_count
+        results_by_account[account]['monetization_count'] += upload_details.monetization_count
 
     # Parcourir le dictionnaire pour créer le message Telegram
     for index, (account, results) in enumerate(results_by_account.items(), start=1):
@@ -258,6 +295,14 @@ def scroll_down(driver):
         last_height = new_height
 
 
+def get_cookie_domain(platform) -> str:
+    """
+    :param platform: website name. suno / soundcloud
+    :return: Root domain the cookies of the platform are set on
+    """
+    return ".soundcloud.com" if platform == "soundcloud" else ".suno.ai"
+
+
 def save_cookies(driver, platform, account_id):
     """
     Save the cookies from a website. The cookies will be stored in this format: /cookies/platform/account_id.pkl
@@ -281,8 +326,7 @@ def save_cookies(driver, platform, account_id):
     for cookie in cookies:
         try:
             # Set the domain to the root domain name of the website
-            domain_name = ".soundcloud.com" if platform == "soundcloud" else ".suno.ai"
-            cookie['domain'] = domain_name
+            cookie['domain'] = get_cookie_domain(platform)
             driver.add_cookie(cookie)
         except TypeError:
             pass
@@ -308,7 +352,8 @@ def load_cookies(driver, platform, account_id):
         cookies = pickle.load(open(account_cookie_path, "rb"))
         print(f"Loading cookies for account {platform} account: {account_id}")
         for cookie in cookies:
-            cookie['domain'] = ".suno.ai"
+            # A cookie of another domain is refused by the browser
+            cookie['domain'] = get_cookie_domain(platform)
             driver.add_cookie(cookie)
             print(cookie)
 
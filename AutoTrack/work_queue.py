@@ -0,0 +1,265 @@
+"""
+SQLite backed work queue shared by a coordinator and its workers over a local TCP connection.
+
+Workers lease items, heartbeat while they work on them and report results back.
+An item whose lease expires is put back in the queue and given to another worker first.
+"""
+import json
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+
+from settings import Settings
+
+
+class WorkQueue:
+    """
+    Persisted queue of work items. Every item has a kind (e.g. suno, soundcloud), a JSON payload and a status:
+    pending -> leased -> done. Items failing Settings.WORK_QUEUE_MAX_ATTEMPTS times are marked as failed.
+    """
+
+    def __init__(self, db_path=Settings.WORK_QUEUE_DB):
+        """
+        :param db_path: Path of the SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=Settings.TIMEOUT)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS work_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    last_worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS queue_state (closed INTEGER NOT NULL)")
+
+    def publish(self, kind, payload) -> int:
+        """
+        Add a work item to the queue
+        :param kind: Type of work. Workers use it to select the bot to run
+        :param payload: JSON serializable details of the work
+        :return: The work item id
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute("INSERT INTO work_items (kind, payload) VALUES (?, ?)",
+                                        (kind, json.dumps(payload)))
+            return cursor.lastrowid
+
+    def requeue_expired(self) -> int:
+        """
+        Put back the items whose lease has expired. Items that used all their attempts are marked as failed
+        :return: Number of requeued items
+        """
+        with self._lock, self._conn:
+            now = time.time()
+            self._conn.execute("""
+                UPDATE work_items SET status = 'failed', error = 'Lease expired', worker = NULL
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+            """, (now, Settings.WORK_QUEUE_MAX_ATTEMPTS))
+            cursor = self._conn.execute("""
+                UPDATE work_items SET status = 'pending', worker = NULL
+                WHERE status = 'leased' AND lease_expires < ?
+            """, (now,))
+            return cursor.rowcount
+
+    def lease(self, worker_id, kind=None, lease_secs=Settings.WORK_QUEUE_LEASE_SECS):
+        """
+        Lease the next pending item. Items a worker already failed are given to other workers first.
+        :param worker_id: Unique name of the worker
+        :param kind: Only lease an item of this kind if set
+        :param lease_secs: No of secs the worker owns the item without a heartbeat
+        :return: Dictionary with the item id, kind and payload or None if nothing is pending
+        """
+        self.requeue_expired()
+        with self._lock, self._conn:
+            # Take the database write lock before reading, other processes may lease from the same file
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(f"""
+                SELECT id, kind, payload FROM work_items
+                WHERE status = 'pending' {"AND kind = ?" if kind else ""}
+                ORDER BY IFNULL(last_worker = ?, 0), id LIMIT 1
+            """, (kind, worker_id) if kind else (worker_id,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("""
+                UPDATE work_items SET status = 'leased', worker = ?, last_worker = ?, lease_expires = ?,
+                attempts = attempts + 1 WHERE id = ?
+            """, (worker_id, worker_id, time.time() + lease_secs, row["id"]))
+            return {"id": row["id"], "kind": row["kind"], "payload": json.loads(row["payload"])}
+
+    def heartbeat(self, item_id, worker_id, lease_secs=Settings.WORK_QUEUE_LEASE_SECS) -> bool:
+        """
+        Extend the lease of an item
+        :return: False if the worker does not own the item anymore
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute("""
+                UPDATE work_items SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'
+            """, (time.time() + lease_secs, item_id, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, item_id, worker_id, result) -> bool:
+        """
+        Store the result of a leased item and mark it as done
+        :return: False if the lease was lost and the result has been discarded
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute("""
+                UPDATE work_items SET status = 'done', result = ?, worker = NULL
+                WHERE id = ? AND worker = ? AND status = 'leased'
+            """, (json.dumps(result), item_id, worker_id))
+            return cursor.rowcount == 1
+
+    def fail(self, item_id, worker_id, error) -> bool:
+        """
+        Give back a leased item after an error so it can be retried by another worker
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute("""
+                UPDATE work_items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                error = ?, worker = NULL WHERE id = ? AND worker = ? AND status = 'leased'
+            """, (Settings.WORK_QUEUE_MAX_ATTEMPTS, str(error), item_id, worker_id))
+            return cursor.rowcount == 1
+
+    def counts(self, kind=None) -> dict:
+        """
+        :return: Number of items per status
+        """
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT status, COUNT(*) AS n FROM work_items {"WHERE kind = ?" if kind else ""} GROUP BY status
+            """, (kind,) if kind else ()).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def payloads(self, kind=None, status="pending") -> list:
+        """
+        :return: The payloads of the items in a status
+        """
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT payload FROM work_items WHERE status = ? {"AND kind = ?" if kind else ""} ORDER BY id
+            """, (status, kind) if kind else (status,)).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
+
+    def is_finished(self, kind=None) -> bool:
+        """
+        :return: True when no item is pending or leased
+        """
+        self.requeue_expired()
+        counts = self.counts(kind)
+        return not counts.get("pending") and not counts.get("leased")
+
+    def close_queue(self):
+        """ Tell the workers no more work items will be published """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO queue_state (closed) VALUES (1)")
+
+    def is_closed(self) -> bool:
+        """
+        :return: True when the queue is closed and every item is done or failed. Workers can then stop
+        """
+        with self._lock:
+            closed = self._conn.execute("SELECT COUNT(*) FROM queue_state").fetchone()[0]
+        return bool(closed) and self.is_finished()
+
+    def results(self, kind=None) -> list:
+        """
+        :return: The results of all done items
+        """
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT result FROM work_items WHERE status = 'done' {"AND kind = ?" if kind else ""} ORDER BY id
+            """, (kind,) if kind else ()).fetchall()
+        return [json.loads(row["result"]) for row in rows]
+
+
+# Queue methods the TCP server exposes to the workers
+QUEUE_METHODS = ("publish", "lease", "heartbeat", "complete", "fail", "counts", "is_finished", "is_closed", "results")
+
+
+class _QueueRequestHandler(socketserver.StreamRequestHandler):
+    """ Handles one JSON request per line: {"method": ..., "kwargs": {...}} """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request["method"] not in QUEUE_METHODS:
+                    raise ValueError(f"Unknown method {request['method']}")
+                response = {"result": getattr(self.server.queue, request["method"])(**request.get("kwargs", {}))}
+            except Exception as e:
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    """ Serves a WorkQueue to the workers over TCP """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, queue, host=Settings.WORK_QUEUE_HOST, port=Settings.WORK_QUEUE_PORT):
+        self.queue = queue
+        super().__init__((host, port), _QueueRequestHandler)
+
+    def start(self):
+        """ Serve in a background thread """
+        threading.Thread(target=self.serve_forever, name="Work queue server", daemon=True).start()
+        return self
+
+
+class QueueClient:
+    """
+    Worker side of the queue. Exposes the same methods as WorkQueue, called over TCP
+    """
+
+    def __init__(self, host=Settings.WORK_QUEUE_HOST, port=Settings.WORK_QUEUE_PORT):
+        self.address = (host, port)
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def _call(self, method, **kwargs):
+        with self._lock:
+            # Reconnect once if the coordinator connection was dropped
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = socket.create_connection(self.address, timeout=Settings.TIMEOUT)
+                        self._file = self._sock.makefile("rwb")
+                    self._file.write((json.dumps({"method": method, "kwargs": kwargs}) + "\n").encode())
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("Work queue connection closed")
+                    break
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Work queue {method} failed: {response['error']}")
+        return response["result"]
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = self._file = None
+
+    def __getattr__(self, name):
+        if name not in QUEUE_METHODS:
+            raise AttributeError(name)
+        return lambda **kwargs: self._call(name, **kwargs)